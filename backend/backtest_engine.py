@@ -0,0 +1,498 @@
+#!/usr/bin/env python3
+"""
+Vectorized backtest engine for cached market data series.
+
+Mirrors runBacktest in src/services/backtester.js: the same strategy objects,
+indicator conditions, stop-loss/take-profit rules, trade records and
+performance metrics. Instead of re-checking every condition on every candle,
+each condition is evaluated once as a boolean NumPy array over the whole
+series, and the simulation jumps from entry signal to exit bar.
+
+Differences to the browser version: indicators are computed on the full cached
+series before the last `days` candles are selected (no warm-up gap at the
+start of the window), and RSI/EMA/MACD come from indicator_engine.
+"""
+
+import sys
+import json
+import math
+import time
+import argparse
+from dataclasses import dataclass
+import numpy as np
+
+import indicator_engine
+import market_data_yf as md
+from market_data_yf import print_debug, print_warning, print_error
+
+# --- Konfigurasjon ---
+DEFAULT_INITIAL_CAPITAL = 10000
+DEFAULT_POSITION_SIZE = 10 # Prosent av kapitalen per handel
+ANNUALIZATION_FACTOR = 252 # Som i frontend (antar daglige barer)
+EXIT_SEARCH_WINDOW = 64 # Første vindu ved søk etter exit; dobles til treff
+STOCH_OVERBOUGHT = 80
+STOCH_OVERSOLD = 20
+# ---------------------
+
+LONG = 1
+SHORT = -1
+EXIT_REASONS = ('Stop Loss', 'Take Profit', 'Indicator Exit', 'End of Data')
+EXIT_STOP_LOSS, EXIT_TAKE_PROFIT, EXIT_INDICATOR, EXIT_END_OF_DATA = range(4)
+SIGNAL_LISTS = ('longEntryIndicators', 'longExitIndicators', 'shortEntryIndicators', 'shortExitIndicators')
+
+
+class BacktestError(ValueError):
+    """Raised for invalid strategies or when there is not enough data to backtest"""
+
+
+# --- Indikatorer fra strategien ---
+def indicator_spec(item):
+    """indicator_engine spec for one strategy indicator item (e.g. {'type': 'SMA', 'period': 50} -> 'sma:50')"""
+    kind = item.get('type')
+    if kind in ('SMA', 'EMA', 'RSI'):
+        default = 14 if kind == 'RSI' else 20
+        return f"{kind.lower()}:{item.get('period') or default}"
+    if kind == 'MACD':
+        return f"macd:{item.get('fastPeriod') or 12}:{item.get('slowPeriod') or 26}:{item.get('signalPeriod') or 9}"
+    if kind == 'BB':
+        return f"bb:{item.get('period') or 20}:{item.get('stdDev') or 2}"
+    if kind == 'Stoch':
+        return f"stoch:{item.get('kPeriod') or 14}:{item.get('dPeriod') or 3}:{item.get('smoothing') or 3}"
+    return None
+
+def strategy_indicator_specs(strategy):
+    """Unique indicator specs used by the strategy's condition lists"""
+    specs = []
+    for list_name in SIGNAL_LISTS:
+        for item in strategy.get(list_name) or []:
+            spec = indicator_spec(item)
+            if spec is not None and spec not in specs:
+                specs.append(spec)
+    return specs
+
+
+# --- Betingelser som boolske arrays ---
+def _previous(x):
+    """Values shifted one bar forward (NaN on the first bar)"""
+    out = np.empty(len(x))
+    out[0] = np.nan
+    out[1:] = x[:-1]
+    return out
+
+def _crossed_above(current, level, previous, previous_level):
+    # NaN-sammenligninger er False, som isNumeric-sjekken i frontend
+    return (previous <= previous_level) & (current > level)
+
+def _crossed_below(current, level, previous, previous_level):
+    return (previous >= previous_level) & (current < level)
+
+def condition_mask(item, close, indicators):
+    """Boolean array: does the condition of one strategy item hold on each bar?"""
+    kind, rule = item.get('type'), item.get('condition')
+    spec = indicator_spec(item)
+    if spec is None:
+        print_warning(f"Unsupported indicator type in strategy: {kind}")
+        return np.zeros(len(close), dtype=bool)
+    base = indicator_engine.parse_indicator_spec(spec).base_name
+    prev_close = _previous(close)
+
+    with np.errstate(invalid='ignore'):
+        if kind in ('SMA', 'EMA'):
+            line = indicators[base]
+            rules = {
+                'price_above': lambda: close > line,
+                'price_below': lambda: close < line,
+                'price_cross_above': lambda: _crossed_above(close, line, prev_close, _previous(line)),
+                'price_cross_below': lambda: _crossed_below(close, line, prev_close, _previous(line)),
+            }
+        elif kind == 'RSI':
+            rsi = indicators[base]
+            overbought = 70 if item.get('overbought') is None else item['overbought']
+            oversold = 30 if item.get('oversold') is None else item['oversold']
+            rules = {
+                'above_threshold': lambda: rsi > overbought,
+                'below_threshold': lambda: rsi < oversold,
+                'cross_above_threshold': lambda: _crossed_above(rsi, overbought, _previous(rsi), overbought),
+                'cross_below_threshold': lambda: _crossed_below(rsi, oversold, _previous(rsi), oversold),
+            }
+        elif kind == 'MACD':
+            macd, signal = indicators[base], indicators[f"{base}_signal"]
+            rules = {
+                'cross_above_signal': lambda: _crossed_above(macd, signal, _previous(macd), _previous(signal)),
+                'cross_below_signal': lambda: _crossed_below(macd, signal, _previous(macd), _previous(signal)),
+                'above_zero': lambda: macd > 0,
+                'below_zero': lambda: macd < 0,
+                'cross_above_zero': lambda: _crossed_above(macd, 0.0, _previous(macd), 0.0),
+                'cross_below_zero': lambda: _crossed_below(macd, 0.0, _previous(macd), 0.0),
+            }
+        elif kind == 'BB':
+            upper, lower = indicators[f"{base}_upper"], indicators[f"{base}_lower"]
+            rules = {
+                'price_above_upper': lambda: close > upper,
+                'price_below_lower': lambda: close < lower,
+                'price_cross_upper': lambda: _crossed_above(close, upper, prev_close, _previous(upper)),
+                'price_cross_lower': lambda: _crossed_below(close, lower, prev_close, _previous(lower)),
+            }
+        else: # Stoch
+            k, d = indicators[f"{base}_k"], indicators[f"{base}_d"]
+            rules = {
+                'k_cross_above_d': lambda: _crossed_above(k, d, _previous(k), _previous(d)),
+                'k_cross_below_d': lambda: _crossed_below(k, d, _previous(k), _previous(d)),
+                'k_above_d': lambda: k > d,
+                'k_below_d': lambda: k < d,
+                'k_above_threshold': lambda: k > STOCH_OVERBOUGHT,
+                'k_below_threshold': lambda: k < STOCH_OVERSOLD,
+                'k_cross_above_threshold': lambda: _crossed_above(k, STOCH_OVERBOUGHT, _previous(k), STOCH_OVERBOUGHT),
+                'k_cross_below_threshold': lambda: _crossed_below(k, STOCH_OVERSOLD, _previous(k), STOCH_OVERSOLD),
+            }
+        if rule not in rules:
+            print_warning(f"Unsupported {kind} condition: {rule}")
+            return np.zeros(len(close), dtype=bool)
+        return np.asarray(rules[rule](), dtype=bool)
+
+def _cached_condition_mask(item, close, indicators, mask_cache):
+    if mask_cache is None:
+        return condition_mask(item, close, indicators)
+    key = (indicator_spec(item), item.get('condition'), item.get('overbought'), item.get('oversold'))
+    if key not in mask_cache:
+        mask_cache[key] = condition_mask(item, close, indicators)
+    return mask_cache[key]
+
+def signal_mask(items, close, indicators, use_or=False, mask_cache=None):
+    """
+    Combine the conditions of a list: AND for entries, OR for exits. An empty list never signals.
+    mask_cache (dict) reuses condition masks between strategies evaluated on the same arrays.
+    """
+    if not items:
+        return np.zeros(len(close), dtype=bool)
+    masks = [_cached_condition_mask(item, close, indicators, mask_cache) for item in items]
+    combined = np.logical_or.reduce(masks) if use_or else np.logical_and.reduce(masks)
+    combined[0] = False # Simuleringen starter på bar 1 (trenger forrige bar)
+    return combined
+
+def build_signals(strategy, close, indicators, mask_cache=None):
+    """Entry direction per bar (LONG/SHORT/0, long has priority) and exit masks per direction"""
+    n = len(close)
+    no_signal = np.zeros(n, dtype=bool)
+    long_enabled, short_enabled = bool(strategy.get('longEnabled')), bool(strategy.get('shortEnabled'))
+
+    def combined(list_name, enabled, use_or=False):
+        if not enabled:
+            return no_signal
+        return signal_mask(strategy.get(list_name), close, indicators, use_or=use_or, mask_cache=mask_cache)
+
+    long_entry = combined('longEntryIndicators', long_enabled)
+    short_entry = combined('shortEntryIndicators', short_enabled)
+    entry = np.where(long_entry, LONG, np.where(short_entry, SHORT, 0)).astype(np.int8)
+    exits = {
+        LONG: combined('longExitIndicators', long_enabled, use_or=True),
+        SHORT: combined('shortExitIndicators', short_enabled, use_or=True),
+    }
+    return entry, exits
+
+
+# --- Simulering ---
+@dataclass
+class SimulationResult:
+    direction: np.ndarray
+    entry_index: np.ndarray
+    exit_index: np.ndarray
+    entry_price: np.ndarray
+    exit_price: np.ndarray
+    shares: np.ndarray
+    entry_value: np.ndarray
+    profit: np.ndarray
+    reason: np.ndarray
+    equity: np.ndarray # Realisert kapital etter hver bar
+
+    @property
+    def trade_count(self):
+        return len(self.profit)
+
+def _next_true(mask):
+    """For each bar, the index of the first True at or after it (len(mask) if there is none)"""
+    n = len(mask)
+    index = np.where(mask, np.arange(n), n)
+    return np.minimum.accumulate(index[::-1])[::-1]
+
+def _find_exit(direction, entry_price, start, high, low, next_signal, stop_loss, take_profit):
+    """First bar >= start that closes the position, as (index, price, reason), or None"""
+    n = len(high)
+    signal_at = int(next_signal[start])
+    if stop_loss > 0 or take_profit > 0:
+        stop_price = entry_price * (1 - direction * stop_loss)
+        target_price = entry_price * (1 + direction * take_profit)
+        sl_source, tp_source = (low, high) if direction == LONG else (high, low)
+        window = EXIT_SEARCH_WINDOW
+        # Stop loss / take profit søkes kun frem til neste indikator-exit (samme bar: SL/TP vinner)
+        last = min(signal_at, n - 1)
+        while start <= last:
+            stop = min(last + 1, start + window)
+            sl_hit = direction * (sl_source[start:stop] - stop_price) <= 0 if stop_loss > 0 else None
+            tp_hit = direction * (tp_source[start:stop] - target_price) >= 0 if take_profit > 0 else None
+            hits = sl_hit if tp_hit is None else (tp_hit if sl_hit is None else sl_hit | tp_hit)
+            offset = int(hits.argmax())
+            if hits[offset]:
+                # Samme prioritet som frontend: stop loss, take profit, indikator
+                if sl_hit is not None and sl_hit[offset]:
+                    return start + offset, stop_price, EXIT_STOP_LOSS
+                return start + offset, target_price, EXIT_TAKE_PROFIT
+            start = stop
+            window *= 2
+    if signal_at < n:
+        return signal_at, None, EXIT_INDICATOR
+    return None
+
+def simulate(close, high, low, entry, exits, initial_capital=DEFAULT_INITIAL_CAPITAL,
+             position_size=DEFAULT_POSITION_SIZE, stop_loss=0, take_profit=0):
+    """
+    Run the position simulation on precomputed signals (see build_signals).
+    stop_loss / take_profit / position_size are percentages, as in the strategy object.
+    Work is proportional to the number of trades, not the number of bars.
+    """
+    n = len(close)
+    stop_loss, take_profit = (stop_loss or 0) / 100.0, (take_profit or 0) / 100.0
+    size = (position_size or DEFAULT_POSITION_SIZE) / 100.0
+    if size <= 0:
+        raise BacktestError("Invalid Position Size configuration (must be > 0%).")
+    if initial_capital <= 0:
+        raise BacktestError("Invalid Initial Capital configuration (must be > 0).")
+
+    next_entry = _next_true(entry != 0)
+    next_exit = {direction: _next_true(mask) for direction, mask in exits.items()}
+    records = []
+    capital = float(initial_capital)
+    position = 1
+    while True:
+        i = int(next_entry[position])
+        # En posisjon åpnet på siste bar lukkes aldri (som i frontend)
+        if i >= n - 1 or capital <= 0:
+            break
+        direction = int(entry[i])
+        entry_price = float(close[i])
+        entry_value = capital * size
+        shares = entry_value / entry_price
+        found = _find_exit(direction, entry_price, i + 1, high, low, next_exit[direction], stop_loss, take_profit)
+        if found is None:
+            j, exit_price, reason = n - 1, None, EXIT_END_OF_DATA
+        else:
+            j, exit_price, reason = found
+        if exit_price is None:
+            exit_price = float(close[j])
+        profit = (exit_price - entry_price) * shares * direction
+        capital += profit
+        records.append((direction, i, j, entry_price, exit_price, shares, entry_value, profit, reason))
+        position = j # Ny inngang er tillatt på samme bar som exit
+
+    columns = list(zip(*records)) if records else [()] * 9
+    exit_index = np.array(columns[2], dtype=np.int64)
+    profit = np.array(columns[7], dtype=np.float64)
+    pnl = np.zeros(n)
+    np.add.at(pnl, exit_index, profit)
+    return SimulationResult(
+        direction=np.array(columns[0], dtype=np.int8),
+        entry_index=np.array(columns[1], dtype=np.int64),
+        exit_index=exit_index,
+        entry_price=np.array(columns[3], dtype=np.float64),
+        exit_price=np.array(columns[4], dtype=np.float64),
+        shares=np.array(columns[5], dtype=np.float64),
+        entry_value=np.array(columns[6], dtype=np.float64),
+        profit=profit,
+        reason=np.array(columns[8], dtype=np.int8),
+        equity=initial_capital + np.cumsum(pnl),
+    )
+
+
+# --- Nøkkeltall ---
+def _round2(values):
+    """Round to cents, like JS parseFloat(x.toFixed(2))"""
+    return np.round(values, 2)
+
+def performance_metrics(result, initial_capital, candles):
+    """
+    Numeric version of calculatePerformanceMetrics (per-trade profits rounded to cents first).
+    Ratios that are undefined in the frontend ('N/A') are NaN; profitFactor is inf without losses.
+    """
+    equity = result.equity
+    final_capital = float(equity[-1]) if len(equity) else float(initial_capital)
+    total = result.trade_count
+    if total == 0:
+        return {'totalTrades': 0, 'winningTrades': 0, 'losingTrades': 0, 'winRate': 0.0,
+                'grossProfit': 0.0, 'grossLoss': 0.0, 'profitFactor': math.nan, 'netProfit': 0.0,
+                'maxDrawdown': 0.0, 'sharpeRatio': math.nan, 'finalCapital': float(initial_capital)}
+
+    profit = _round2(result.profit)
+    winning = int((profit > 0).sum())
+    gross_profit = float(profit[profit > 0].sum())
+    gross_loss = float(-profit[profit < 0].sum())
+    if gross_loss > 0:
+        profit_factor = gross_profit / gross_loss
+    else:
+        profit_factor = math.inf if gross_profit > 0 else math.nan
+
+    peak = np.maximum.accumulate(np.maximum(equity, initial_capital))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        drawdown = np.where(peak > 0, (peak - equity) / peak * 100, 0.0)
+    max_drawdown = max(0.0, float(drawdown.max()))
+
+    sharpe = math.nan
+    if total > 1:
+        entry_value = _round2(result.entry_value)
+        returns = np.where(entry_value > 0, profit / np.where(entry_value > 0, entry_value, 1.0), 0.0)
+        std = float(returns.std(ddof=1))
+        trades_per_year = total / (candles / ANNUALIZATION_FACTOR)
+        annualized_std = std * math.sqrt(trades_per_year)
+        if annualized_std > 0:
+            sharpe = float(returns.mean()) * trades_per_year / annualized_std
+
+    return {'totalTrades': total, 'winningTrades': winning, 'losingTrades': total - winning,
+            'winRate': winning / total * 100, 'grossProfit': gross_profit, 'grossLoss': gross_loss,
+            'profitFactor': profit_factor, 'netProfit': gross_profit - gross_loss,
+            'maxDrawdown': max_drawdown, 'sharpeRatio': sharpe, 'finalCapital': final_capital}
+
+def format_metrics(metrics):
+    """Format numeric metrics the way calculatePerformanceMetrics returns them (fixed-point strings)"""
+    if metrics['totalTrades'] == 0:
+        out = {key: f"{value:.2f}" for key, value in metrics.items()
+               if key in ('winRate', 'grossProfit', 'grossLoss', 'netProfit', 'maxDrawdown')}
+        out.update(totalTrades=0, winningTrades=0, losingTrades=0, profitFactor='N/A',
+                   sharpeRatio='N/A', finalCapital=metrics['finalCapital'])
+        return out
+
+    def fixed(value):
+        if math.isnan(value):
+            return 'N/A'
+        return 'Infinity' if math.isinf(value) else f"{value:.2f}"
+
+    out = {key: fixed(value) for key, value in metrics.items()}
+    out.update(totalTrades=metrics['totalTrades'], winningTrades=metrics['winningTrades'],
+               losingTrades=metrics['losingTrades'])
+    return out
+
+
+# --- Offentlig API ---
+def backtest_arrays(strategy, prices, indicators=None, mask_cache=None):
+    """
+    Backtest on plain arrays: prices = {'close', 'high', 'low'} (NumPy arrays),
+    indicators = {column_name: array} as produced by indicator_engine.
+    Missing indicator columns are computed from the prices. Returns a SimulationResult.
+    """
+    close = np.asarray(prices['close'], dtype=np.float64)
+    if len(close) < 2:
+        raise BacktestError("Insufficient market data provided for backtesting (need at least 2 data points).")
+    indicators = dict(indicators or {})
+    missing = [spec for spec in strategy_indicator_specs(strategy)
+               if not all(col in indicators for col in indicator_engine.output_columns(spec))]
+    if missing:
+        indicators.update(indicator_engine.compute_indicators(indicator_engine.IndicatorContext(prices), missing))
+    entry, exits = build_signals(strategy, close, indicators, mask_cache=mask_cache)
+    return simulate(close, np.asarray(prices['high'], dtype=np.float64), np.asarray(prices['low'], dtype=np.float64),
+                    entry, exits,
+                    initial_capital=strategy.get('initialCapital') or DEFAULT_INITIAL_CAPITAL,
+                    position_size=strategy.get('positionSize') or DEFAULT_POSITION_SIZE,
+                    stop_loss=strategy.get('stopLoss'), take_profit=strategy.get('takeProfit'))
+
+def _trade_records(result, dates):
+    records = []
+    for t in range(result.trade_count):
+        i, j = int(result.entry_index[t]), int(result.exit_index[t])
+        records.append({
+            'id': t + 1,
+            'type': 'LONG' if result.direction[t] == LONG else 'SHORT',
+            'entry': round(float(result.entry_price[t]), 4),
+            'exit': round(float(result.exit_price[t]), 4),
+            'entryDate': dates[i],
+            'exitDate': dates[j],
+            'entryIndex': i,
+            'exitIndex': j,
+            'profit': round(float(result.profit[t]), 2),
+            'duration': j - i,
+            'entryValue': round(float(result.entry_value[t]), 2),
+            'exitReason': EXIT_REASONS[result.reason[t]],
+            'positionSizeShares': round(float(result.shares[t]), 6),
+        })
+    return records
+
+def run_backtest(strategy, symbol, timeframe_id='1d', days=None, compact_equity=False):
+    """
+    Backtest a strategy (frontend strategy object) on the cached series of symbol/timeframe.
+    `days` limits the run to the last N candles. With compact_equity the equity curve
+    only contains the bars where it changes (plus first and last bar).
+    Returns the same shape as runBacktest in src/services/backtester.js.
+    """
+    if not strategy:
+        raise BacktestError("Strategy configuration is missing.")
+    started = time.perf_counter()
+    frame = md.get_market_frame(symbol, timeframe_id)
+    if frame is None or frame.empty:
+        raise BacktestError(f"No data available for {symbol} ({timeframe_id})")
+    specs = strategy_indicator_specs(strategy)
+    indicator_frame = md.get_market_indicators(symbol, timeframe_id, specs) if specs else None
+
+    start = max(0, len(frame) - int(days)) if days else 0
+    prices = {col: frame[col].to_numpy(dtype=np.float64)[start:] for col in ('open', 'high', 'low', 'close')}
+    indicators = {}
+    if indicator_frame is not None:
+        indicators = {col: indicator_frame[col].to_numpy()[start:] for col in indicator_frame.columns if col != 'date'}
+    result = backtest_arrays(strategy, prices, indicators)
+    simulated = time.perf_counter()
+
+    initial_capital = strategy.get('initialCapital') or DEFAULT_INITIAL_CAPITAL
+    candles = len(prices['close'])
+    dates = frame['date'].iloc[start:].reset_index(drop=True)
+    date_only = md.is_date_only(dates)
+    if compact_equity:
+        changed = np.flatnonzero(np.diff(result.equity) != 0) + 1
+        points = np.unique(np.concatenate(([0], changed, [candles - 1])))
+    else:
+        points = np.arange(candles)
+    trade_bars = np.concatenate((result.entry_index, result.exit_index))
+    needed = np.unique(np.concatenate((points, trade_bars)))
+    labels = dict(zip(needed.tolist(), md.format_dates(dates.iloc[needed], date_only)))
+
+    metrics = format_metrics(performance_metrics(result, initial_capital, candles))
+    metrics['equityData'] = [{'date': labels[i], 'equity': float(result.equity[i])} for i in points.tolist()]
+    print_debug("Backtest %s (%s): %d candles, %d trades, simulated in %.1f ms.",
+                symbol, timeframe_id, candles, result.trade_count, (simulated - started) * 1000)
+    return {
+        **metrics,
+        'trades': _trade_records(result, labels),
+        'initialCapital': initial_capital,
+        'strategyName': strategy.get('name') or 'Unnamed Strategy',
+        'symbol': symbol,
+        'timeframe': timeframe_id,
+        'startDate': labels[0],
+        'endDate': labels[candles - 1],
+        'candlesProcessed': candles,
+    }
+
+
+# --- Hovedlogikk for å håndtere argumenter ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Backtest a strategy (JSON, same shape as the frontend strategy) on cached market data.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+        )
+    parser.add_argument('--strategy', type=str, required=True, help="Path to a strategy JSON file ('-' = stdin).")
+    parser.add_argument('--symbol', type=str, required=True, help='Trading symbol (e.g., AAPL)')
+    parser.add_argument('--timeframe', type=str, default='1d', help='Timeframe ID (e.g., 1h, 1d, 1wk, 1mo)')
+    parser.add_argument('--days', type=int, default=None, help='Only backtest the last N candles.')
+    parser.add_argument('--compact-equity', action='store_true', help='Only emit equity points where the equity changes.')
+    parser.add_argument('--summary', action='store_true', help='Print the metrics only (no trades/equity curve).')
+    args = parser.parse_args()
+
+    try:
+        with (sys.stdin if args.strategy == '-' else open(args.strategy, encoding='utf-8')) as f:
+            strategy = json.load(f)
+        # Stdout er reservert for JSON-resultatet
+        sys.stdout = sys.stderr
+        result = run_backtest(strategy, args.symbol, args.timeframe, days=args.days,
+                              compact_equity=args.compact_equity)
+        sys.stdout = sys.__stdout__
+        if args.summary:
+            result = {k: v for k, v in result.items() if k not in ('trades', 'equityData')}
+        print(json.dumps(result, indent=2))
+    except (BacktestError, OSError, ValueError) as e:
+        sys.stdout = sys.__stdout__
+        print_error(f"Backtest failed: {e}")
+        sys.exit(1)
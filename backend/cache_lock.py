@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Locking helpers for the market data cache.
+
+- SingleFlight: concurrent calls for the same key inside one process share
+  one execution and its result (or exception).
+- FileLock: exclusive per-key lock that also works across processes
+  (fcntl.flock on POSIX, msvcrt.locking on Windows), so spawned scripts and
+  the serve worker do not download/write the same cache file at once.
+- atomic_write: write a file through a temp file in the same directory and
+  os.replace it into place, so readers never see a half-written file.
+"""
+
+import os
+import time
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+LOCK_DIR_NAME = '.locks'
+LOCK_POLL_SECONDS = 0.05
+
+
+class LockTimeout(TimeoutError):
+    """Raised when a FileLock could not be acquired within the timeout"""
+
+
+class SingleFlight:
+    """Deduplicate concurrent calls per key: one caller runs fn, the others wait and share the result"""
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """Run fn() once for all concurrent callers with the same key. Returns (result, shared)."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+
+class FileLock:
+    """
+    Exclusive lock on `<directory>/.locks/<name>.lock`, usable as a context manager.
+    Blocks until acquired (or raises LockTimeout after `timeout` seconds).
+    """
+
+    def __init__(self, directory, name, timeout=None):
+        self.path = os.path.join(directory, LOCK_DIR_NAME, f"{name}.lock")
+        self.timeout = timeout
+        self._fd = None
+
+    def acquire(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        try:
+            while True:
+                try:
+                    if fcntl is not None:
+                        fcntl.flock(fd, fcntl.LOCK_EX | (fcntl.LOCK_NB if deadline else 0))
+                    else:
+                        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        raise LockTimeout(f"Timed out waiting for lock {self.path}")
+                    time.sleep(LOCK_POLL_SECONDS)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+        return self
+
+    def release(self):
+        if self._fd is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+def atomic_write(path, write, suffix='.tmp'):
+    """
+    Call write(tmp_path) and move the result to path with os.replace.
+    The temp file is removed if writing fails.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp_', suffix=suffix)
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Cache warm-up / prefetch scheduler for the market data cache.
+Refreshes symbol/timeframe caches ahead of CACHE_HOURS expiry so that
+downloads happen off the request path. Entries are ordered by staleness
+and popularity (access_stats.json), grouped into batched downloads, and
+sent to Yahoo through a token-bucket rate limit.
+"""
+
+import os
+import sys
+import math
+import time
+import argparse
+import threading
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import market_data_yf as md
+from market_data_yf import print_debug, print_info, print_warning, print_error
+
+# --- Konfigurasjon ---
+DEFAULT_CONCURRENCY = 2
+DEFAULT_RATE_PER_SECOND = 1.0 # Tickere per sekund mot Yahoo
+DEFAULT_BURST = 5
+DEFAULT_BATCH_SIZE = 10
+DEFAULT_REFRESH_AHEAD = 0.8 # Oppdater når cachen har nådd 80 % av CACHE_HOURS
+DEFAULT_LOOP_MINUTES = 30
+MISSING_STALENESS = 10.0 # Manglende cache prioriteres som "10x utdatert"
+# ---------------------
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, at most `burst` stored"""
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(max(burst, 1))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """
+        Block until `tokens` tokens are available and take them. Requests above burst
+        wait for a full bucket and leave it in debt, so the long-run rate still holds.
+        """
+        tokens = float(tokens)
+        needed = min(tokens, self.burst)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= needed:
+                    self._tokens -= tokens # Kan bli negativ: gjelden betales ned før neste uttak
+                    return
+                wait = (needed - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+@dataclass
+class WarmupJob:
+    symbol: str
+    timeframe_id: str
+    yf_interval: str
+    age_hours: float # math.inf hvis cachen mangler
+    hits: int
+    priority: float
+
+
+def cache_age_hours(cache_file):
+    try:
+        return (time.time() - os.path.getmtime(cache_file)) / 3600.0
+    except OSError:
+        return math.inf
+
+def plan_warmup(symbols, timeframes, refresh_ahead=DEFAULT_REFRESH_AHEAD, include_popular=True):
+    """
+    Build the list of caches due for refresh, highest priority first.
+    Priority = staleness (age / CACHE_HOURS) weighted by log popularity.
+    Symbols seen in access stats are included when include_popular is set.
+    """
+    access_stats = md.load_access_stats()
+    pairs = {(symbol, tf) for symbol in symbols for tf in timeframes}
+    if include_popular:
+        interval_to_tf = {tf['yf_interval']: tf['id'] for tf in md.AVAILABLE_TIMEFRAMES}
+        for (symbol, yf_interval) in access_stats:
+            if yf_interval in interval_to_tf and interval_to_tf[yf_interval] in timeframes:
+                pairs.add((symbol, interval_to_tf[yf_interval]))
+
+    threshold_hours = refresh_ahead * md.CACHE_HOURS
+    jobs = []
+    for symbol, timeframe_id in pairs:
+        yf_interval = md.map_timeframe_id_to_yf_interval(timeframe_id)
+        age = cache_age_hours(md.get_cache_file_path(symbol, yf_interval))
+        if age < threshold_hours:
+            continue
+        hits = access_stats.get((symbol, yf_interval), {}).get('hits', 0)
+        staleness = MISSING_STALENESS if math.isinf(age) else age / md.CACHE_HOURS
+        jobs.append(WarmupJob(symbol, timeframe_id, yf_interval, age, hits,
+                              staleness * (1.0 + math.log1p(hits))))
+    jobs.sort(key=lambda job: job.priority, reverse=True)
+    return jobs
+
+def _batches(jobs, batch_size):
+    """Group jobs by interval into batches, keeping priority order within each interval"""
+    by_interval = {}
+    for job in jobs:
+        by_interval.setdefault(job.timeframe_id, []).append(job)
+    batches = []
+    for interval_jobs in by_interval.values():
+        for i in range(0, len(interval_jobs), batch_size):
+            batches.append(interval_jobs[i:i + batch_size])
+    # Høyeste prioritet i batchen bestemmer rekkefølgen
+    batches.sort(key=lambda batch: batch[0].priority, reverse=True)
+    return batches
+
+def run_warmup(jobs, concurrency=DEFAULT_CONCURRENCY, rate=DEFAULT_RATE_PER_SECOND,
+               burst=DEFAULT_BURST, batch_size=DEFAULT_BATCH_SIZE, refresh_ahead=DEFAULT_REFRESH_AHEAD):
+    """Refresh the planned jobs on a thread pool. Returns {(symbol, timeframe_id): cache_file or None}."""
+    if not jobs:
+        print_info("Warm-up: all caches are fresh, nothing to do.")
+        return {}
+    bucket = TokenBucket(rate, burst)
+    max_age_hours = refresh_ahead * md.CACHE_HOURS
+    batches = _batches(jobs, max(1, batch_size))
+    print_info(f"Warm-up: refreshing {len(jobs)} caches in {len(batches)} batches "
+               f"(concurrency={concurrency}, rate={rate}/s, burst={burst}).")
+
+    def run_batch(batch):
+        bucket.acquire(len(batch)) # Én token per ticker mot Yahoo
+        timeframe_id = batch[0].timeframe_id
+        symbols = [job.symbol for job in batch]
+        print_debug("Warm-up batch %s: %s", timeframe_id, symbols)
+        return timeframe_id, md.fetch_market_data_batch(symbols, timeframe_id, max_age_hours=max_age_hours)
+
+    results = {}
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='md-warmup') as pool:
+        futures = {pool.submit(run_batch, batch): batch for batch in batches}
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                timeframe_id, batch_results = future.result()
+            except Exception as e:
+                print_error(f"Warm-up batch failed ({batch[0].timeframe_id}): {e}", include_traceback=True)
+                timeframe_id, batch_results = batch[0].timeframe_id, {}
+            for job in batch:
+                results[(job.symbol, timeframe_id)] = batch_results.get(job.symbol)
+    refreshed = sum(1 for cache_file in results.values() if cache_file)
+    print_info(f"Warm-up finished: {refreshed}/{len(jobs)} caches available in {time.time() - started:.1f}s.")
+    return results
+
+def warm_cache(symbols, timeframes, **options):
+    """Plan and run one warm-up pass"""
+    refresh_ahead = options.get('refresh_ahead', DEFAULT_REFRESH_AHEAD)
+    jobs = plan_warmup(symbols, timeframes, refresh_ahead=refresh_ahead,
+                       include_popular=options.pop('include_popular', True))
+    return run_warmup(jobs, **options)
+
+def run_periodic(symbols, timeframes, every_minutes=DEFAULT_LOOP_MINUTES, stop_event=None, **options):
+    """Run warm-up passes every `every_minutes` until stop_event is set"""
+    stop_event = stop_event or threading.Event()
+    while not stop_event.is_set():
+        try:
+            warm_cache(symbols, timeframes, **dict(options))
+        except Exception as e:
+            print_error(f"Warm-up pass failed: {e}", include_traceback=True)
+        stop_event.wait(every_minutes * 60)
+
+def start_background_refresher(symbols, timeframes, every_minutes=DEFAULT_LOOP_MINUTES, **options):
+    """Start run_periodic in a daemon thread. Returns the stop event."""
+    stop_event = threading.Event()
+    thread = threading.Thread(target=run_periodic, args=(symbols, timeframes, every_minutes, stop_event),
+                              kwargs=options, name='md-refresher', daemon=True)
+    thread.start()
+    return stop_event
+
+
+# --- Hovedlogikk for å håndtere argumenter ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Pre-populate / refresh the market data cache ahead of expiry.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+        )
+    parser.add_argument('--symbols', type=str, default='default', help="Comma-separated symbols ('default' = DEFAULT_SYMBOLS).")
+    parser.add_argument('--timeframes', type=str, default='all', help="Comma-separated timeframe IDs ('all' = AVAILABLE_TIMEFRAMES).")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help='Number of batches processed in parallel.')
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE_PER_SECOND, help='Ticker downloads per second toward Yahoo (token bucket rate).')
+    parser.add_argument('--burst', type=int, default=DEFAULT_BURST, help='Token bucket size.')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Symbols per grouped download.')
+    parser.add_argument('--refresh-ahead', type=float, default=DEFAULT_REFRESH_AHEAD, help='Refresh caches older than this fraction of CACHE_HOURS.')
+    parser.add_argument('--no-popular', action='store_true', help='Do not add symbols from access stats.')
+    parser.add_argument('--loop', action='store_true', help='Keep running as a periodic background refresher.')
+    parser.add_argument('--every', type=float, default=DEFAULT_LOOP_MINUTES, help='Minutes between passes with --loop.')
+    args = parser.parse_args()
+
+    symbols = md.resolve_symbol_list(args.symbols)
+    timeframes = md.resolve_timeframe_list(args.timeframes)
+    options = dict(concurrency=args.concurrency, rate=args.rate, burst=args.burst,
+                   batch_size=args.batch_size, refresh_ahead=args.refresh_ahead,
+                   include_popular=not args.no_popular)
+    try:
+        if args.loop:
+            run_periodic(symbols, timeframes, every_minutes=args.every, **options)
+        else:
+            results = warm_cache(symbols, timeframes, **options)
+            if any(cache_file is None for cache_file in results.values()):
+                print_warning("Some caches could not be refreshed.")
+                sys.exit(1)
+    except KeyboardInterrupt:
+        print_info("Warm-up interrupted.")
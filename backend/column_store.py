@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+Columnar binary cache format for market data series.
+
+File layout ("TSCOL1"):
+  - a fixed 4096 byte header: 8 byte magic, uint32 JSON length, JSON metadata
+    (row count, capacity, column names/dtypes, timezone and free-form attrs)
+  - one fixed-width little-endian block per column, each `capacity` rows long
+
+Every column is preallocated to `capacity` rows, so appending bars writes into
+the existing blocks (past the committed rows) and then commits the new row count
+in the header. Changing committed rows always rewrites the file atomically.
+A ColumnStore reader maps the file once, so it keeps reading one consistent
+version: a replaced file does not affect it and in-place appends stay beyond
+its row count. A header that changes while being read is re-read.
+Reads memory-map only the requested rows, without any text parsing.
+The 'date' column is stored as int64 milliseconds since the epoch (UTC).
+
+Frame layout ("TSRF1", for streaming slices over the wire):
+  - 8 byte magic, uint32 JSON length, uint32 body length, JSON metadata
+    (rows, tz, attrs and each column's name/dtype/offset into the body)
+  - the body: each column's `rows` values back to back, padded to 8 bytes
+Frames are self-delimiting, so a stream is just frames written one after another.
+"""
+
+import os
+import json
+import mmap
+import time
+import struct
+import tempfile
+import numpy as np
+import pandas as pd
+
+MAGIC = b'TSCOL1\x00\x00'
+HEADER_SIZE = 4096
+FORMAT_VERSION = 1
+DATE_COLUMN = 'date'
+MIN_CAPACITY = 256
+GROWTH_FACTOR = 1.5 # Ekstra plass ved ny skriving, slik at fremtidige tillegg skjer på stedet
+FRAME_MAGIC = b'TSRF1\x00\x00\x00'
+FRAME_PREFIX_SIZE = 16
+HEADER_READ_ATTEMPTS = 5
+HEADER_RETRY_SECONDS = 0.001
+
+
+class ColumnStoreError(Exception):
+    """Raised when a column store file is missing, corrupt or incompatible"""
+
+
+def _encode_header(header):
+    payload = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    if len(payload) + 12 > HEADER_SIZE:
+        raise ColumnStoreError(f"Header too large ({len(payload)} bytes)")
+    return (MAGIC + struct.pack('<I', len(payload)) + payload).ljust(HEADER_SIZE, b' ')
+
+def _decode_header(raw, path):
+    if len(raw) < 12 or raw[:8] != MAGIC:
+        raise ColumnStoreError(f"Not a column store file: {path}")
+    (length,) = struct.unpack('<I', raw[8:12])
+    try:
+        header = json.loads(raw[12:12 + length].decode('utf-8'))
+    except (UnicodeDecodeError, ValueError) as e:
+        raise ColumnStoreError(f"Corrupt column store header in {path}: {e}") from e
+    if header.get('version') != FORMAT_VERSION:
+        raise ColumnStoreError(f"Unsupported column store version {header.get('version')} in {path}")
+    return header
+
+def _column_offsets(header):
+    """Byte offset of each column block"""
+    offsets = {}
+    position = HEADER_SIZE
+    for col in header['columns']:
+        offsets[col['name']] = position
+        position += header['capacity'] * np.dtype(col['dtype']).itemsize
+    return offsets, position
+
+def _dates_to_ms(dates):
+    """datetime Series (naive = UTC) -> int64 milliseconds since epoch"""
+    dates = pd.to_datetime(dates)
+    if dates.dt.tz is not None:
+        dates = dates.dt.tz_convert('UTC').dt.tz_localize(None)
+    return dates.to_numpy(dtype='datetime64[ms]').astype('<i8')
+
+def _ms_to_dates(values, tz):
+    dates = pd.to_datetime(np.asarray(values, dtype='<i8'), unit='ms')
+    if tz:
+        dates = dates.tz_localize('UTC').tz_convert(tz)
+    return dates
+
+def _frame_to_columns(df):
+    """Split a DataFrame into (column specs, numpy arrays); non-numeric columns are skipped"""
+    specs, arrays = [], []
+    for name in df.columns:
+        series = df[name]
+        if name == DATE_COLUMN:
+            values = _dates_to_ms(series)
+        elif pd.api.types.is_bool_dtype(series) or not pd.api.types.is_numeric_dtype(series):
+            continue # F.eks. 'symbol', som lagres i attrs
+        elif pd.api.types.is_integer_dtype(series):
+            values = series.to_numpy(dtype='<i8')
+        elif pd.api.types.is_float_dtype(series) and series.dtype.itemsize == 4:
+            values = series.to_numpy(dtype='<f4')
+        else:
+            values = series.to_numpy(dtype='<f8', na_value=np.nan)
+        specs.append({'name': name, 'dtype': values.dtype.str})
+        arrays.append(values)
+    return specs, arrays
+
+def _date_tz(df):
+    if DATE_COLUMN in df.columns and pd.api.types.is_datetime64_any_dtype(df[DATE_COLUMN]):
+        tz = df[DATE_COLUMN].dt.tz
+        return str(tz) if tz is not None else None
+    return None
+
+
+def write_frame(path, df, attrs=None, capacity=None):
+    """
+    Write a DataFrame as a new column store file (atomically, via temp file + rename).
+    String columns are not stored; put them in attrs instead (e.g. {'symbol': 'AAPL'}).
+    """
+    specs, arrays = _frame_to_columns(df)
+    rows = len(df)
+    if capacity is None:
+        capacity = max(MIN_CAPACITY, int(rows * GROWTH_FACTOR))
+    header = {
+        'version': FORMAT_VERSION,
+        'rows': rows,
+        'capacity': max(capacity, rows),
+        'columns': specs,
+        'tz': _date_tz(df),
+        'attrs': attrs or {},
+    }
+    offsets, total_size = _column_offsets(header)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp_', suffix='.col')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_encode_header(header))
+            for spec, values in zip(specs, arrays):
+                f.seek(offsets[spec['name']])
+                f.write(np.ascontiguousarray(values).tobytes())
+            f.truncate(total_size)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+def encode_frame(df, attrs=None):
+    """Encode a DataFrame as one self-contained binary frame (same column encoding as the file)"""
+    specs, arrays = _frame_to_columns(df)
+    position = 0
+    for spec, values in zip(specs, arrays):
+        spec['offset'] = position
+        position += -(-values.nbytes // 8) * 8 # Hver kolonne starter på 8-byte grense (typed arrays i JS)
+    header = {'version': FORMAT_VERSION, 'rows': len(df), 'columns': specs, 'tz': _date_tz(df), 'attrs': attrs or {}}
+    payload = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    payload += b' ' * (-(FRAME_PREFIX_SIZE + len(payload)) % 8)
+    body = bytearray(position)
+    for spec, values in zip(specs, arrays):
+        body[spec['offset']:spec['offset'] + values.nbytes] = np.ascontiguousarray(values).tobytes()
+    return FRAME_MAGIC + struct.pack('<II', len(payload), position) + payload + bytes(body)
+
+def decode_frames(data):
+    """Decode a byte string of one or more frames into a list of DataFrames (attrs in DataFrame.attrs)"""
+    frames = []
+    view = memoryview(data)
+    position = 0
+    while position < len(view):
+        if bytes(view[position:position + 8]) != FRAME_MAGIC:
+            raise ColumnStoreError(f"Not a frame at byte {position}")
+        header_length, body_length = struct.unpack('<II', view[position + 8:position + FRAME_PREFIX_SIZE])
+        body_start = position + FRAME_PREFIX_SIZE + header_length
+        header = json.loads(bytes(view[position + FRAME_PREFIX_SIZE:body_start]).decode('utf-8'))
+        columns = {}
+        for spec in header['columns']:
+            values = np.frombuffer(view, dtype=spec['dtype'], count=header['rows'], offset=body_start + spec['offset'])
+            columns[spec['name']] = _ms_to_dates(values, header.get('tz')) if spec['name'] == DATE_COLUMN else values.copy()
+        df = pd.DataFrame(columns)
+        df.attrs.update(header.get('attrs', {}))
+        frames.append(df)
+        position = body_start + body_length
+    return frames
+
+def write_tail(path, df, start_row, attrs=None):
+    """
+    Replace rows [start_row:] of an existing store with the rows of df.
+    Rows at or beyond the committed row count are written in place (invisible to
+    readers until the new row count is committed in the header, last). Leading rows
+    of df that are byte-identical to the stored rows are skipped. If any committed
+    row actually changes, or the layout/capacity does not fit, the file is rewritten
+    via temp file + rename, so readers never see half-revised bars.
+    """
+    store = ColumnStore(path)
+    specs, arrays = _frame_to_columns(df)
+    new_rows = start_row + len(df)
+    committed = store.rows
+    same_layout = [s['name'] for s in specs] == store.column_names and \
+        all(s['dtype'] == c['dtype'] for s, c in zip(specs, store.header['columns']))
+    skip = 0
+    if same_layout and start_row <= committed <= new_rows:
+        # Overlapp-radene er vanligvis uendrede; da trengs bare et tillegg på stedet
+        overlap = committed - start_row
+        if all(np.ascontiguousarray(values[:overlap]).tobytes() == store.column(spec['name'], start_row, committed).tobytes()
+               for spec, values in zip(specs, arrays)):
+            skip = overlap
+    if (start_row < committed and not skip) or not same_layout or new_rows > store.capacity or start_row > committed:
+        head = store.read_frame(0, start_row)
+        if attrs is None:
+            attrs = store.attrs
+        head = head[[c for c in head.columns if c in df.columns]]
+        combined = pd.concat([head, df[head.columns]], ignore_index=True) if len(head) else df
+        capacity = store.capacity if same_layout and len(combined) <= store.capacity else None
+        return write_frame(path, combined, attrs=attrs, capacity=capacity)
+
+    header = dict(store.header)
+    header['rows'] = new_rows
+    if attrs is not None:
+        header['attrs'] = attrs
+    with open(path, 'r+b') as f:
+        for spec, values in zip(specs, arrays):
+            itemsize = np.dtype(spec['dtype']).itemsize
+            f.seek(store.offsets[spec['name']] + (start_row + skip) * itemsize)
+            f.write(np.ascontiguousarray(values[skip:]).tobytes())
+        f.flush()
+        f.seek(0)
+        f.write(_encode_header(header))
+    return path
+
+
+class ColumnStore:
+    """
+    Read-only, memory-mapped view of a column store file as it was when opened
+    (a later atomic replace does not affect an open instance).
+    With attrs_as_columns=False, frames carry the attrs (e.g. 'symbol') in
+    DataFrame.attrs instead of as a repeated per-row column.
+    """
+
+    def __init__(self, path, attrs_as_columns=True):
+        self.path = path
+        self.attrs_as_columns = attrs_as_columns
+        # Header og kolonner leses fra samme mapping: byttes filen ut (os.replace) etterpå,
+        # leser denne instansen fortsatt den gamle inoden, aldri nye data med gamle offsets
+        try:
+            with open(path, 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError as e:
+            raise ColumnStoreError(f"Column store not found: {path}") from e
+        except ValueError as e: # Tom fil
+            raise ColumnStoreError(f"Not a column store file: {path}") from e
+        self.header = self._read_header()
+        self.offsets, _ = _column_offsets(self.header)
+        self._dtypes = {c['name']: np.dtype(c['dtype']) for c in self.header['columns']}
+
+    def _read_header(self):
+        """
+        Decode the header, retrying when it changes while being read: an in-place append
+        commits the new row count by rewriting the header, which is not atomic for readers.
+        """
+        for attempt in range(HEADER_READ_ATTEMPTS):
+            raw = self._map[:HEADER_SIZE]
+            if raw == self._map[:HEADER_SIZE]:
+                try:
+                    return _decode_header(raw, self.path)
+                except ColumnStoreError:
+                    if raw[:8] != MAGIC or attempt == HEADER_READ_ATTEMPTS - 1:
+                        raise
+            time.sleep(HEADER_RETRY_SECONDS)
+        raise ColumnStoreError(f"Column store header of {self.path} kept changing while being read")
+
+    @property
+    def rows(self):
+        return self.header['rows']
+
+    @property
+    def capacity(self):
+        return self.header['capacity']
+
+    @property
+    def column_names(self):
+        return [c['name'] for c in self.header['columns']]
+
+    @property
+    def attrs(self):
+        return self.header.get('attrs', {})
+
+    @property
+    def tz(self):
+        return self.header.get('tz')
+
+    def column(self, name, start=0, stop=None):
+        """Memory-mapped view of rows [start:stop] of one column (raw values, dates as ms)"""
+        if name not in self._dtypes:
+            raise ColumnStoreError(f"Column '{name}' not found in {self.path}")
+        start, stop, _ = slice(start, stop).indices(self.rows)
+        if stop <= start:
+            return np.empty(0, dtype=self._dtypes[name])
+        dtype = self._dtypes[name]
+        return np.frombuffer(self._map, dtype=dtype, count=stop - start,
+                             offset=self.offsets[name] + start * dtype.itemsize)
+
+    def date_index(self, value, side='left'):
+        """Row position of a date (Timestamp/str) in the date column, by binary search on the mmap"""
+        ts = pd.Timestamp(value)
+        if ts.tzinfo is None and self.tz:
+            ts = ts.tz_localize(self.tz)
+        if ts.tzinfo is not None:
+            ts = ts.tz_convert('UTC').tz_localize(None)
+        target = np.datetime64(ts.to_datetime64(), 'ms').astype('<i8')
+        return int(np.searchsorted(self.column(DATE_COLUMN), target, side=side))
+
+    def read_frame(self, start=0, stop=None, columns=None):
+        """Read rows [start:stop] as a DataFrame (attrs such as 'symbol' are added as columns)"""
+        names = columns or self.column_names
+        data = {}
+        for name in names:
+            values = self.column(name, start, stop)
+            data[name] = _ms_to_dates(values, self.tz) if name == DATE_COLUMN else np.array(values)
+        df = pd.DataFrame(data)
+        if columns is None:
+            if not self.attrs_as_columns:
+                df.attrs.update(self.attrs)
+                return df
+            for key, value in self.attrs.items():
+                if key == 'symbol':
+                    df[key] = value
+        return df
+
+    def tail(self, n, columns=None):
+        """Read the last n rows"""
+        return self.read_frame(max(0, self.rows - n), None, columns)
+
+    def read_range(self, start_date=None, end_date=None, columns=None):
+        """Read rows with start_date <= date <= end_date"""
+        start = self.date_index(start_date) if start_date is not None else 0
+        stop = self.date_index(end_date, side='right') if end_date is not None else None
+        return self.read_frame(start, stop, columns)
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+Vectorized indicator engine for cached market data series.
+
+Indicators are registered by name and requested with spec strings such as
+'sma:20', 'ema:12', 'rsi:14', 'macd:12:26:9', 'bb:20:2' or 'stoch:14:3:3'.
+All kernels work on NumPy arrays. Shared intermediates (price diffs, EMAs,
+rolling means) are computed once per IndicatorContext, so a request for
+e.g. ['ema:12', 'macd:12:26:9', 'rsi:14', 'rsi:21'] computes EMA12 and the
+close diffs only once.
+
+Output columns are named after the spec: 'sma20', 'rsi14', 'macd12_26_9',
+'macd12_26_9_signal', 'bb20_2_upper', ... Values before an indicator has
+enough history are NaN. EMA/MACD follow the frontend (src/utils/indicators.js):
+seeded with the SMA of the first `period` values. RSI uses Wilder smoothing.
+"""
+
+import math
+from dataclasses import dataclass
+from functools import lru_cache
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Rekursive indikatorer (EMA/Wilder) har uendelig hukommelse; ved beregning over
+# en hale brukes WARMUP_FACTOR * periode barer slik at feilen fra startverdien
+# blir neglisjerbar ((1 - 1/14) ** 280 ~ 1e-9 for RSI14).
+WARMUP_FACTOR = 20
+PRICE_COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+
+
+class IndicatorError(ValueError):
+    """Raised for unknown indicators or invalid parameters"""
+
+
+# --- Register ---
+@dataclass(frozen=True)
+class IndicatorDef:
+    name: str
+    func: object
+    defaults: tuple
+    lookback: object # callable(*params) -> antall barer som trengs bakover
+
+INDICATOR_REGISTRY = {}
+
+def register_indicator(name, defaults=(), lookback=None):
+    """Decorator registering an indicator kernel: func(ctx, *params) -> {suffix: array}"""
+    def decorator(func):
+        INDICATOR_REGISTRY[name] = IndicatorDef(name, func, tuple(defaults), lookback or (lambda *p: 0))
+        return func
+    return decorator
+
+@dataclass(frozen=True)
+class IndicatorSpec:
+    name: str
+    params: tuple
+
+    @property
+    def base_name(self):
+        return self.name + '_'.join(_format_param(p) for p in self.params)
+
+    def column_name(self, suffix):
+        return f"{self.base_name}_{suffix}" if suffix else self.base_name
+
+    def __str__(self):
+        return ':'.join([self.name] + [_format_param(p) for p in self.params])
+
+def _format_param(value):
+    if float(value).is_integer():
+        return str(int(value))
+    return str(value).replace('.', 'p')
+
+def _parse_param(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+def parse_indicator_spec(spec):
+    """Parse 'rsi:14' / ('rsi', 14) / IndicatorSpec into an IndicatorSpec with defaults applied"""
+    if isinstance(spec, IndicatorSpec):
+        return spec
+    if isinstance(spec, str):
+        parts = [p for p in spec.strip().lower().split(':') if p != '']
+        if not parts:
+            raise IndicatorError("Empty indicator spec")
+        name, params = parts[0], tuple(_parse_param(p) for p in parts[1:])
+    else:
+        name, params = spec[0].lower(), tuple(spec[1:])
+    if name not in INDICATOR_REGISTRY:
+        raise IndicatorError(f"Unknown indicator '{name}'. Available: {sorted(INDICATOR_REGISTRY)}")
+    definition = INDICATOR_REGISTRY[name]
+    if len(params) > len(definition.defaults):
+        raise IndicatorError(f"Too many parameters for '{name}': {params}")
+    params = params + definition.defaults[len(params):]
+    if any(p <= 0 for p in params):
+        raise IndicatorError(f"Indicator parameters must be positive: {name}{params}")
+    return IndicatorSpec(name, params)
+
+def required_lookback(specs):
+    """Bars of history needed before a bar to reproduce all given indicators on it"""
+    lookback = 0
+    for spec in map(parse_indicator_spec, specs):
+        lookback = max(lookback, int(math.ceil(INDICATOR_REGISTRY[spec.name].lookback(*spec.params))))
+    return lookback
+
+
+# --- NumPy-kjerner ---
+def _first_valid(x):
+    valid = np.flatnonzero(~np.isnan(x))
+    return int(valid[0]) if len(valid) else len(x)
+
+def _window_has_nan(x, period):
+    """True for each full window (ending at period-1 ..) that contains a NaN"""
+    nan_count = np.cumsum(np.insert(np.isnan(x), 0, False))
+    return (nan_count[period:] - nan_count[:-period]) > 0
+
+def rolling_mean(x, period):
+    """Simple moving average; NaN until `period` values are available and for windows containing NaN"""
+    out = np.full(len(x), np.nan)
+    if period > len(x):
+        return out
+    # NaN teller som 0 i kumulativsummen, ellers ville ett hull gjort resten av serien NaN
+    c = np.cumsum(np.insert(np.nan_to_num(x, nan=0.0), 0, 0.0))
+    out[period - 1:] = (c[period:] - c[:-period]) / period
+    out[period - 1:][_window_has_nan(x, period)] = np.nan
+    return out
+
+def rolling_std(x, period):
+    """Population standard deviation over `period` values (NaN for windows containing NaN)"""
+    out = np.full(len(x), np.nan)
+    if period > len(x):
+        return out
+    first = _first_valid(x)
+    shifted = np.nan_to_num(x - (x[first] if first < len(x) else 0.0), nan=0.0) # Sentrer for numerisk stabilitet
+    c1 = np.cumsum(np.insert(shifted, 0, 0.0))
+    c2 = np.cumsum(np.insert(shifted * shifted, 0, 0.0))
+    s1 = c1[period:] - c1[:-period]
+    s2 = c2[period:] - c2[:-period]
+    out[period - 1:] = np.sqrt(np.maximum(s2 / period - (s1 / period) ** 2, 0.0))
+    out[period - 1:][_window_has_nan(x, period)] = np.nan
+    return out
+
+def rolling_max(x, period):
+    out = np.full(len(x), np.nan)
+    if period <= len(x):
+        out[period - 1:] = sliding_window_view(x, period).max(axis=1)
+    return out
+
+def rolling_min(x, period):
+    out = np.full(len(x), np.nan)
+    if period <= len(x):
+        out[period - 1:] = sliding_window_view(x, period).min(axis=1)
+    return out
+
+def ewm_recursive(x, alpha, initial):
+    """
+    y[t] = (1 - alpha) * y[t-1] + alpha * x[t] with y[-1] = initial, vectorized.
+    Uses the closed form y[t] = a^(t+1) * (y0 + alpha * sum_k x[k] * a^-(k+1))
+    in blocks short enough that a^-block stays within float range.
+    NaN inputs keep the previous value (the recursion continues after the gap).
+    """
+    x = np.asarray(x, dtype=np.float64)
+    gaps = np.flatnonzero(np.isnan(x))
+    if len(gaps):
+        # Hull er sjeldne: beregn hvert sammenhengende stykke for seg og bær verdien over hullet
+        out = np.empty(len(x))
+        previous, start = float(initial), 0
+        for gap in np.append(gaps, len(x)).tolist():
+            if gap > start:
+                out[start:gap] = _ewm_segment(x[start:gap], alpha, previous)
+                previous = out[gap - 1]
+            if gap < len(x):
+                out[gap] = previous
+            start = gap + 1
+        return out
+    return _ewm_segment(x, alpha, initial)
+
+def _ewm_segment(x, alpha, initial):
+    out = np.empty(len(x))
+    decay = 1.0 - alpha
+    if decay <= 0.0:
+        out[:] = x
+        return out
+    block = len(x) if decay == 1.0 else max(1, min(8192, int(460.0 / -math.log(decay))))
+    previous = float(initial)
+    for start in range(0, len(x), block):
+        chunk = x[start:start + block]
+        powers = decay ** np.arange(1, len(chunk) + 1)
+        out[start:start + len(chunk)] = powers * (previous + alpha * np.cumsum(chunk / powers))
+        previous = out[start + len(chunk) - 1]
+    return out
+
+def sma_seeded_ewm(x, period, alpha):
+    """EWM seeded with the SMA of the first `period` valid values (NaN before that)"""
+    out = np.full(len(x), np.nan)
+    valid = np.flatnonzero(~np.isnan(x))
+    if len(valid) < period:
+        return out
+    seed_end = int(valid[period - 1]) + 1
+    seed = x[valid[:period]].mean()
+    out[seed_end - 1] = seed
+    out[seed_end:] = ewm_recursive(x[seed_end:], alpha, seed)
+    return out
+
+
+class IndicatorContext:
+    """Holds the price arrays of one series and memoizes shared intermediates"""
+
+    def __init__(self, arrays, frame=None):
+        self.arrays = {name: np.asarray(values, dtype=np.float64) for name, values in arrays.items()}
+        self._frame = frame
+        if frame is not None:
+            self.length = len(frame)
+        else:
+            self.length = len(next(iter(self.arrays.values()))) if self.arrays else 0
+        self._memo = {}
+
+    @classmethod
+    def from_frame(cls, df):
+        # Kolonnene konverteres til float64 først når en indikator trenger dem
+        return cls({}, frame=df)
+
+    def source(self, name):
+        if name not in self.arrays:
+            if self._frame is None or name not in PRICE_COLUMNS or name not in self._frame.columns:
+                raise IndicatorError(f"Column '{name}' is required for this indicator")
+            self.arrays[name] = self._frame[name].to_numpy(dtype=np.float64)
+        return self.arrays[name]
+
+    def _cached(self, key, compute):
+        if key not in self._memo:
+            self._memo[key] = compute()
+        return self._memo[key]
+
+    def diff(self, column='close'):
+        def compute():
+            x = self.source(column)
+            return np.concatenate(([np.nan], np.diff(x)))
+        return self._cached(('diff', column), compute)
+
+    def sma(self, column, period):
+        return self._cached(('sma', column, period), lambda: rolling_mean(self.source(column), period))
+
+    def std(self, column, period):
+        return self._cached(('std', column, period), lambda: rolling_std(self.source(column), period))
+
+    def ema(self, column, period):
+        return self._cached(('ema', column, period),
+                            lambda: sma_seeded_ewm(self.source(column), period, 2.0 / (period + 1)))
+
+    def highest(self, column, period):
+        return self._cached(('max', column, period), lambda: rolling_max(self.source(column), period))
+
+    def lowest(self, column, period):
+        return self._cached(('min', column, period), lambda: rolling_min(self.source(column), period))
+
+    def wilder_gain_loss(self, period):
+        """Wilder-smoothed average gain and loss of close-to-close changes"""
+        def compute():
+            delta = self.diff('close')[1:]
+            gain = sma_seeded_ewm(np.maximum(delta, 0.0), period, 1.0 / period)
+            loss = sma_seeded_ewm(np.maximum(-delta, 0.0), period, 1.0 / period)
+            pad = np.array([np.nan])
+            return np.concatenate((pad, gain)), np.concatenate((pad, loss))
+        return self._cached(('wilder', period), compute)
+
+
+# --- Indikatorer ---
+@register_indicator('sma', defaults=(20,), lookback=lambda period: period)
+def _sma(ctx, period):
+    return {'': ctx.sma('close', period)}
+
+@register_indicator('ema', defaults=(20,), lookback=lambda period: WARMUP_FACTOR * period)
+def _ema(ctx, period):
+    return {'': ctx.ema('close', period)}
+
+@register_indicator('rsi', defaults=(14,), lookback=lambda period: WARMUP_FACTOR * period)
+def _rsi(ctx, period):
+    avg_gain, avg_loss = ctx.wilder_gain_loss(period)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsi = 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+    # Ingen tap: 100 hvis det finnes gevinst, ellers nøytral 50 (som i frontend)
+    rsi = np.where(avg_loss == 0.0, np.where(avg_gain > 0.0, 100.0, 50.0), rsi)
+    rsi[np.isnan(avg_gain)] = np.nan
+    return {'': rsi}
+
+@register_indicator('macd', defaults=(12, 26, 9),
+                    lookback=lambda fast, slow, signal: WARMUP_FACTOR * (slow + signal))
+def _macd(ctx, fast, slow, signal):
+    if fast >= slow:
+        raise IndicatorError(f"MACD fast period ({fast}) must be below slow period ({slow})")
+    macd = ctx.ema('close', fast) - ctx.ema('close', slow)
+    signal_line = sma_seeded_ewm(macd, signal, 2.0 / (signal + 1))
+    return {'': macd, 'signal': signal_line, 'hist': macd - signal_line}
+
+@register_indicator('bb', defaults=(20, 2), lookback=lambda period, width: period)
+def _bollinger(ctx, period, width):
+    middle = ctx.sma('close', period)
+    band = width * ctx.std('close', period)
+    return {'mid': middle, 'upper': middle + band, 'lower': middle - band}
+
+@register_indicator('stoch', defaults=(14, 3, 3), lookback=lambda k, d, smoothing: k + d + smoothing)
+def _stochastic(ctx, k_period, d_period, smoothing):
+    highest = ctx.highest('high', k_period)
+    lowest = ctx.lowest('low', k_period)
+    span = highest - lowest
+    with np.errstate(divide='ignore', invalid='ignore'):
+        raw_k = 100.0 * (ctx.source('close') - lowest) / span
+    # Flat marked: bruk forrige %K (50 hvis ingen finnes), som i frontend
+    in_window = ~np.isnan(span)
+    raw_k[span == 0.0] = np.nan
+    last_valid = np.maximum.accumulate(np.where(~np.isnan(raw_k), np.arange(len(raw_k)), -1))
+    carried = np.where(last_valid >= 0, raw_k[np.maximum(last_valid, 0)], 50.0)
+    raw_k = np.where(in_window, carried, np.nan)
+    start = _first_valid(raw_k)
+    k_line = np.full(len(raw_k), np.nan)
+    k_line[start:] = rolling_mean(raw_k[start:], smoothing) if smoothing > 1 else raw_k[start:]
+    d_line = np.full(len(raw_k), np.nan)
+    k_start = _first_valid(k_line)
+    d_line[k_start:] = rolling_mean(k_line[k_start:], d_period)
+    return {'k': k_line, 'd': d_line}
+
+
+# --- Offentlig API ---
+def compute_indicators(data, specs, context=None):
+    """
+    Compute indicators for a DataFrame (or an IndicatorContext).
+    Returns {column_name: ndarray}; intermediates are shared across specs.
+    """
+    ctx = context or (data if isinstance(data, IndicatorContext) else IndicatorContext.from_frame(data))
+    results = {}
+    for spec in map(parse_indicator_spec, specs):
+        outputs = INDICATOR_REGISTRY[spec.name].func(ctx, *spec.params)
+        for suffix, values in outputs.items():
+            results[spec.column_name(suffix)] = values
+    return results
+
+def output_columns(spec):
+    """Column names a spec produces (computed on a tiny dummy series)"""
+    return list(_output_columns(parse_indicator_spec(spec)))
+
+@lru_cache(maxsize=None)
+def _output_columns(spec):
+    dummy = IndicatorContext({col: np.ones(2) for col in PRICE_COLUMNS})
+    return tuple(compute_indicators(None, [spec], context=dummy))
+
+def available_indicators():
+    """List registered indicators with their default parameters"""
+    return [{'name': d.name, 'defaults': list(d.defaults)} for d in INDICATOR_REGISTRY.values()]
@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+"""
+Asyncio HTTP service serving market data straight from the Python cache.
+
+An alternative to Express -> Python worker -> JSON lines -> Node: the same
+endpoints as server.js, answered in this process (stdlib only, HTTP/1.1 with
+keep-alive). Both '/complete-market-data' and '/api/complete-market-data' work.
+
+  GET /complete-market-data?symbol=&timeframe=&days=&format=   (also /market-data)
+  GET /market-data/range?...                                   (see range_query.py; streamed)
+  GET /scan?query=&timeframe=&symbols=&sort=&desc=&top=          (see panel_store.py)
+  GET /correlation?symbols=&timeframe=&window=
+  GET /symbols, /timeframes, /metrics[?format=prometheus], /health
+
+- Blocking work (downloads, cache reads, encoding) runs in a thread pool; the
+  event loop only parses requests and writes responses.
+- Concurrent identical requests share one in-flight computation and its encoded body.
+- format=json (records, compact separators), format=columns (one array per
+  column) or format=arrow (Arrow IPC stream; needs pyarrow). Large bodies are
+  gzipped when the client accepts it.
+
+server.js proxies its data endpoints here when MARKET_DATA_HTTP_URL is set.
+"""
+
+import os
+import gzip
+import json
+import asyncio
+import argparse
+import threading
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qsl
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError: # Valgfri: kun nødvendig for format=arrow
+    pa = None
+
+import telemetry
+import market_data_yf as md
+from market_data_yf import print_info, print_warning, print_error
+
+# --- Konfigurasjon ---
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_HTTP_WORKERS = 8 # Tråder for blokkerende arbeid (nedlasting, cache-lesing, koding)
+DEFAULT_DAYS = 100 # Samme standard som DEFAULT_JS_DAYS i market_data_service.js
+KEEP_ALIVE_SECONDS = 15
+MAX_HEADER_LINES = 100
+MAX_REQUEST_BODY_BYTES = 64 * 1024 # Ingen endepunkter leser en body; større forespørsler avvises
+GZIP_MIN_BYTES = 8192
+GZIP_LEVEL = 1 # Rask komprimering; JSON krymper likevel kraftig
+STREAM_QUEUE_CHUNKS = 4 # Biter som kan ligge klare før produsenten venter på klienten
+ARROW_MEDIA_TYPE = 'application/vnd.apache.arrow.stream'
+FRAME_FORMATS = ('json', 'columns', 'arrow')
+EXPOSED_HEADERS = 'X-Total-Rows, X-Rows, X-Next-Cursor, X-Downsampled, X-Shared'
+# ---------------------
+
+STATUS_TEXT = {200: 'OK', 204: 'No Content', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               406: 'Not Acceptable', 500: 'Internal Server Error'}
+
+
+class HTTPError(Exception):
+    """An error answered with `status` and {'error': message}"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+@dataclass
+class Response:
+    status: int
+    content_type: str
+    body: bytes
+    headers: dict = field(default_factory=dict)
+
+
+@dataclass
+class StreamingResponse:
+    status: int
+    content_type: str
+    chunks: object # Asynkron generator av bytes
+    headers: dict = field(default_factory=dict)
+    producer: object = None
+    cancel: object = None
+
+
+def json_response(payload, status=200, headers=None):
+    body = json.dumps(payload, separators=(',', ':'), default=str).encode('utf-8')
+    return Response(status, 'application/json; charset=utf-8', body, headers or {})
+
+def error_response(status, message):
+    return json_response({'error': message}, status)
+
+
+# --- Koding av serier ---
+def frame_columns(frame):
+    """Column-oriented JSON payload: {'columns': [...], 'data': {name: [...]}} (about half the size of records)"""
+    records = md.frame_to_records(frame)
+    names = list(records[0]) if records else list(frame.columns)
+    return {'columns': names, 'data': {name: [row.get(name) for row in records] for name in names}}
+
+def frame_to_arrow(frame):
+    """Arrow IPC stream bytes (dates as ISO strings, as in the JSON formats)"""
+    if pa is None:
+        raise HTTPError(406, "format=arrow requires pyarrow (pip install pyarrow)")
+    out = frame.copy()
+    if 'date' in out.columns:
+        dates = out['date']
+        out['date'] = md.format_dates(dates) if pd.api.types.is_datetime64_any_dtype(dates) else dates.astype(str)
+    if 'symbol' not in out.columns and frame.attrs.get('symbol'):
+        out['symbol'] = frame.attrs['symbol']
+    table = pa.Table.from_pandas(out, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def encode_frame_response(frame, output_format):
+    if output_format == 'arrow':
+        return Response(200, ARROW_MEDIA_TYPE, frame_to_arrow(frame))
+    if output_format == 'columns':
+        return json_response(frame_columns(frame))
+    return json_response(md.frame_to_records(frame))
+
+def requested_format(query, headers, allowed=FRAME_FORMATS):
+    output_format = query.get('format') or ('arrow' if ARROW_MEDIA_TYPE in headers.get('accept', '') else 'json')
+    if output_format not in allowed:
+        raise HTTPError(400, f"Invalid 'format' parameter. Use one of {', '.join(allowed)}.")
+    return output_format
+
+def positive_int(query, name, default=None):
+    if query.get(name) in (None, ''):
+        return default
+    try:
+        value = int(query[name])
+    except ValueError:
+        value = 0
+    if value <= 0:
+        raise HTTPError(400, f"Invalid '{name}' parameter. Must be a positive integer.")
+    return value
+
+
+# --- Tjenesten ---
+class MarketDataHTTPServer:
+    """Routes, thread pool and in-flight request sharing for the HTTP service"""
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, workers=DEFAULT_HTTP_WORKERS):
+        self.host = host
+        self.port = port
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='md-http')
+        self._in_flight = {}
+        self._lists = {} # CSV-fil -> (stempel, poster)
+        self.routes = {
+            '/complete-market-data': self.complete_market_data,
+            '/market-data': self.complete_market_data, # Eldre navn, samme svar som i server.js
+            '/market-data/range': self.market_data_range,
+            '/scan': self.scan,
+            '/correlation': self.correlation,
+            '/symbols': self.symbols,
+            '/timeframes': self.timeframes,
+            '/metrics': self.metrics,
+            '/health': self.health,
+        }
+
+    async def run_blocking(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def shared(self, key, fn, *args):
+        """Run fn in the thread pool once for all concurrent requests with the same key. Returns (result, shared)."""
+        task = self._in_flight.get(key)
+        shared = task is not None
+        if shared:
+            telemetry.increment('http_shared_requests')
+        else:
+            task = asyncio.ensure_future(self.run_blocking(fn, *args))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # shield: en klient som kobler fra avbryter ikke arbeidet de andre venter på
+        return await asyncio.shield(task), shared
+
+    # --- Endepunkter ---
+    async def complete_market_data(self, query, headers):
+        symbol = query.get('symbol') or 'AAPL'
+        timeframe_id = query.get('timeframe') or '1d'
+        days = positive_int(query, 'days', DEFAULT_DAYS)
+        output_format = requested_format(query, headers)
+
+        def build():
+            with telemetry.trace('http.complete-market-data', symbol=symbol, timeframe=timeframe_id):
+                frame = md.get_market_frame(symbol, timeframe_id)
+                if frame is None:
+                    raise HTTPError(404, f"No data available for {symbol} ({timeframe_id})")
+                return encode_frame_response(frame.tail(days), output_format)
+        response, shared = await self.shared(('complete', symbol, timeframe_id, days, output_format), build)
+        return Response(response.status, response.content_type, response.body, {'X-Shared': '1' if shared else '0'})
+
+    def _read_list(self, filename):
+        """Records of a list CSV written by save_default_lists, cached until the file changes"""
+        path = os.path.join(md.DATA_DIR, filename)
+        if not os.path.exists(path):
+            md.save_default_lists()
+        stamp = md._file_stamp(path)
+        cached = self._lists.get(path)
+        if cached is None or cached[0] != stamp:
+            cached = (stamp, md.frame_to_records(pd.read_csv(path)) if stamp else [])
+            self._lists[path] = cached
+        return cached[1]
+
+    async def symbols(self, query, headers):
+        records, _ = await self.shared(('list', 'default_symbols.csv'), self._read_list, 'default_symbols.csv')
+        return json_response(records)
+
+    async def timeframes(self, query, headers):
+        records, _ = await self.shared(('list', 'timeframes.csv'), self._read_list, 'timeframes.csv')
+        return json_response(records)
+
+    async def scan(self, query, headers):
+        """Universe scan over the latest bar of every cached symbol (panel_store.py)"""
+        import panel_store
+        if not query.get('query'):
+            raise HTTPError(400, "Missing 'query' parameter (e.g. rsi < 30).")
+        request = {
+            'cmd': 'scan', 'query': query['query'], 'timeframe': query.get('timeframe') or '1d',
+            'symbols': query.get('symbols'), 'at': query.get('at'), 'sort': query.get('sort'),
+            'desc': query.get('desc') == 'true', 'top': positive_int(query, 'top'), 'refresh': query.get('refresh') == 'true',
+        }
+        result, _ = await self.shared(('scan', *request.values()), panel_store.handle_panel_request, request)
+        return json_response(result['result'])
+
+    async def correlation(self, query, headers):
+        import panel_store
+        request = {
+            'cmd': 'correlation', 'symbols': query.get('symbols') or 'default', 'timeframe': query.get('timeframe') or '1d',
+            'window': positive_int(query, 'window'),
+        }
+        result, _ = await self.shared(('correlation', *request.values()), panel_store.handle_panel_request, request)
+        return json_response(result['result'])
+
+    async def metrics(self, query, headers):
+        frame_stats = md.get_frame_cache().stats()
+        if query.get('format') == 'prometheus':
+            text = telemetry.prometheus_text(gauges={f"frame_cache_{k}": v for k, v in frame_stats.items()})
+            return Response(200, 'text/plain; version=0.0.4', text.encode('utf-8'))
+        return json_response({'metrics': telemetry.snapshot(), 'frameCache': frame_stats})
+
+    async def health(self, query, headers):
+        return json_response({'status': 'ok', 'in_flight': len(self._in_flight)})
+
+    async def market_data_range(self, query, headers):
+        """Range query (range_query.py); ndjson/binary are sent chunk by chunk as they are read"""
+        import range_query
+        output_format = query.get('format') or 'ndjson'
+        if output_format not in range_query.OUTPUT_FORMATS:
+            raise HTTPError(400, f"Invalid 'format' parameter. Use one of {', '.join(range_query.OUTPUT_FORMATS)}.")
+        request = {
+            'symbol': query.get('symbol') or 'AAPL',
+            'timeframe': query.get('timeframe') or '1d',
+            'start': query.get('start'), 'end': query.get('end'), 'after': query.get('after'),
+            'method': query.get('method'), 'columns': query.get('columns'),
+            'last': positive_int(query, 'last'), 'limit': positive_int(query, 'limit'),
+            'points': positive_int(query, 'points'), 'chunk_rows': positive_int(query, 'chunk'),
+        }
+        if output_format == 'json':
+            def build():
+                with telemetry.trace('http.range', symbol=request['symbol'], timeframe=request['timeframe']):
+                    return range_query.handle_range_request({**request, 'format': 'json'})
+            return json_response(await self.run_blocking(build))
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=STREAM_QUEUE_CHUNKS)
+        stop = threading.Event()
+
+        def put(item):
+            # Blokkerer produsenttråden når køen er full (mottrykk fra klienten)
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        def produce():
+            try:
+                with telemetry.trace('http.range', symbol=request['symbol'], timeframe=request['timeframe']):
+                    meta, chunks = range_query.query_range(
+                        request['symbol'], request['timeframe'], start=request['start'], end=request['end'],
+                        last=request['last'], after=request['after'], limit=request['limit'], points=request['points'],
+                        method=request['method'] or range_query.DEFAULT_DOWNSAMPLE_METHOD,
+                        columns=[c for c in request['columns'].split(',') if c] if request['columns'] else None,
+                        chunk_rows=request['chunk_rows'])
+                    put(('meta', meta))
+                    for chunk in chunks:
+                        if stop.is_set():
+                            return
+                        encoded = range_query.encode_chunk(chunk, output_format, meta['date_only'])
+                        if output_format == 'ndjson':
+                            encoded = ''.join(json.dumps(row, separators=(',', ':'), default=str) + '\n' for row in encoded).encode('utf-8')
+                        put(('chunk', encoded))
+                put(('end', None))
+            except Exception as e:
+                put(('error', e))
+
+        def cancel():
+            stop.set()
+            while not queue.empty(): # Frigjør en produsent som venter på plass i køen
+                queue.get_nowait()
+
+        async def body():
+            while True:
+                kind, value = await queue.get()
+                if kind == 'chunk':
+                    yield value
+                elif kind == 'error':
+                    raise value
+                else:
+                    return
+
+        producer = loop.run_in_executor(self.executor, produce)
+        kind, value = await queue.get()
+        if kind == 'error':
+            await producer
+            raise value
+        response = StreamingResponse(200, 'application/octet-stream' if output_format == 'binary' else 'application/x-ndjson', body(), {
+            'X-Total-Rows': str(value['total_rows']),
+            'X-Rows': str(value['rows']),
+            'X-Next-Cursor': value['next_cursor'] or '',
+            'X-Downsampled': value['downsampled'] or '',
+        })
+        response.producer, response.cancel = producer, cancel
+        return response
+
+    # --- HTTP ---
+    async def dispatch(self, method, target, headers):
+        url = urlsplit(target)
+        path = url.path.rstrip('/') or '/'
+        if path.startswith('/api/'):
+            path = path[4:] # Samme stier som Express-serveren
+        handler = self.routes.get(path)
+        if handler is None:
+            return error_response(404, f"Unknown endpoint {url.path}")
+        if method == 'OPTIONS':
+            return Response(204, 'text/plain', b'', {'Access-Control-Allow-Methods': 'GET, OPTIONS',
+                                                     'Access-Control-Allow-Headers': '*'})
+        if method not in ('GET', 'HEAD'):
+            return error_response(405, f"Method {method} not allowed")
+        telemetry.increment('http_requests')
+        try:
+            return await handler(dict(parse_qsl(url.query)), headers)
+        except HTTPError as e:
+            return error_response(e.status, str(e))
+        except ValueError as e:
+            return error_response(400, str(e))
+        except Exception as e:
+            print_error(f"HTTP {method} {target} failed: {e}", include_traceback=True)
+            return error_response(500, str(e) or 'Internal error')
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line.strip():
+                    break
+                parts = request_line.decode('latin-1').split()
+                if len(parts) != 3:
+                    await self.write_response(writer, error_response(400, "Malformed request line"), keep_alive=False)
+                    break
+                method, target, version = parts
+                headers = {}
+                for _ in range(MAX_HEADER_LINES):
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                content_length = headers.get('content-length', '0') or '0'
+                if not content_length.isdigit() or int(content_length) > MAX_REQUEST_BODY_BYTES:
+                    await self.write_response(writer, error_response(400, "Invalid or too large Content-Length"), keep_alive=False)
+                    break
+                if int(content_length):
+                    await reader.readexactly(int(content_length)) # Ingen endepunkter leser en body
+                keep_alive = (headers.get('connection', '').lower() != 'close'
+                              and (version == 'HTTP/1.1' or headers.get('connection', '').lower() == 'keep-alive'))
+                response = await self.dispatch(method.upper(), target, headers)
+                await self.write_response(writer, response, keep_alive, head=method.upper() == 'HEAD',
+                                          gzip_ok='gzip' in headers.get('accept-encoding', ''))
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass # Klienten koblet fra
+        finally:
+            writer.close()
+
+    async def write_response(self, writer, response, keep_alive, head=False, gzip_ok=False):
+        headers = {
+            'Content-Type': response.content_type,
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': EXPOSED_HEADERS,
+            'Connection': 'keep-alive' if keep_alive else 'close',
+            **response.headers,
+        }
+        streaming = isinstance(response, StreamingResponse)
+        body = b''
+        if streaming:
+            headers['Transfer-Encoding'] = 'chunked'
+        else:
+            body = response.body
+            if gzip_ok and len(body) >= GZIP_MIN_BYTES:
+                body = await self.run_blocking(gzip.compress, body, GZIP_LEVEL)
+                headers['Content-Encoding'] = 'gzip'
+                headers['Vary'] = 'Accept-Encoding'
+            headers['Content-Length'] = str(len(body))
+        head_lines = [f"HTTP/1.1 {response.status} {STATUS_TEXT.get(response.status, '')}"]
+        head_lines += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(('\r\n'.join(head_lines) + '\r\n\r\n').encode('latin-1'))
+        if streaming:
+            try:
+                if not head: # HEAD: bare headere; produsenten stoppes under
+                    async for chunk in response.chunks:
+                        if chunk:
+                            writer.write(f"{len(chunk):X}\r\n".encode('ascii') + chunk + b'\r\n')
+                            await writer.drain()
+                    writer.write(b'0\r\n\r\n')
+            finally:
+                response.cancel() # Klienten kan ha koblet fra midt i strømmen
+                await response.producer
+        elif not head:
+            writer.write(body)
+        await writer.drain()
+
+    async def serve_forever(self):
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        print_info(f"Market data HTTP service listening on http://{self.host}:{self.port} "
+                   f"({self.executor._max_workers} worker threads, arrow {'enabled' if pa else 'unavailable'}).")
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        md.flush_access_stats()
+
+
+# --- Hovedlogikk for å håndtere argumenter ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve market data over HTTP directly from the Python cache (asyncio, no Node hop).",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+        )
+    parser.add_argument('--host', type=str, default=os.environ.get('MARKET_DATA_HTTP_HOST', DEFAULT_HOST), help='Interface to bind.')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('MARKET_DATA_HTTP_PORT', DEFAULT_PORT)), help='Port to listen on.')
+    parser.add_argument('--workers', type=int, default=DEFAULT_HTTP_WORKERS, help='Threads for downloads, cache reads and encoding.')
+    parser.add_argument('--low-memory', action='store_true', help='Process with float32 columns (same as MARKET_DATA_LOW_MEMORY=1).')
+    parser.add_argument('--log-level', choices=list(telemetry.LOG_LEVELS), default=None, help='Minimum log level (overrides MARKET_DATA_LOG_LEVEL).')
+    args = parser.parse_args()
+
+    if args.log_level:
+        telemetry.set_log_level(args.log_level)
+    if args.low_memory:
+        md.LOW_MEMORY = True
+    service = MarketDataHTTPServer(args.host, args.port, max(1, args.workers))
+    try:
+        asyncio.run(service.serve_forever())
+    except KeyboardInterrupt:
+        print_info("HTTP service interrupted.")
+    except OSError as e:
+        print_warning(f"Could not start HTTP service on {args.host}:{args.port}: {e}")
+        exit(1)
+    finally:
+        service.close()
@@ -7,6 +7,7 @@ import fs from 'fs';
 import path from 'path';
 import { fileURLToPath } from 'url';
 import { spawn } from 'child_process'; // <-- Importer spawn
+import readline from 'readline';
 // import dotenv from 'dotenv'; // Ikke lenger nødvendig for API-nøkkel
 
 // --- Konfigurasjon ---
@@ -23,13 +24,28 @@ const PYTHON_SCRIPT_PATH = path.resolve(__dirname, 'market_data_yf.py');
 // Mappe for data lagret av Python-skriptet (bør matche Python-skriptets DATA_DIR)
 const DATA_DIR = path.join(__dirname, 'market_data');
 
+// Bruk en langlevende Python-worker (--serve) i stedet for én prosess per forespørsel.
+// Sett PY_WORKER_MODE=spawn for å gå tilbake til den gamle oppførselen.
+const USE_PYTHON_WORKER = (process.env.PY_WORKER_MODE || 'serve') !== 'spawn';
+const PYTHON_WORKER_THREADS = parseInt(process.env.PY_WORKER_THREADS || '4', 10);
+
+// Binært kolonneformat skrevet av column_store.py (se filen for layout)
+const COLUMN_CACHE_EXT = '.col';
+const COLUMN_STORE_MAGIC = 'TSCOL1';
+const COLUMN_STORE_HEADER_SIZE = 4096;
+
 // Standard antall dager for JS-funksjonen (Python har sin egen default)
 const DEFAULT_JS_DAYS = 100;
 
 // Tilgjengelige tidsrammer (bør matche Python AVAILABLE_TIMEFRAMES)
 // Vi trenger mapping til yf_interval for å finne riktig cache-fil
+// 2h/4h/3d/1wk/1mo aggregeres lokalt i Python fra 1h-/1d-cachen, men har egne cache-filer
 const AVAILABLE_TIMEFRAMES_JS = [
+    { id: '1h', name: '1 Hour', yf_interval: '1h' },
+    { id: '2h', name: '2 Hours', yf_interval: '2h' },
+    { id: '4h', name: '4 Hours', yf_interval: '4h' },
     { id: '1d', name: '1 Day', yf_interval: '1d' },
+    { id: '3d', name: '3 Days', yf_interval: '3d' },
     { id: '1wk', 'name': '1 Week', yf_interval: '1wk' },
     { id: '1mo', 'name': '1 Month', yf_interval: '1mo' },
 ];
@@ -72,20 +88,148 @@ function runPythonScript(args = []) {
   });
 }
 
+// --- Langlevende Python-worker ---
+// Snakker JSON-lines med `market_data_yf.py --serve`: én forespørsel per linje på stdin,
+// ett svar per linje på stdout (matchet via id). Python-logging kommer på stderr.
+let pythonWorker = null;
+let nextRequestId = 1;
+
+function startPythonWorker() {
+  const args = [PYTHON_SCRIPT_PATH, '--serve', '--workers', String(PYTHON_WORKER_THREADS)];
+  console.log(`JS: Starting Python worker: ${PYTHON_EXECUTABLE} ${args.join(' ')}`);
+  const pyProcess = spawn(PYTHON_EXECUTABLE, args);
+  const worker = { process: pyProcess, pending: new Map() };
+
+  const rl = readline.createInterface({ input: pyProcess.stdout });
+  rl.on('line', (line) => {
+    let message;
+    try {
+      message = JSON.parse(line);
+    } catch (e) {
+      // Linjer skrevet før serve-modus tok over stdout (f.eks. oppstartslogging)
+      console.log(`PY_STDOUT: ${line.trim()}`);
+      return;
+    }
+    if (message.id === null || message.id === undefined) {
+      if (message.ready) console.log('JS: Python worker ready.');
+      else if (!message.ok) console.warn(`JS: Python worker reported: ${message.error}`);
+      return;
+    }
+    const entry = worker.pending.get(message.id);
+    if (!entry) return;
+    if (message.partial) {
+      // Delsvar fra strømmende kommandoer (range); det endelige svaret kommer senere
+      if (entry.onPartial) entry.onPartial(message);
+      return;
+    }
+    worker.pending.delete(message.id);
+    if (message.ok) {
+      entry.resolve(message);
+    } else {
+      entry.reject(new Error(`Python worker request failed: ${message.error}`));
+    }
+  });
+
+  pyProcess.stderr.on('data', (data) => {
+    console.error(`PY_STDERR: ${data.toString().trim()}`);
+  });
+
+  const failPending = (reason) => {
+    for (const entry of worker.pending.values()) {
+      entry.reject(new Error(reason));
+    }
+    worker.pending.clear();
+    if (pythonWorker === worker) pythonWorker = null; // Neste forespørsel starter en ny worker
+  };
+
+  pyProcess.on('close', (code) => {
+    console.warn(`JS: Python worker exited with code ${code}`);
+    failPending(`Python worker exited with code ${code}`);
+  });
+
+  pyProcess.on('error', (err) => {
+    console.error('JS: Failed to start Python worker.', err);
+    failPending(`Failed to spawn Python worker: ${err.message}`);
+  });
+
+  return worker;
+}
+
+function sendWorkerRequest(request, onPartial = null) {
+  if (!pythonWorker) pythonWorker = startPythonWorker();
+  const worker = pythonWorker;
+  const id = nextRequestId++;
+  return new Promise((resolve, reject) => {
+    worker.pending.set(id, { resolve, reject, onPartial });
+    worker.process.stdin.write(JSON.stringify({ id, ...request }) + '\n');
+  });
+}
+
+/**
+ * Runs a command against Python, via the long-lived worker when enabled,
+ * or by spawning the script with the equivalent CLI arguments.
+ *
+ * @param {Object} request - Worker request ({ cmd, symbol, timeframe, days })
+ * @param {Array} cliArgs - Equivalent command-line arguments for spawn mode
+ * @returns {Promise<Object>} - Worker response (empty object in spawn mode)
+ */
+async function callPython(request, cliArgs) {
+  if (USE_PYTHON_WORKER) {
+    return sendWorkerRequest(request);
+  }
+  await runPythonScript(cliArgs);
+  return {};
+}
+
 // Hjelpefunksjon for å finne yf_interval (ligner Python-versjonen)
 function mapTimeframeIdToYfInterval(timeframeId) {
     const tf = AVAILABLE_TIMEFRAMES_JS.find(t => t.id === timeframeId);
     return tf ? tf.yf_interval : '1d'; // Default til '1d'
 }
 
-// Hjelpefunksjon for å lage filnavn som matcher Python
+// Hjelpefunksjon for å lage filnavn som matcher Python (get_cache_file_path)
+// Foretrekker kolonnecachen (.col) og faller tilbake til CSV.
 function getCacheFilePath(symbol, timeframeId) {
     const yfInterval = mapTimeframeIdToYfInterval(timeframeId);
-    // Erstatt ugyldige tegn for filnavn, spesielt '/' i forex-symboler
-    const safeSymbol = symbol.replace(/[^a-zA-Z0-9\-.]/g, '-');
+    // Samme erstatninger som Python: '/' -> '-', '=' -> '_'
+    const safeSymbol = symbol.replace(/\//g, '-').replace(/=/g, '_');
+    const columnFilePath = path.join(DATA_DIR, `${safeSymbol}_${yfInterval}_data${COLUMN_CACHE_EXT}`);
+    if (fs.existsSync(columnFilePath)) return columnFilePath;
     return path.join(DATA_DIR, `${safeSymbol}_${yfInterval}_data.csv`);
 }
 
+// Leser cache-filen i riktig format basert på filendelsen
+function loadCachedData(filePath, limit = null) {
+    if (filePath.endsWith(COLUMN_CACHE_EXT)) {
+        return loadDataFromColumnStore(filePath, limit);
+    }
+    return loadDataFromCSV(filePath, limit);
+}
+
+// Samtidige forespørsler for samme symbol/tidsramme/dager deler ett Python-kall
+const inFlightFetches = new Map();
+
+/**
+ * Single-flight wrapper around loadCompleteMarketData: concurrent calls with the
+ * same arguments wait for the same in-flight fetch and share its result.
+ *
+ * @param {string} symbol - Trading symbol (Yahoo Finance format, e.g., 'AAPL', 'BTC-USD')
+ * @param {string} timeframeId - Timeframe ID ('1d', '1wk', '1mo')
+ * @param {number} days - Number of days of history requested
+ * @returns {Promise<Array>} - Market data array of objects
+ */
+export const fetchCompleteMarketData = (symbol = 'AAPL', timeframeId = '1d', days = DEFAULT_JS_DAYS) => {
+  const key = `${symbol}|${timeframeId}|${days}`;
+  if (inFlightFetches.has(key)) {
+    console.log(`JS: Joining in-flight fetch for ${symbol} (${timeframeId}).`);
+    return inFlightFetches.get(key);
+  }
+  const promise = loadCompleteMarketData(symbol, timeframeId, days)
+    .finally(() => inFlightFetches.delete(key));
+  inFlightFetches.set(key, promise);
+  return promise;
+};
+
 /**
  * Ensures market data is fetched/updated by the Python script
  * and then loads the data from the CSV cache.
@@ -96,7 +240,7 @@ function getCacheFilePath(symbol, timeframeId) {
  * @returns {Promise<Array>} - Market data array of objects
  * @throws {Error} - If Python script fails or CSV cannot be read
  */
-export const fetchCompleteMarketData = async (symbol = 'AAPL', timeframeId = '1d', days = DEFAULT_JS_DAYS) => {
+const loadCompleteMarketData = async (symbol = 'AAPL', timeframeId = '1d', days = DEFAULT_JS_DAYS) => {
   // 1. Kjør Python-skriptet for å sikre at data/cache er oppdatert
   const pythonArgs = [
     '--symbol', symbol,
@@ -105,19 +249,23 @@ export const fetchCompleteMarketData = async (symbol = 'AAPL', timeframeId = '1d
   ];
 
   try {
-    await runPythonScript(pythonArgs);
+    // Workeren returnerer de siste radene direkte fra sin minnecache (rows)
+    const result = await callPython({ cmd: 'fetch', symbol, timeframe: timeframeId, days, rows: days }, pythonArgs);
     // Python-skriptet har fullført (enten hentet nytt eller bekreftet fersk cache)
     console.log(`JS: Python script finished successfully for ${symbol}.`);
+    if (Array.isArray(result.data)) {
+      return result.data;
+    }
 
-    // 2. Finn den forventede CSV-filstien
-    const cacheFilePath = getCacheFilePath(symbol, timeframeId);
+    // 2. Finn CSV-filstien (workeren rapporterer den nøyaktige stien)
+    const cacheFilePath = result.cache_file || getCacheFilePath(symbol, timeframeId);
     console.log(`JS: Attempting to load data from: ${cacheFilePath}`);
 
     // 3. Les dataen fra CSV-filen som Python har laget/oppdatert
     if (fs.existsSync(cacheFilePath)) {
       // Bruk loadDataFromCSV til å lese filen
       // Pass 'days' for å begrense antall rader som returneres fra CSV
-      const data = loadDataFromCSV(cacheFilePath, days);
+      const data = loadCachedData(cacheFilePath, days);
       return data;
     } else {
       // Dette bør *egentlig* ikke skje hvis Python kjørte vellykket og fant/lagde data
@@ -132,7 +280,7 @@ export const fetchCompleteMarketData = async (symbol = 'AAPL', timeframeId = '1d
      if (fs.existsSync(cacheFilePath)) {
         console.warn(`JS: Python script failed, attempting to return potentially stale data from ${cacheFilePath}`);
         try {
-            return loadDataFromCSV(cacheFilePath, days);
+            return loadCachedData(cacheFilePath, days);
         } catch (loadError) {
             console.error(`JS: Failed to load stale cache file ${cacheFilePath}:`, loadError);
             throw new Error(`Python script failed and unable to load cache for ${symbol}. Original error: ${error.message}`);
@@ -153,7 +301,7 @@ export const fetchAvailableSymbols = async () => {
 
   // Kjør Python for å sikre at filen er opprettet hvis den mangler
   try {
-      await runPythonScript(['--init-lists']);
+      await callPython({ cmd: 'init-lists' }, ['--init-lists']);
   } catch(error) {
       console.warn(`JS: Python script failed during init-lists, file might be missing: ${error.message}`)
       // Fortsett uansett, loadDataFromCSV vil håndtere manglende fil
@@ -182,7 +330,7 @@ export const fetchAvailableTimeframes = async () => {
 
     // Kjør Python for å sikre at filen er opprettet hvis den mangler
     try {
-        await runPythonScript(['--init-lists']);
+        await callPython({ cmd: 'init-lists' }, ['--init-lists']);
     } catch(error) {
         console.warn(`JS: Python script failed during init-lists, file might be missing: ${error.message}`)
     }
@@ -200,6 +348,252 @@ export const fetchAvailableTimeframes = async () => {
     }
 };
 
+/**
+ * Runs a backtest in the Python worker (backtest_engine.py) against the cached series,
+ * so only the trades, metrics and equity curve are sent to the client.
+ *
+ * @param {Object} strategy - Strategy configuration (same shape as in the frontend backtester)
+ * @param {string} symbol - Trading symbol
+ * @param {string} timeframeId - Timeframe ID ('1h', '1d', '1wk', '1mo')
+ * @param {number|null} days - Only backtest the last N candles (null = whole cache)
+ * @param {boolean} compactEquity - Only return equity points where the equity changes
+ * @returns {Promise<Object>} - Backtest result (same shape as runBacktest)
+ */
+export const runServerBacktest = async (strategy, symbol = 'AAPL', timeframeId = '1d', days = null, compactEquity = false) => {
+  if (!USE_PYTHON_WORKER) {
+    throw new Error('Server-side backtests require the Python worker (PY_WORKER_MODE=serve).');
+  }
+  const result = await sendWorkerRequest({
+    cmd: 'backtest', strategy, symbol, timeframe: timeframeId, days, compact_equity: compactEquity,
+  });
+  return result.result;
+};
+
+/**
+ * Streams a date range of a cached series from the Python worker (range_query.py).
+ * Only the selected rows are read from the cache; with `points` the range is
+ * downsampled ('ohlc', 'minmax' or 'lttb') before it is sent.
+ *
+ * @param {string} symbol - Trading symbol
+ * @param {string} timeframeId - Timeframe ID
+ * @param {Object} query - { start, end, last, after, limit, points, method, columns, chunkRows }
+ * @param {string} format - 'ndjson' (chunks are row arrays) or 'binary' (chunks are Buffers of TSRF1 frames)
+ * @param {Object} handlers - { onMeta(meta), onChunk(chunk) }
+ * @returns {Promise<Object>} - Final summary ({ done, chunks })
+ */
+export const streamMarketDataRange = async (symbol, timeframeId = '1d', query = {}, format = 'ndjson', handlers = {}) => {
+  if (!USE_PYTHON_WORKER) {
+    throw new Error('Range queries require the Python worker (PY_WORKER_MODE=serve).');
+  }
+  const { onMeta = () => {}, onChunk = () => {} } = handlers;
+  const { start, end, last, after, limit, points, method, columns, chunkRows } = query;
+  const result = await sendWorkerRequest({
+    cmd: 'range', stream: true, format, symbol, timeframe: timeframeId,
+    start, end, last, after, limit, points, method, columns, chunk_rows: chunkRows,
+  }, (message) => {
+    if (message.meta) onMeta(message.meta);
+    else onChunk(format === 'binary' ? Buffer.from(message.chunk, 'base64') : message.chunk);
+  });
+  return { done: result.done, chunks: result.chunks };
+};
+
+/**
+ * Runs a range query in the Python worker and returns all rows at once (see streamMarketDataRange).
+ *
+ * @returns {Promise<Object>} - { meta, data }
+ */
+export const fetchMarketDataRange = async (symbol, timeframeId = '1d', query = {}) => {
+  if (!USE_PYTHON_WORKER) {
+    throw new Error('Range queries require the Python worker (PY_WORKER_MODE=serve).');
+  }
+  const { start, end, last, after, limit, points, method, columns } = query;
+  const result = await sendWorkerRequest({
+    cmd: 'range', format: 'json', symbol, timeframe: timeframeId,
+    start, end, last, after, limit, points, method, columns,
+  });
+  return { meta: result.meta, data: result.data };
+};
+
+/**
+ * Reads counters and per-stage timings from the Python worker (see backend/telemetry.py).
+ *
+ * @param {string} format - 'json' or 'prometheus' (text exposition format)
+ * @returns {Promise<Object|string>} - Metrics snapshot, or Prometheus text
+ */
+export const fetchWorkerMetrics = async (format = 'json') => {
+  if (!USE_PYTHON_WORKER) {
+    throw new Error('Metrics require the Python worker (PY_WORKER_MODE=serve).');
+  }
+  const result = await sendWorkerRequest({ cmd: 'metrics', format });
+  return format === 'prometheus' ? result.text : { metrics: result.metrics, frameCache: result.frame_cache };
+};
+
+/**
+ * Runs a parameter sweep (param_sweep.py) in the Python worker: every combination of
+ * `params` applied to the strategy template is backtested on all CPU cores.
+ *
+ * @param {Object} strategy - Strategy template
+ * @param {Object} params - Parameter paths mapped to value lists or { start, stop, step } ranges
+ * @param {string} symbol - Trading symbol
+ * @param {string} timeframeId - Timeframe ID
+ * @param {Object} options - { days, rankBy, top, workers }
+ * @returns {Promise<Object>} - Sweep summary with the ranked results
+ */
+export const runServerSweep = async (strategy, params, symbol = 'AAPL', timeframeId = '1d', options = {}) => {
+  if (!USE_PYTHON_WORKER) {
+    throw new Error('Parameter sweeps require the Python worker (PY_WORKER_MODE=serve).');
+  }
+  const { days = null, rankBy = 'netProfit', top = 50, workers = null } = options;
+  const result = await sendWorkerRequest({
+    cmd: 'sweep', strategy, params, symbol, timeframe: timeframeId, days, rank_by: rankBy, top, workers,
+  });
+  return result.result;
+};
+
+/**
+ * Screens the latest bar of every cached symbol (panel_store.py), e.g. "rsi < 30".
+ *
+ * @param {string} query - Screen expression over fields (close, rsi, sma20, change_pct, ...)
+ * @param {string} timeframeId - Timeframe ID
+ * @param {Object} options - { symbols, at, sort, desc, top, refresh }
+ * @returns {Promise<Object>} - { date, universe, matches, results: [{ symbol, date, close, ... }] }
+ */
+export const runUniverseScan = async (query, timeframeId = '1d', options = {}) => {
+  if (!USE_PYTHON_WORKER) {
+    throw new Error('Universe scans require the Python worker (PY_WORKER_MODE=serve).');
+  }
+  const { symbols = null, at = null, sort = null, desc = false, top = null, refresh = false } = options;
+  const result = await sendWorkerRequest({
+    cmd: 'scan', query, timeframe: timeframeId, symbols, at, sort, desc, top, refresh,
+  });
+  return result.result;
+};
+
+/**
+ * Correlation matrix of returns between symbols (default: DEFAULT_SYMBOLS) over the last `window` bars.
+ *
+ * @param {string|Array|null} symbols - Symbols, comma-separated string or 'default'
+ * @param {string} timeframeId - Timeframe ID
+ * @param {Object} options - { window, minPeriods }
+ * @returns {Promise<Object>} - { symbols, start, end, window, matrix }
+ */
+export const fetchCorrelationMatrix = async (symbols = 'default', timeframeId = '1d', options = {}) => {
+  if (!USE_PYTHON_WORKER) {
+    throw new Error('Correlation matrices require the Python worker (PY_WORKER_MODE=serve).');
+  }
+  const { window = null, minPeriods = null } = options;
+  const result = await sendWorkerRequest({
+    cmd: 'correlation', symbols, timeframe: timeframeId, window, min_periods: minPeriods,
+  });
+  return result.result;
+};
+
+
+// --- Kolonnecache (binær) ---
+
+const COLUMN_DTYPE_READERS = {
+  '<f8': { size: 8, read: (buf, off) => buf.readDoubleLE(off) },
+  '<f4': { size: 4, read: (buf, off) => buf.readFloatLE(off) },
+  '<i8': { size: 8, read: (buf, off) => Number(buf.readBigInt64LE(off)) },
+};
+
+const zoneFormatters = new Map();
+
+/**
+ * Build a formatter that renders epoch milliseconds as local ISO 8601 in the given
+ * time zone ("2025-01-03T06:00:00-05:00"), matching md.format_dates in Python.
+ * Unknown zones fall back to UTC ("…Z").
+ *
+ * @param {string} timeZone - IANA zone name from the column store header
+ * @returns {Function} - (ms) => ISO 8601 string
+ */
+function zonedIsoFormatter(timeZone) {
+  let formatter = zoneFormatters.get(timeZone);
+  if (formatter) return formatter;
+  let parts;
+  try {
+    parts = new Intl.DateTimeFormat('en-US', {
+      timeZone, hourCycle: 'h23', year: 'numeric', month: '2-digit', day: '2-digit',
+      hour: '2-digit', minute: '2-digit', second: '2-digit',
+    });
+  } catch (error) {
+    console.warn(`JS: Unknown time zone '${timeZone}' in column store, using UTC`);
+    formatter = ms => new Date(ms).toISOString().slice(0, 19) + 'Z';
+    zoneFormatters.set(timeZone, formatter);
+    return formatter;
+  }
+  const pad = n => String(n).padStart(2, '0');
+  formatter = (ms) => {
+    const f = {};
+    for (const { type, value } of parts.formatToParts(new Date(ms))) f[type] = value;
+    // Veggklokke tolket som UTC minus faktisk tidspunkt gir UTC-offset (hele sekunder)
+    const wall = Date.UTC(+f.year, +f.month - 1, +f.day, +f.hour, +f.minute, +f.second);
+    const minutes = Math.round((wall - Math.floor(ms / 1000) * 1000) / 60000);
+    const sign = minutes < 0 ? '-' : '+';
+    const offset = `${sign}${pad(Math.floor(Math.abs(minutes) / 60))}:${pad(Math.abs(minutes) % 60)}`;
+    return `${f.year}-${f.month}-${f.day}T${f.hour}:${f.minute}:${f.second}${offset}`;
+  };
+  zoneFormatters.set(timeZone, formatter);
+  return formatter;
+}
+
+/**
+ * Load the most recent rows from a column store cache file.
+ * Only the header and the requested tail of each column are read from disk.
+ *
+ * @param {string} filePath - Path to the .col file
+ * @param {number|null} limit - Maximum number of *most recent* rows to return (optional). Null returns all.
+ * @returns {Array} - Parsed data
+ */
+function loadDataFromColumnStore(filePath, limit = null) {
+  let fd = null;
+  try {
+    fd = fs.openSync(filePath, 'r');
+    const headerBuf = Buffer.alloc(COLUMN_STORE_HEADER_SIZE);
+    fs.readSync(fd, headerBuf, 0, COLUMN_STORE_HEADER_SIZE, 0);
+    if (headerBuf.toString('latin1', 0, COLUMN_STORE_MAGIC.length) !== COLUMN_STORE_MAGIC) {
+      console.warn(`JS: Not a column store file: ${filePath}`);
+      return [];
+    }
+    const headerLength = headerBuf.readUInt32LE(8);
+    const header = JSON.parse(headerBuf.toString('utf8', 12, 12 + headerLength));
+
+    const totalRows = header.rows;
+    const count = (limit !== null && limit > 0) ? Math.min(limit, totalRows) : totalRows;
+    const startRow = totalRows - count;
+    // Intradag: lokal tid med offset i cachens tidssone, som CSV og Python-workeren
+    const formatDate = header.tz ? zonedIsoFormatter(header.tz) : ms => new Date(ms).toISOString().slice(0, 10);
+
+    const rows = Array.from({ length: count }, () => ({}));
+    let blockOffset = COLUMN_STORE_HEADER_SIZE;
+    for (const column of header.columns) {
+      const reader = COLUMN_DTYPE_READERS[column.dtype];
+      if (!reader) throw new Error(`Unsupported column dtype ${column.dtype} for '${column.name}'`);
+      const buf = Buffer.alloc(count * reader.size);
+      fs.readSync(fd, buf, 0, buf.length, blockOffset + startRow * reader.size);
+      for (let i = 0; i < count; i++) {
+        const value = reader.read(buf, i * reader.size);
+        if (column.name === 'date') {
+          rows[i].date = formatDate(value); // Daglige barer som YYYY-MM-DD
+        } else {
+          rows[i][column.name] = Number.isNaN(value) ? null : value;
+        }
+      }
+      blockOffset += header.capacity * reader.size;
+    }
+    if (header.attrs && header.attrs.symbol) {
+      rows.forEach(row => { row.symbol = header.attrs.symbol; });
+    }
+
+    console.log(`JS: Loaded ${rows.length} of ${totalRows} rows from column store ${filePath}`);
+    return rows;
+  } catch (error) {
+    console.error(`JS: Error reading column store ${filePath}:`, error);
+    return [];
+  } finally {
+    if (fd !== null) fs.closeSync(fd);
+  }
+}
 
 // --- Eksisterende CSV Hjelpefunksjoner (Uendret) ---
 
@@ -11,15 +11,42 @@ import time
 import sys # For å skrive til stderr
 from datetime import datetime, timedelta
 import pandas as pd
+import numpy as np
 import yfinance as yf
 import argparse
-import traceback # For å skrive ut full traceback ved feil
+import column_store
+import cache_lock
+import indicator_engine
+import telemetry
+import io
+import shutil
+import json
+import threading
+from collections import OrderedDict
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
 
 # --- Configuration ---
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(SCRIPT_DIR, 'market_data')
 DEFAULT_FETCH_DAYS_ARG = 365
 CACHE_HOURS = 24
+# Cache-format: 'col' (kolonnebasert binærfil, se column_store.py) eller 'csv'
+CACHE_FORMAT = os.environ.get('MARKET_DATA_CACHE_FORMAT', 'col')
+COLUMN_CACHE_EXT = '.col'
+# Minnecache for prosesserte DataFrames (LRU, begrenset av totalt antall bytes)
+FRAME_CACHE_MAX_BYTES = int(float(os.environ.get('MARKET_DATA_FRAME_CACHE_MB', '256')) * 1024 * 1024)
+DEFAULT_SERVE_WORKERS = 4 # Antall samtidige forespørsler i --serve modus
+# Inkrementell oppdatering: hent kun barer etter siste cachede dato
+INCREMENTAL_REFRESH = os.environ.get('MARKET_DATA_INCREMENTAL', '1') != '0'
+INCREMENTAL_OVERLAP_BARS = 3 # Hent de siste barene på nytt for å fange opp reviderte verdier
+INCREMENTAL_TAIL_MARGIN = 64 # Ekstra rader lest fra cachen (start hentes på dagsnivå)
+INCREMENTAL_MATCH_RTOL = 1e-6 # Overlapp-barene må stemme med cachen, ellers full oppdatering (splitt/utbytte)
+# Lavminnemodus: float32-priser/indikatorer, symbol i DataFrame.attrs i stedet for en kolonne
+# per rad, og prosessering uten mellomkopier (endres også med --low-memory)
+LOW_MEMORY = os.environ.get('MARKET_DATA_LOW_MEMORY', '0') == '1'
+LOW_MEMORY_FLOAT = np.float32
+INTRADAY_INTERVALS = ['1m', '2m', '5m', '15m', '30m', '60m', '90m', '1h']
 DEFAULT_SYMBOLS = [ # Forkortet for eksempel
     {'symbol': 'AAPL', 'name': 'Apple Inc.', 'type': 'stock'},
     {'symbol': 'MSFT', 'name': 'Microsoft Corporation', 'type': 'stock'},
@@ -34,94 +61,88 @@ DEFAULT_SYMBOLS = [ # Forkortet for eksempel
     {'symbol': 'GBPUSD=X', 'name': 'GBP/USD', 'type': 'forex'},
     {'symbol': 'JPY=X', 'name': 'USD/JPY', 'type': 'forex'},
 ]
+# Tidsrammer med 'base' lastes ikke ned, men aggregeres lokalt fra base-serien i cachen
+# ('rule': bøttelengde som pandas-frekvens, eller 'W' = uke fra mandag / 'M' = kalendermåned)
 AVAILABLE_TIMEFRAMES = [
     {'id': '1h', 'name': '1 Hour', 'yf_interval': '1h'},
-    # OBS: '4h' er IKKE en standard yfinance interval. Kan gi feil.
-    # {'id': '4h', 'name': '4 Hours', 'yf_interval': '4h'}, # Vurder å fjerne eller finne alternativ
+    {'id': '2h', 'name': '2 Hours', 'yf_interval': '2h', 'base': '1h', 'rule': '2h'},
+    {'id': '4h', 'name': '4 Hours', 'yf_interval': '4h', 'base': '1h', 'rule': '4h'},
     {'id': '1d', 'name': '1 Day', 'yf_interval': '1d'},
-    {'id': '1wk', 'name': '1 Week', 'yf_interval': '1wk'},
-    {'id': '1mo', 'name': '1 Month', 'yf_interval': '1mo'},
+    {'id': '3d', 'name': '3 Days', 'yf_interval': '3d', 'base': '1d', 'rule': '3D'},
+    {'id': '1wk', 'name': '1 Week', 'yf_interval': '1wk', 'base': '1d', 'rule': 'W'},
+    {'id': '1mo', 'name': '1 Month', 'yf_interval': '1mo', 'base': '1d', 'rule': 'M'},
 ]
 # ---------------------
 
-# --- Hjelpefunksjoner ---
-
-def print_debug(message):
-    """Helper for DEBUG level prints"""
-    print(f"Py DEBUG: {message}", file=sys.stdout) # Skriv til stdout
-
-def print_info(message):
-    """Helper for INFO level prints"""
-    print(f"Py INFO: {message}", file=sys.stdout)
-
-def print_warning(message):
-    """Helper for WARNING level prints"""
-    # Skriv advarsler til stderr slik at Node.js kan se dem separat hvis ønskelig
-    print(f"Py WARNING: {message}", file=sys.stderr)
+# yf.download bruker globale tilstander internt (shared._DFS), så samtidige kall
+# fra flere tråder kan blande resultater. Cache-treff og prosessering går parallelt.
+_YF_DOWNLOAD_LOCK = threading.Lock()
+# Samtidige forespørsler for samme symbol/intervall deler én nedlasting (i prosessen);
+# på tvers av prosesser serialiseres skriving per nøkkel med fillåser.
+_fetch_flight = cache_lock.SingleFlight()
+CACHE_LOCK_TIMEOUT_SECONDS = 300
 
-def print_error(message, include_traceback=False):
-    """Helper for ERROR level prints"""
-    print(f"Py ERROR: {message}", file=sys.stderr)
-    if include_traceback:
-        traceback.print_exc(file=sys.stderr) # Skriv full traceback til stderr
+# --- Hjelpefunksjoner ---
+# Nivåstyrt logging og metrikker ligger i telemetry.py (re-eksportert herfra)
+from telemetry import print_debug, print_info, print_warning, print_error
 
 # --- Kjernefunksjoner ---
 
+@telemetry.timed('cache_check')
 def is_cached_file_fresh(filepath, hours=CACHE_HOURS):
     """Check if cached file exists and is fresh"""
     if not os.path.exists(filepath):
-        print_debug(f"Cache check: File not found - {os.path.basename(filepath)}")
+        print_debug("Cache check: File not found - %s", os.path.basename(filepath))
         return False
     try:
         file_mod_time = os.path.getmtime(filepath)
         file_age_seconds = time.time() - file_mod_time
         is_fresh = file_age_seconds < (hours * 3600)
-        print_debug(f"Cache check: File '{os.path.basename(filepath)}' age {file_age_seconds:.0f}s. Fresh: {is_fresh} (Threshold: {hours*3600}s)")
+        print_debug("Cache check: File '%s' age %.0fs. Fresh: %s (Threshold: %ss)", os.path.basename(filepath), file_age_seconds, is_fresh, hours*3600)
         return is_fresh
     except OSError as e:
         print_warning(f"Could not get modification time for {filepath}: {e}")
         return False
 
+# Indikatorer som lagres i cachen, og kolonnenavnene de lagres under
+CACHED_INDICATORS = {'sma:20': {'sma20': 'sma20'}, 'rsi:14': {'rsi14': 'rsi'}}
+# Antall foregående barer indikatorene trenger ved beregning over halen
+INDICATOR_LOOKBACK_BARS = indicator_engine.required_lookback(CACHED_INDICATORS)
+
+@telemetry.timed('indicators')
 def calculate_indicators(df):
-    """Calculate SMA20 and RSI14 indicators"""
-    print_debug(f"Calculating indicators for DataFrame with shape {df.shape}")
+    """Calculate the cached indicators (SMA20, Wilder RSI14) with the indicator engine"""
+    print_debug("Calculating indicators for DataFrame with shape %s", df.shape)
     close_col = 'close'
     if close_col not in df.columns:
         print_error(f"'{close_col}' column not found for indicator calculation.")
         return df
 
-    # Kopier for å unngå SettingWithCopyWarning hvis df er en slice (selv om det kanskje ikke er tilfelle her)
-    df_out = df.copy()
-
     try:
-        # Beregn SMA20
-        df_out['sma20'] = df_out[close_col].rolling(window=20, min_periods=20).mean()
-        print_debug("SMA20 calculated.")
-
-        # Beregn RSI14
-        delta = df_out[close_col].diff()
-        gain = delta.where(delta > 0, 0.0).rolling(window=14, min_periods=1).mean()
-        loss = -delta.where(delta < 0, 0.0).rolling(window=14, min_periods=1).mean()
-        # Håndter tilfeller der loss er null for å unngå divisjon med null
-        loss = loss.replace(0, 1e-10) # Bruk en veldig liten verdi i stedet for 0
-        rs = gain / loss
-        df_out['rsi'] = 100.0 - (100.0 / (1.0 + rs))
-        # df['rsi'].fillna(50.0, inplace=True) # Gammel metode (kan gi warning)
-        df_out['rsi'] = df_out['rsi'].fillna(50.0) # Ny, sikrere metode
-        print_debug("RSI14 calculated.")
+        results = indicator_engine.compute_indicators(df, CACHED_INDICATORS)
+        # Kopier for å unngå SettingWithCopyWarning hvis df er en slice; lavminnemodus skriver på stedet
+        df_out = df if LOW_MEMORY else df.copy()
+        for column_map in CACHED_INDICATORS.values():
+            for engine_name, cache_name in column_map.items():
+                values = results[engine_name]
+                if cache_name == 'rsi':
+                    # RSI er udefinert for de første barene; bruk nøytral 50 som før
+                    values = np.where(np.isnan(values), 50.0, values)
+                df_out[cache_name] = values.astype(LOW_MEMORY_FLOAT) if LOW_MEMORY else values
+        print_debug("Indicators calculated: %s", list(CACHED_INDICATORS))
     except Exception as e:
         print_error(f"Error during indicator calculation: {e}", include_traceback=True)
-        # Returner den *originale* df hvis beregning feiler, siden df_out kan være delvis modifisert
+        # Returner den *originale* df hvis beregning feiler (resultatene skrives først når alt er beregnet)
         return df
 
-    print_debug(f"Indicators calculation complete. DataFrame shape {df_out.shape}")
+    print_debug("Indicators calculation complete. DataFrame shape %s", df_out.shape)
     return df_out
 
 def map_timeframe_id_to_yf_interval(timeframe_id):
     """Find the Yahoo Finance interval string"""
     for tf in AVAILABLE_TIMEFRAMES:
         if tf['id'] == timeframe_id or tf['yf_interval'] == timeframe_id:
-            print_debug(f"Mapped timeframe ID '{timeframe_id}' to yf_interval '{tf['yf_interval']}'")
+            print_debug("Mapped timeframe ID '%s' to yf_interval '%s'", timeframe_id, tf['yf_interval'])
             return tf['yf_interval']
     print_warning(f"Timeframe ID '{timeframe_id}' not found in AVAILABLE_TIMEFRAMES. Using default '1d'.")
     return '1d'
@@ -135,18 +156,27 @@ def save_default_lists():
 
     if not os.path.exists(symbols_file):
         try:
-            pd.DataFrame(DEFAULT_SYMBOLS).to_csv(symbols_file, index=False)
+            cache_lock.atomic_write(symbols_file, lambda tmp: pd.DataFrame(DEFAULT_SYMBOLS).to_csv(tmp, index=False))
             print_info(f"Saved default symbols to {symbols_file}")
         except Exception as e:
             print_warning(f"Could not save default symbols: {e}")
     else:
         print_debug("Default symbols file already exists.")
 
+    # Filtrer ut ugyldige timeframes før lagring (avledede tidsrammer er alltid gyldige)
+    valid_timeframes = [tf for tf in AVAILABLE_TIMEFRAMES if tf.get('base') or tf['yf_interval'] in ['1m', '2m', '5m', '15m', '30m', '60m', '90m', '1h', '1d', '5d', '1wk', '1mo', '3mo']]
+    if os.path.exists(timeframes_file):
+        try:
+            if pd.read_csv(timeframes_file)['id'].tolist() != [tf['id'] for tf in valid_timeframes]:
+                print_info("Timeframes file is outdated, rewriting it.")
+                os.remove(timeframes_file)
+        except Exception as e:
+            print_warning(f"Could not check timeframes file: {e}")
+
     if not os.path.exists(timeframes_file):
         try:
-            # Filtrer ut ugyldige timeframes før lagring hvis nødvendig
-            valid_timeframes = [tf for tf in AVAILABLE_TIMEFRAMES if tf['yf_interval'] in ['1m', '2m', '5m', '15m', '30m', '60m', '90m', '1h', '1d', '5d', '1wk', '1mo', '3mo']]
-            pd.DataFrame(valid_timeframes).to_csv(timeframes_file, index=False)
+            timeframes_frame = pd.DataFrame(valid_timeframes, columns=['id', 'name', 'yf_interval'])
+            cache_lock.atomic_write(timeframes_file, lambda tmp: timeframes_frame.to_csv(tmp, index=False))
             print_info(f"Saved available timeframes to {timeframes_file}")
         except Exception as e:
             print_warning(f"Could not save timeframes: {e}")
@@ -156,22 +186,120 @@ def save_default_lists():
     print_info("Default lists check/save complete.")
 
 
+# --- Bruksstatistikk (popularitet for cache-oppvarming) ---
+ACCESS_STATS_FILE = 'access_stats.json'
+ACCESS_FLUSH_SECONDS = 60
+_access_counts = {}
+_access_lock = threading.Lock()
+_last_access_flush = time.time()
+
+def record_access(symbol, yf_interval):
+    """Count a request for symbol/interval; counts are flushed to disk periodically"""
+    global _last_access_flush
+    key = f"{symbol}|{yf_interval}"
+    with _access_lock:
+        _access_counts[key] = _access_counts.get(key, 0) + 1
+        due = time.time() - _last_access_flush >= ACCESS_FLUSH_SECONDS
+    if due:
+        flush_access_stats()
+
+def load_access_stats():
+    """Return {(symbol, yf_interval): {'hits': n, 'last_access': epoch}} from disk"""
+    stats_file = os.path.join(DATA_DIR, ACCESS_STATS_FILE)
+    try:
+        with open(stats_file, 'r', encoding='utf-8') as f:
+            raw = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {tuple(key.split('|', 1)): value for key, value in raw.items() if '|' in key}
+
+def flush_access_stats():
+    """
+    Merge in-memory access counts into the stats file. The read-merge-write runs under
+    a cross-process lock, so concurrent flushes from several processes do not lose hits.
+    """
+    global _last_access_flush
+    with _access_lock:
+        pending = dict(_access_counts)
+        _access_counts.clear()
+        _last_access_flush = time.time()
+    if not pending:
+        return
+    try:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        with cache_lock.FileLock(DATA_DIR, 'access_stats', timeout=CACHE_LOCK_TIMEOUT_SECONDS):
+            stats = {f"{sym}|{interval}": value for (sym, interval), value in load_access_stats().items()}
+            now = time.time()
+            for key, hits in pending.items():
+                entry = stats.setdefault(key, {'hits': 0, 'last_access': now})
+                entry['hits'] += hits
+                entry['last_access'] = now
+            def write(tmp_path):
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(stats, f)
+            cache_lock.atomic_write(os.path.join(DATA_DIR, ACCESS_STATS_FILE), write, suffix='.json')
+    except Exception as e:
+        print_warning(f"Could not save access stats: {e}")
+        with _access_lock: # Behold tellingene til neste forsøk
+            for key, hits in pending.items():
+                _access_counts[key] = _access_counts.get(key, 0) + hits
+
 # --- Kjernefunksjon for datahenting ---
-def fetch_market_data_yf(symbol, timeframe_id='1d', days_arg=DEFAULT_FETCH_DAYS_ARG):
-    """Fetch market data based on timeframe, cache, calc indicators."""
-    print_info(f"--- Starting fetch_market_data_yf for {symbol} ({timeframe_id}) ---")
-    yf_interval = map_timeframe_id_to_yf_interval(timeframe_id)
-    safe_symbol = symbol.replace('/','-').replace('=','_') # For filnavn
-    cache_file = os.path.join(DATA_DIR, f"{safe_symbol}_{yf_interval}_data.csv")
-    print_debug(f"Cache file path: {cache_file}")
+def _safe_symbol(symbol):
+    return symbol.replace('/','-').replace('=','_') # For filnavn
 
-    # 1. Check Cache
-    if is_cached_file_fresh(cache_file):
-        print_info(f"Using fresh cached data for {symbol} ({yf_interval})")
-        return cache_file
+def get_cache_file_path(symbol, yf_interval, cache_format=None):
+    """Build the cache file path for a symbol/interval"""
+    extension = COLUMN_CACHE_EXT if (cache_format or CACHE_FORMAT) == 'col' else '.csv'
+    return os.path.join(DATA_DIR, f"{_safe_symbol(symbol)}_{yf_interval}_data{extension}")
 
-    # 2. Determine Fetch Period
-    end_date = datetime.now()
+def cache_file_lock(symbol, yf_interval):
+    """Cross-process lock guarding downloads and writes of one symbol/interval cache"""
+    return cache_lock.FileLock(DATA_DIR, f"{_safe_symbol(symbol)}_{yf_interval}", timeout=CACHE_LOCK_TIMEOUT_SECONDS)
+
+def is_column_cache(cache_file):
+    return cache_file.endswith(COLUMN_CACHE_EXT)
+
+def open_column_store(cache_file):
+    """ColumnStore reader; in low-memory mode the symbol stays in DataFrame.attrs"""
+    return column_store.ColumnStore(cache_file, attrs_as_columns=not LOW_MEMORY)
+
+@telemetry.timed('write')
+def write_cache_file(data, cache_file, symbol, yf_interval):
+    """Write a processed frame to the cache in the format given by the file extension"""
+    if is_column_cache(cache_file):
+        column_store.write_frame(cache_file, data, attrs={'symbol': symbol, 'interval': yf_interval})
+    else:
+        if 'symbol' not in data.columns: # Lavminnemodus: CSV-filen beholder symbolkolonnen
+            data = data.assign(symbol=symbol)
+        # La pandas håndtere datoformat; temp-fil + rename så lesere aldri ser en halvskrevet fil
+        cache_lock.atomic_write(cache_file, lambda tmp: data.to_csv(tmp, index=False), suffix='.csv')
+    telemetry.increment('bytes_written', os.path.getsize(cache_file))
+
+@telemetry.timed('load')
+def load_cache_frame(cache_file, last_rows=None):
+    """Read a cache file (column store or CSV) into a DataFrame, optionally only the last rows"""
+    if is_column_cache(cache_file):
+        store = open_column_store(cache_file)
+        return store.tail(last_rows) if last_rows else store.read_frame()
+    if last_rows:
+        return read_csv_tail(cache_file, last_rows)[0]
+    return pd.read_csv(cache_file)
+
+def export_cache_to_csv(symbol, timeframe_id='1d', output_path=None):
+    """Export a cached series to CSV (the legacy cache layout). Returns the CSV path."""
+    yf_interval = map_timeframe_id_to_yf_interval(timeframe_id)
+    cache_file = get_cache_file_path(symbol, yf_interval)
+    if not os.path.exists(cache_file):
+        raise FileNotFoundError(f"No cached data for {symbol} ({yf_interval}) at {cache_file}")
+    output_path = output_path or get_cache_file_path(symbol, yf_interval, cache_format='csv')
+    data = load_cache_frame(cache_file)
+    cache_lock.atomic_write(output_path, lambda tmp: data.to_csv(tmp, index=False), suffix='.csv')
+    print_info(f"Exported {len(data)} rows for {symbol} ({yf_interval}) to {output_path}")
+    return output_path
+
+def determine_fetch_start(yf_interval, end_date):
+    """Return (start_date, description) for a full-history fetch of the interval"""
     start_date = None
     fetch_description = "MAX available"
     # yfinance krever start/slutt for < 1d intervaller, og har begrensninger på hvor langt tilbake
@@ -200,13 +328,12 @@ def fetch_market_data_yf(symbol, timeframe_id='1d', days_arg=DEFAULT_FETCH_DAYS_
              print_warning(f"Unknown interval '{yf_interval}', attempting MAX history fetch.")
              start_date = None
              fetch_description = "MAX available"
+    return start_date, fetch_description
 
-    print_info(f"Fetching {fetch_description} historical data for {symbol} (Interval: {yf_interval})...")
-    if start_date: print_debug(f"Calculated fetch range: {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}")
-
-    try:
-        # 3. Fetch Data
-        print_debug(f"Calling yf.download(tickers='{symbol}', start={start_date}, end={end_date}, interval='{yf_interval}')")
+def download_yf_data(symbol, yf_interval, start_date, end_date):
+    """Call yf.download for one symbol (serialized, see _YF_DOWNLOAD_LOCK)"""
+    print_debug("Calling yf.download(tickers='%s', start=%s, end=%s, interval='%s')", symbol, start_date, end_date, yf_interval)
+    with _YF_DOWNLOAD_LOCK, telemetry.timed('download'): # Ventetid på låsen telles ikke med
         data = yf.download(
             tickers=symbol,
             start=start_date,
@@ -216,146 +343,446 @@ def fetch_market_data_yf(symbol, timeframe_id='1d', days_arg=DEFAULT_FETCH_DAYS_
             auto_adjust=True, # Bruker justerte priser
             # group_by='ticker' # Kan være nyttig hvis du henter flere symboler
         )
-        print_debug(f"yf.download finished. DataFrame is empty: {data.empty}")
-
-        if data.empty:
-             print_warning(f"No data returned by yfinance for {symbol} (Interval: {yf_interval}).")
-             if os.path.exists(cache_file):
-                 print_info(f"Keeping potentially stale cache for {symbol}.")
-                 return cache_file # Returner gammel cache hvis den finnes
-             return None # Ingen data og ingen cache
-
-        print_debug(f"Initial data shape: {data.shape}, Columns: {data.columns.tolist()}, Index name: {data.index.name}")
-
-        # 4. Process Data
-
-        # --- VIKTIG FIX: Håndter MultiIndex Kolonner ---
-        if isinstance(data.columns, pd.MultiIndex):
-            print_debug("Detected MultiIndex columns. Flattening by keeping first level...")
-            # Behold kun det øverste nivået (f.eks. 'Open', 'High', 'Low', 'Close', 'Volume')
-            data.columns = data.columns.get_level_values(0)
-            print_debug(f"Columns after flattening: {data.columns.tolist()}")
-        # --- SLUTT FIX ---
-
-        # Reset index for å få 'Date'/'Datetime' som kolonne
-        original_index_name = data.index.name or 'Date' # Gjett 'Date' hvis navnet er None
-        data = data.reset_index()
-        print_debug(f"Shape after reset_index: {data.shape}, Columns: {data.columns.tolist()}")
-
-        # --- FORBEDRET: Identifiser og Omdøp Kolonner ---
-        # Finn datokolonnen (kan hete 'Date' eller 'Datetime' eller navnet fra index)
-        date_col_original_name = None
-        possible_date_names = [original_index_name, 'Date', 'Datetime']
-        for name in possible_date_names:
-            if name in data.columns:
-                date_col_original_name = name
-                break
-
-        if not date_col_original_name:
-             print_error(f"Could not identify the date column after reset_index for {symbol}. Columns: {data.columns.tolist()}")
-             if os.path.exists(cache_file): return cache_file
-             return None
-        print_debug(f"Identified original date column as: '{date_col_original_name}'")
-
-        # Definer ønskede kolonner og deres nye navn (nå med enkle strenger)
-        rename_map = {
-            date_col_original_name: 'date',
-            'Open': 'open',
-            'High': 'high',
-            'Low': 'low',
-            'Close': 'close',
-            'Volume': 'volume'
-            # Legg til 'Adj Close' hvis du satte auto_adjust=False
-        }
+    print_debug("yf.download finished. DataFrame is empty: %s", data.empty)
+    telemetry.increment('downloads')
+    telemetry.increment('download_rows', len(data))
+    return data
 
-        # Omdøp kun de kolonnene som faktisk finnes
-        columns_to_rename = {k: v for k, v in rename_map.items() if k in data.columns}
-        data.rename(columns=columns_to_rename, inplace=True)
-        print_debug(f"Columns after applying rename map {columns_to_rename}: {data.columns.tolist()}")
+@telemetry.timed('normalize')
+def normalize_yf_data(data, symbol, yf_interval):
+    """
+    Turn a raw yf.download frame into the cache layout
+    (date, open, high, low, close, volume, symbol). Returns None on failure.
+    """
+    print_debug("Initial data shape: %s, Columns: %s, Index name: %s", data.shape, data.columns, data.index.name)
+    if LOW_MEMORY:
+        return build_lean_frame(data, symbol, yf_interval)
 
-        # Sjekk om 'date'-kolonnen faktisk ble opprettet
-        if 'date' not in data.columns:
-            print_error(f"'date' column missing after rename attempt for {symbol}. Columns: {data.columns.tolist()}")
-            if os.path.exists(cache_file): return cache_file
-            return None
-        # --- SLUTT FORBEDRING ---
+    # --- VIKTIG FIX: Håndter MultiIndex Kolonner ---
+    if isinstance(data.columns, pd.MultiIndex):
+        print_debug("Detected MultiIndex columns. Flattening by keeping first level...")
+        # Behold kun det øverste nivået (f.eks. 'Open', 'High', 'Low', 'Close', 'Volume')
+        data.columns = data.columns.get_level_values(0)
+        print_debug("Columns after flattening: %s", data.columns)
+    # --- SLUTT FIX ---
 
-        # Konverter 'date'-kolonnen til riktig format
-        try:
-            print_debug(f"Converting 'date' column to datetime objects...")
-            data['date'] = pd.to_datetime(data['date'])
-            # Behold som datetime for intradag, konverter til date for daglig+
-            is_intraday = yf_interval in ['1m', '2m', '5m', '15m', '30m', '60m', '90m', '1h']
-            if not is_intraday:
-                 # For daglig/ukentlig/månedlig, behold kun dato-delen
-                 # Viktig: Bruk .dt.normalize() for å sette klokkeslett til 00:00:00
-                 #          i stedet for .dt.date som konverterer til Python date objekter
-                 data['date'] = data['date'].dt.normalize()
-                 print_debug("'date' column normalized to midnight (kept as datetime).")
-            else:
-                 print_debug("'date' column kept as datetime objects (intraday).")
-        except Exception as date_err:
-            print_warning(f"Error converting 'date' column for {symbol}: {date_err}")
-            # Ikke kritisk feil, fortsett, men dropna/sortering kan feile
+    # Reset index for å få 'Date'/'Datetime' som kolonne
+    original_index_name = data.index.name or 'Date' # Gjett 'Date' hvis navnet er None
+    data = data.reset_index()
+    print_debug("Shape after reset_index: %s, Columns: %s", data.shape, data.columns)
 
-        # Legg til symbol-kolonne
-        data['symbol'] = symbol
+    # --- FORBEDRET: Identifiser og Omdøp Kolonner ---
+    # Finn datokolonnen (kan hete 'Date' eller 'Datetime' eller navnet fra index)
+    date_col_original_name = None
+    possible_date_names = [original_index_name, 'Date', 'Datetime']
+    for name in possible_date_names:
+        if name in data.columns:
+            date_col_original_name = name
+            break
+
+    if not date_col_original_name:
+         print_error(f"Could not identify the date column after reset_index for {symbol}. Columns: {data.columns.tolist()}")
+         return None
+    print_debug("Identified original date column as: '%s'", date_col_original_name)
+
+    # Definer ønskede kolonner og deres nye navn (nå med enkle strenger)
+    rename_map = {
+        date_col_original_name: 'date',
+        'Open': 'open',
+        'High': 'high',
+        'Low': 'low',
+        'Close': 'close',
+        'Volume': 'volume'
+        # Legg til 'Adj Close' hvis du satte auto_adjust=False
+    }
+
+    # Omdøp kun de kolonnene som faktisk finnes
+    columns_to_rename = {k: v for k, v in rename_map.items() if k in data.columns}
+    data.rename(columns=columns_to_rename, inplace=True)
+    print_debug("Columns after applying rename map %s: %s", columns_to_rename, data.columns)
+
+    # Sjekk om 'date'-kolonnen faktisk ble opprettet
+    if 'date' not in data.columns:
+        print_error(f"'date' column missing after rename attempt for {symbol}. Columns: {data.columns.tolist()}")
+        return None
+    # --- SLUTT FORBEDRING ---
+
+    # Konverter 'date'-kolonnen til riktig format
+    try:
+        print_debug("Converting 'date' column to datetime objects...")
+        data['date'] = pd.to_datetime(data['date'])
+        # Behold som datetime for intradag, konverter til date for daglig+
+        is_intraday = yf_interval in INTRADAY_INTERVALS
+        if not is_intraday:
+             # For daglig/ukentlig/månedlig, behold kun dato-delen
+             # Viktig: Bruk .dt.normalize() for å sette klokkeslett til 00:00:00
+             #          i stedet for .dt.date som konverterer til Python date objekter
+             data['date'] = data['date'].dt.normalize()
+             print_debug("'date' column normalized to midnight (kept as datetime).")
+        else:
+             print_debug("'date' column kept as datetime objects (intraday).")
+    except Exception as date_err:
+        print_warning(f"Error converting 'date' column for {symbol}: {date_err}")
+        # Ikke kritisk feil, fortsett, men dropna/sortering kan feile
+
+    # Legg til symbol-kolonne
+    data['symbol'] = symbol
+
+    # Velg ut nødvendige kolonner FØR indikatorberegning for renhet
+    required_cols = ['date', 'open', 'high', 'low', 'close', 'volume', 'symbol']
+    available_cols = [col for col in required_cols if col in data.columns]
+    # Sjekk om essensielle kolonner mangler
+    if 'close' not in available_cols or 'date' not in available_cols:
+         print_error(f"Essential columns ('date', 'close') missing before indicator calculation. Available: {available_cols}")
+         return None
+    data = data[available_cols]
+    print_debug("Selected columns: %s. Shape before indicators: %s", available_cols, data.shape)
+    return data
+
+def build_lean_frame(data, symbol, yf_interval):
+    """
+    Low-memory variant of normalize_yf_data: the cache columns are built straight
+    from the download's arrays (no reset_index/column-selection copies), prices
+    as float32, and the symbol is kept in DataFrame.attrs. Returns None on failure.
+    """
+    fields = data.columns.get_level_values(0) if isinstance(data.columns, pd.MultiIndex) else data.columns
+    positions = {name: i for i, name in enumerate(fields)}
+    if 'Close' not in positions:
+        print_error(f"Essential column 'Close' missing in download for {symbol}. Columns: {list(fields)}")
+        return None
+    try:
+        dates = pd.to_datetime(data.index)
+        if yf_interval not in INTRADAY_INTERVALS:
+            dates = dates.normalize()
+    except Exception as date_err:
+        print_error(f"Error converting the date index for {symbol}: {date_err}")
+        return None
+
+    columns = {'date': dates}
+    for source, target in [('Open', 'open'), ('High', 'high'), ('Low', 'low'), ('Close', 'close'), ('Volume', 'volume')]:
+        if source in positions:
+            values = data.iloc[:, positions[source]].to_numpy()
+            columns[target] = values if target == 'volume' else values.astype(LOW_MEMORY_FLOAT)
+    frame = pd.DataFrame(columns, copy=False)
+    frame.attrs['symbol'] = symbol
+    print_debug("Lean frame for %s: %s rows, dtypes %s", symbol, len(frame), frame.dtypes)
+    return frame
 
-        # Velg ut nødvendige kolonner FØR indikatorberegning for renhet
-        required_cols = ['date', 'open', 'high', 'low', 'close', 'volume', 'symbol']
-        available_cols = [col for col in required_cols if col in data.columns]
-        # Sjekk om essensielle kolonner mangler
-        if 'close' not in available_cols or 'date' not in available_cols:
-             print_error(f"Essential columns ('date', 'close') missing before indicator calculation. Available: {available_cols}")
-             if os.path.exists(cache_file): return cache_file
-             return None
-        data = data[available_cols]
-        print_debug(f"Selected columns: {available_cols}. Shape before indicators: {data.shape}")
-
-        # Beregn indikatorer
-        data = calculate_indicators(data)
-
-        # Fjern rader med manglende essensielle verdier (NÅ SKAL 'date' finnes!)
-        essential_subset = ['date', 'open', 'high', 'low', 'close', 'volume']
-        cols_to_check = [col for col in essential_subset if col in data.columns]
-        original_rows = len(data)
-        print_debug(f"Shape before dropna (subset={cols_to_check}): {data.shape}")
+def finalize_data(data, symbol):
+    """Drop incomplete rows, sort by date and calculate indicators"""
+    # Ufullstendige barer fjernes først, så de ikke inngår i indikatorvinduene
+    data = drop_incomplete_and_sort(data, symbol)
+    if data.empty:
+        return data
+    return calculate_indicators(data)
+
+@telemetry.timed('dropna_sort')
+def drop_incomplete_and_sort(data, symbol):
+    """Drop rows missing essential OHLCV values and sort by date (in place)"""
+    # Fjern rader med manglende essensielle verdier (NÅ SKAL 'date' finnes!)
+    essential_subset = ['date', 'open', 'high', 'low', 'close', 'volume']
+    cols_to_check = [col for col in essential_subset if col in data.columns]
+    original_rows = len(data)
+    print_debug("Shape before dropna (subset=%s): %s", cols_to_check, data.shape)
+    # dropna kopierer hele rammen; sjekk kolonnene først (vanligvis finnes ingen hull)
+    if any(data[col].hasnans for col in cols_to_check):
         data.dropna(subset=cols_to_check, inplace=True) # Bruk 'inplace=True' her er OK
-        rows_dropped = original_rows - len(data)
-        if rows_dropped > 0: print_info(f"Removed {rows_dropped} rows with missing values in {cols_to_check} for {symbol}.")
-        print_debug(f"Shape after dropna: {data.shape}")
-
-        if data.empty:
-            print_warning(f"DataFrame became empty after removing NaNs for {symbol}. No data to save.")
-            # Slett gammel cache hvis den er utdatert? Eller behold den? For nå, behold.
-            if os.path.exists(cache_file): print_info(f"Keeping potentially stale cache for {symbol}.")
-            return cache_file if os.path.exists(cache_file) else None
+    rows_dropped = original_rows - len(data)
+    if rows_dropped > 0: print_info(f"Removed {rows_dropped} rows with missing values in {cols_to_check} for {symbol}.")
+    print_debug("Shape after dropna: %s", data.shape)
 
+    if data.empty:
+        return data
 
-        # Sorter etter dato
-        try:
+    # Sorter etter dato (yfinance leverer normalt sortert; da hoppes sorteringen over)
+    try:
+         if not data['date'].is_monotonic_increasing:
              print_debug("Sorting data by date...")
              data.sort_values(by='date', ascending=True, inplace=True)
              print_debug("Sorting complete.")
-        except Exception as sort_err:
-            print_warning(f"Could not sort data by date for {symbol}: {sort_err}")
+    except Exception as sort_err:
+        print_warning(f"Could not sort data by date for {symbol}: {sort_err}")
+    return data
 
-        # 5. Save to Cache
-        os.makedirs(DATA_DIR, exist_ok=True)
-        try:
-            # Bruk ISO 8601 format for datetime, standard YYYY-MM-DD for date
-            # Pandas' to_csv håndterer dette bra automatisk basert på dtype
-            print_info(f"Saving data ({len(data)} rows) for {symbol} ({yf_interval}) to {cache_file}")
-            data.to_csv(cache_file, index=False) # La pandas håndtere datoformat
-            print_info(f"Save successful for {symbol} ({yf_interval}).")
+# --- Inkrementell oppdatering av cache ---
+def _to_utc(dates):
+    """Convert a date Series to tz-aware UTC so cached and fresh bars compare equal"""
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        return pd.to_datetime(dates, utc=True) # Tekst fra CSV (med eller uten UTC-offset)
+    if dates.dt.tz is None:
+        return dates.dt.tz_localize('UTC')
+    return dates.dt.tz_convert('UTC')
+
+def read_csv_tail(filepath, n_rows, block_size=65536):
+    """
+    Read the header and the last n_rows rows of a CSV file by seeking from the end.
+    Returns (tail DataFrame, byte offset of each tail row), without parsing the whole file.
+    """
+    with open(filepath, 'rb') as f:
+        header_line = f.readline()
+        header_end = f.tell()
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        buffer = b''
+        while pos > header_end and buffer.count(b'\n') <= n_rows:
+            read_size = min(block_size, pos - header_end)
+            pos -= read_size
+            f.seek(pos)
+            buffer = f.read(read_size) + buffer
+
+    rows, offsets = [], []
+    offset = pos
+    for i, line in enumerate(buffer.split(b'\n')):
+        line_start = offset
+        offset += len(line) + 1
+        if i == 0 and pos > header_end:
+            continue # Første linje er delvis lest
+        if line.strip():
+            rows.append(line.rstrip(b'\r'))
+            offsets.append(line_start)
+    rows, offsets = rows[-n_rows:], offsets[-n_rows:]
+    tail = pd.read_csv(io.BytesIO(header_line + b'\n'.join(rows) + b'\n'))
+    return tail, offsets
+
+def read_cache_tail(cache_file, n_rows):
+    """
+    Read the last n_rows of a cache file. Returns (tail DataFrame, positions), where
+    positions[i] is where tail row i starts (byte offset for CSV, row index for the
+    column store) and positions[-1] is the end of the data.
+    """
+    if is_column_cache(cache_file):
+        store = open_column_store(cache_file)
+        start = max(0, store.rows - n_rows)
+        return store.read_frame(start), list(range(start, store.rows + 1))
+    tail, offsets = read_csv_tail(cache_file, n_rows)
+    return tail, offsets + [os.path.getsize(cache_file)]
+
+@telemetry.timed('write')
+def replace_cache_tail(cache_file, position, rows, columns):
+    """
+    Replace everything from position (see read_cache_tail) onward with rows.
+    The column store appends in place and commits the new row count in its header last
+    (revised committed rows trigger an atomic rewrite); a CSV is rebuilt as a temp file
+    (copied prefix + new rows) and renamed into place.
+    """
+    if is_column_cache(cache_file):
+        column_store.write_tail(cache_file, rows[columns], position)
+        telemetry.increment('bytes_written', int(rows[columns].memory_usage(index=False).sum()))
+        return
+
+    def write(tmp_path):
+        shutil.copyfile(cache_file, tmp_path)
+        with open(tmp_path, 'r+b') as f:
+            f.truncate(position)
+        rows[columns].to_csv(tmp_path, mode='a', header=False, index=False)
+    cache_lock.atomic_write(cache_file, write, suffix='.csv')
+    telemetry.increment('bytes_written', os.path.getsize(cache_file)) # Hele filen skrives på nytt
+
+def read_incremental_state(symbol, yf_interval, cache_file):
+    """
+    Read the cached tail needed for an incremental refresh.
+    Returns (old_tail, positions, overlap_start) or None if the cache cannot be extended.
+    """
+    read_rows = INDICATOR_LOOKBACK_BARS + INCREMENTAL_OVERLAP_BARS + INCREMENTAL_TAIL_MARGIN
+    try:
+        old_tail, positions = read_cache_tail(cache_file, read_rows)
+    except Exception as e:
+        print_warning(f"Could not read tail of cache file {cache_file}: {e}")
+        return None
+    if 'date' not in old_tail.columns or 'close' not in old_tail.columns or len(old_tail) <= INCREMENTAL_OVERLAP_BARS:
+        print_debug("Cache tail for %s (%s) unusable for incremental refresh.", symbol, yf_interval)
+        return None
+    overlap_start = _to_utc(old_tail['date']).iloc[-INCREMENTAL_OVERLAP_BARS]
+    return old_tail, positions, overlap_start
+
+def overlap_matches(old_tail, new_data):
+    """
+    True when the re-downloaded overlap bars match the cached ones (open/close within
+    INCREMENTAL_MATCH_RTOL). The last cached bar is skipped, since it may have been a
+    partial bar. Prices are adjusted (auto_adjust), so a split or dividend rescales all
+    earlier bars; a mismatch means the cached history is stale and must be re-downloaded.
+    """
+    old_ms = _utc_ms(old_tail['date'])[:-1]
+    _, old_idx, new_idx = np.intersect1d(old_ms, _utc_ms(new_data['date']), return_indices=True)
+    if not len(old_idx):
+        return False # Ingenting å sammenligne med: kan ikke bekrefte at historikken er uendret
+    for col in ('open', 'close'):
+        if col in old_tail.columns and col in new_data.columns:
+            cached = old_tail[col].to_numpy(dtype=np.float64)[:-1][old_idx]
+            fresh = new_data[col].to_numpy(dtype=np.float64)[new_idx]
+            if not np.allclose(fresh, cached, rtol=INCREMENTAL_MATCH_RTOL, atol=0.0):
+                return False
+    return True
+
+def refresh_cache_incremental(symbol, yf_interval, cache_file, new_data=None, state=None):
+    """
+    Bring a stale cache file up to date by downloading only the bars after its
+    last date (with INCREMENTAL_OVERLAP_BARS of overlap to pick up revised bars).
+    The file is truncated at the first replaced row and the new rows appended;
+    indicators are recomputed only over the tail. Returns the cache file path,
+    or None when a full refresh is needed instead (e.g. the overlap bars no longer
+    match the cache after a split or dividend adjustment).
+    new_data/state can be passed in when the bars were downloaded in a batch.
+    """
+    state = state or read_incremental_state(symbol, yf_interval, cache_file)
+    if state is None:
+        return None
+    old_tail, positions, overlap_start = state
+    old_dates = _to_utc(old_tail['date'])
+
+    if new_data is None:
+        print_info(f"Incremental refresh for {symbol} ({yf_interval}) from {overlap_start.date()} (last cached bar {old_dates.iloc[-1]})")
+        new_data = download_yf_data(symbol, yf_interval, overlap_start.strftime('%Y-%m-%d'), datetime.now())
+    if new_data.empty:
+        print_warning(f"No data returned by yfinance for incremental refresh of {symbol} (Interval: {yf_interval}).")
+        print_info(f"Keeping potentially stale cache for {symbol}.")
+        return cache_file
+    new_data = normalize_yf_data(new_data, symbol, yf_interval)
+    if new_data is None:
+        return None
+    essential_subset = [col for col in ['date', 'open', 'high', 'low', 'close', 'volume'] if col in new_data.columns]
+    new_data = new_data.dropna(subset=essential_subset).sort_values(by='date')
+    # Nedlastingen starter på dagsnivå (og i batch ved tidligste symbol); dropp eldre barer
+    new_data = new_data[(_to_utc(new_data['date']) >= overlap_start).to_numpy()]
+    if new_data.empty:
+        return cache_file
+    if not overlap_matches(old_tail, new_data):
+        print_info(f"Cached history of {symbol} ({yf_interval}) no longer matches Yahoo (split/dividend adjustment?).")
+        telemetry.increment('incremental_mismatches')
+        return None
+
+    # Rader i cachen fra og med første nye bar erstattes
+    cut_date = _to_utc(new_data['date']).iloc[0]
+    keep_mask = (old_dates < cut_date).to_numpy()
+    kept_rows = int(keep_mask.sum())
+    if kept_rows < INDICATOR_LOOKBACK_BARS:
+        print_debug("Not enough cached rows before %s for incremental refresh of %s.", cut_date, symbol)
+        return None
+
+    # Indikatorene beregnes kun over de siste cachede radene + de nye barene
+    price_cols = [col for col in ['open', 'high', 'low', 'close', 'volume', 'symbol'] if col in old_tail.columns]
+    combined = pd.concat(
+        [old_tail.loc[keep_mask, price_cols], new_data.drop(columns=['date'])],
+        ignore_index=True
+    )
+    combined = calculate_indicators(combined)
+    new_rows = combined.iloc[kept_rows:].reset_index(drop=True)
+    new_rows.insert(0, 'date', new_data['date'].reset_index(drop=True))
+    if 'symbol' in old_tail.columns:
+        new_rows['symbol'] = symbol # Nye barer fra lavminnemodus har symbolet i attrs
+
+    if set(new_rows.columns) != set(old_tail.columns):
+        print_debug("Column layout changed for %s (%s), full refresh required.", symbol, yf_interval)
+        return None
+
+    replace_cache_tail(cache_file, positions[kept_rows], new_rows, list(old_tail.columns))
+    telemetry.increment('incremental_refreshes')
+    print_info(f"Incremental refresh for {symbol} ({yf_interval}): replaced {len(old_tail) - kept_rows} and wrote {len(new_rows)} rows.")
+    return cache_file
+
+def process_and_store(data, symbol, yf_interval, cache_file):
+    """Normalize, enrich and write a full-history download. Returns the cache file path or None."""
+    data = normalize_yf_data(data, symbol, yf_interval)
+    if data is None:
+        return cache_file if os.path.exists(cache_file) else None
+
+    data = finalize_data(data, symbol)
+    if data.empty:
+        print_warning(f"DataFrame became empty after removing NaNs for {symbol}. No data to save.")
+        # Slett gammel cache hvis den er utdatert? Eller behold den? For nå, behold.
+        if os.path.exists(cache_file): print_info(f"Keeping potentially stale cache for {symbol}.")
+        return cache_file if os.path.exists(cache_file) else None
+
+    # Save to Cache
+    os.makedirs(DATA_DIR, exist_ok=True)
+    try:
+        # Bruk ISO 8601 format for datetime, standard YYYY-MM-DD for date
+        # Pandas' to_csv håndterer dette bra automatisk basert på dtype
+        print_info(f"Saving data ({len(data)} rows) for {symbol} ({yf_interval}) to {cache_file}")
+        write_cache_file(data, cache_file, symbol, yf_interval)
+        telemetry.increment('full_refreshes')
+        print_info(f"Save successful for {symbol} ({yf_interval}).")
+        return cache_file
+    except Exception as e:
+        print_error(f"Error saving data to cache file {cache_file}: {e}", include_traceback=True)
+        # Returner ingenting hvis lagring feiler, selv om data ble hentet
+        return None
+
+def download_and_store(symbol, yf_interval, cache_file):
+    """Refresh a stale cache: incremental tail refresh if possible, otherwise a full history download"""
+    # 2. Utdatert cache: hent kun nye barer hvis mulig
+    if INCREMENTAL_REFRESH and os.path.exists(cache_file):
+        refreshed_file = refresh_cache_incremental(symbol, yf_interval, cache_file)
+        if refreshed_file:
+            return refreshed_file
+        print_info(f"Falling back to full history download for {symbol} ({yf_interval}).")
+
+    # 3. Determine Fetch Period
+    end_date = datetime.now()
+    start_date, fetch_description = determine_fetch_start(yf_interval, end_date)
+    print_info(f"Fetching {fetch_description} historical data for {symbol} (Interval: {yf_interval})...")
+    if start_date: print_debug("Calculated fetch range: %s to %s", start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+
+    # 4. Fetch Data
+    data = download_yf_data(symbol, yf_interval, start_date, end_date)
+
+    if data.empty:
+         print_warning(f"No data returned by yfinance for {symbol} (Interval: {yf_interval}).")
+         if os.path.exists(cache_file):
+             print_info(f"Keeping potentially stale cache for {symbol}.")
+             return cache_file # Returner gammel cache hvis den finnes
+         return None # Ingen data og ingen cache
+
+    # 5. Process Data and Save to Cache
+    return process_and_store(data, symbol, yf_interval, cache_file)
+
+def refresh_cache_locked(symbol, yf_interval, cache_file, max_age_hours=CACHE_HOURS):
+    """download_and_store under the cross-process lock for this cache file"""
+    with cache_file_lock(symbol, yf_interval):
+        # En annen prosess kan ha oppdatert cachen mens vi ventet på låsen
+        if is_cached_file_fresh(cache_file, hours=max_age_hours):
+            print_info(f"Cache for {symbol} ({yf_interval}) was refreshed by another process.")
             return cache_file
-        except Exception as e:
-            print_error(f"Error saving data to cache file {cache_file}: {e}", include_traceback=True)
-            # Returner ingenting hvis lagring feiler, selv om data ble hentet
-            return None
+        return download_and_store(symbol, yf_interval, cache_file)
 
+def fetch_market_data_yf(symbol, timeframe_id='1d', days_arg=DEFAULT_FETCH_DAYS_ARG, max_age_hours=CACHE_HOURS):
+    """Fetch market data based on timeframe, cache, calc indicators."""
+    with telemetry.trace('fetch', symbol=symbol, timeframe=timeframe_id):
+        return _fetch_market_data_yf(symbol, timeframe_id, days_arg, max_age_hours)
+
+def _fetch_market_data_yf(symbol, timeframe_id, days_arg, max_age_hours):
+    print_info(f"--- Starting fetch_market_data_yf for {symbol} ({timeframe_id}) ---")
+    yf_interval = map_timeframe_id_to_yf_interval(timeframe_id)
+    cache_file = get_cache_file_path(symbol, yf_interval)
+    print_debug("Cache file path: %s", cache_file)
+    record_access(symbol, yf_interval)
+
+    timeframe = get_timeframe(timeframe_id)
+    if timeframe and timeframe.get('base'):
+        try:
+            return fetch_derived_timeframe(symbol, timeframe, max_age_hours)
+        finally:
+            print_info(f"--- Finished fetch_market_data_yf for {symbol} ({timeframe_id}) ---")
+
+    # 1. Check Cache
+    if is_cached_file_fresh(cache_file, hours=max_age_hours):
+        print_info(f"Using fresh cached data for {symbol} ({yf_interval})")
+        telemetry.increment('cache_hits')
+        return cache_file
+    telemetry.increment('cache_misses')
+
+    try:
+        # 2. Én nedlasting per nøkkel, også ved samtidige forespørsler
+        result, shared = _fetch_flight.do(
+            (symbol, yf_interval),
+            lambda: refresh_cache_locked(symbol, yf_interval, cache_file, max_age_hours))
+        if shared:
+            print_debug("Shared in-flight fetch result for %s (%s).", symbol, yf_interval)
+            telemetry.increment('shared_fetches')
+        return result
     except Exception as e:
         # Generell feilhåndtering for hele fetch/process-blokken
+        telemetry.increment('fetch_errors')
         print_error(f"Unhandled error during fetch/process for {symbol}: {e}", include_traceback=True)
         if os.path.exists(cache_file):
              print_info(f"Keeping potentially stale cache for {symbol} due to unhandled error.")
@@ -365,8 +792,768 @@ def fetch_market_data_yf(symbol, timeframe_id='1d', days_arg=DEFAULT_FETCH_DAYS_
         print_info(f"--- Finished fetch_market_data_yf for {symbol} ({timeframe_id}) ---")
 
 
+# --- Batch-henting (flere symboler per yf.download) ---
+def download_yf_batch(symbols, yf_interval, start_date, end_date):
+    """One grouped yf.download for several tickers (columns: ticker -> OHLCV)"""
+    print_debug("Calling grouped yf.download(tickers=%s, start=%s, end=%s, interval='%s')", symbols, start_date, end_date, yf_interval)
+    with _YF_DOWNLOAD_LOCK, telemetry.timed('download'):
+        data = yf.download(
+            tickers=symbols,
+            start=start_date,
+            end=end_date,
+            interval=yf_interval,
+            progress=False,
+            auto_adjust=True, # Bruker justerte priser
+            group_by='ticker',
+        )
+    print_debug("Grouped yf.download finished. Shape: %s", data.shape)
+    telemetry.increment('downloads')
+    telemetry.increment('download_rows', len(data))
+    return data
+
+def split_batch_frame(data, symbols):
+    """Split a grouped yf.download frame into {symbol: single-ticker frame}"""
+    frames = {}
+    if data.empty:
+        return frames
+    if not isinstance(data.columns, pd.MultiIndex):
+        # Flate kolonner betyr ett enkelt symbol
+        if len(symbols) == 1:
+            frames[symbols[0]] = data
+        return frames
+    # group_by='ticker' gir (ticker, felt), men sjekk begge nivåer for sikkerhets skyld
+    ticker_level = 0 if any(sym in data.columns.get_level_values(0) for sym in symbols) else 1
+    available = set(data.columns.get_level_values(ticker_level))
+    for symbol in symbols:
+        if symbol not in available:
+            print_warning(f"Symbol {symbol} missing from grouped download.")
+            continue
+        frame = data.xs(symbol, axis=1, level=ticker_level)
+        # Indeksen er unionen av alle tickere (f.eks. forex vs. aksjer); dropp tomme rader
+        frames[symbol] = frame.dropna(how='all')
+    return frames
+
+def fetch_market_data_batch(symbols, timeframe_id='1d', max_age_hours=CACHE_HOURS):
+    """
+    Fetch/refresh the cache for many symbols of one interval with grouped downloads:
+    one call for all stale caches that can be extended incrementally and one for
+    symbols that need their full history. Returns {symbol: cache_file or None}.
+    """
+    with telemetry.trace('fetch-batch', symbols=len(symbols), timeframe=timeframe_id):
+        return _fetch_market_data_batch(symbols, timeframe_id, max_age_hours)
+
+def _fetch_market_data_batch(symbols, timeframe_id, max_age_hours):
+    timeframe = get_timeframe(timeframe_id)
+    if timeframe and timeframe.get('base'):
+        return fetch_derived_batch(symbols, timeframe, max_age_hours)
+    yf_interval = map_timeframe_id_to_yf_interval(timeframe_id)
+    print_info(f"--- Starting batch fetch for {len(symbols)} symbols ({yf_interval}) ---")
+    results = {}
+    stale = []
+    for symbol in symbols:
+        cache_file = get_cache_file_path(symbol, yf_interval)
+        if is_cached_file_fresh(cache_file, hours=max_age_hours):
+            results[symbol] = cache_file
+        else:
+            stale.append(symbol)
+    telemetry.increment('cache_hits', len(results))
+    telemetry.increment('cache_misses', len(stale))
+    if not stale:
+        print_info(f"--- Finished batch fetch ({yf_interval}): all {len(symbols)} caches fresh ---")
+        return results
+
+    # Lås alle utdaterte nøkler i fast rekkefølge (unngår vranglås mellom prosesser)
+    with ExitStack() as locks:
+        for symbol in sorted(set(stale)):
+            locks.enter_context(cache_file_lock(symbol, yf_interval))
+        results.update(_fetch_stale_batch(stale, yf_interval, max_age_hours))
+
+    print_info(f"--- Finished batch fetch ({yf_interval}): {sum(1 for f in results.values() if f)}/{len(symbols)} available ---")
+    return results
+
+def _fetch_stale_batch(symbols, yf_interval, max_age_hours):
+    """Refresh stale caches with grouped downloads (caller holds the cache locks)"""
+    results = {}
+    incremental = {} # symbol -> (cache_file, state)
+    full = {}        # symbol -> cache_file
+    for symbol in symbols:
+        cache_file = get_cache_file_path(symbol, yf_interval)
+        # En annen prosess kan ha oppdatert cachen mens vi ventet på låsene
+        if is_cached_file_fresh(cache_file, hours=max_age_hours):
+            results[symbol] = cache_file
+            continue
+        state = read_incremental_state(symbol, yf_interval, cache_file) if INCREMENTAL_REFRESH and os.path.exists(cache_file) else None
+        if state is not None:
+            incremental[symbol] = (cache_file, state)
+        else:
+            full[symbol] = cache_file
+    print_info(f"Batch plan ({yf_interval}): {len(results)} fresh, {len(incremental)} incremental, {len(full)} full.")
+
+    end_date = datetime.now()
+    if incremental:
+        start = min(state[2] for _, state in incremental.values())
+        try:
+            frames = split_batch_frame(
+                download_yf_batch(list(incremental), yf_interval, start.strftime('%Y-%m-%d'), end_date),
+                list(incremental))
+        except Exception as e:
+            print_error(f"Grouped incremental download failed ({yf_interval}): {e}", include_traceback=True)
+            frames = {}
+        for symbol, (cache_file, state) in incremental.items():
+            try:
+                refreshed = refresh_cache_incremental(symbol, yf_interval, cache_file,
+                                                      new_data=frames.get(symbol, pd.DataFrame()), state=state)
+            except Exception as e:
+                print_error(f"Incremental batch refresh failed for {symbol}: {e}", include_traceback=True)
+                refreshed = None
+            if refreshed:
+                results[symbol] = refreshed
+            else:
+                full[symbol] = cache_file # Prøv full historikk i stedet
+
+    if full:
+        start_date, fetch_description = determine_fetch_start(yf_interval, end_date)
+        print_info(f"Fetching {fetch_description} historical data for {len(full)} symbols (Interval: {yf_interval})...")
+        try:
+            frames = split_batch_frame(download_yf_batch(list(full), yf_interval, start_date, end_date), list(full))
+        except Exception as e:
+            print_error(f"Grouped download failed ({yf_interval}): {e}", include_traceback=True)
+            frames = {}
+        for symbol, cache_file in full.items():
+            data = frames.get(symbol)
+            if data is None or data.empty:
+                print_warning(f"No data returned by yfinance for {symbol} (Interval: {yf_interval}).")
+                results[symbol] = cache_file if os.path.exists(cache_file) else None
+                continue
+            try:
+                results[symbol] = process_and_store(data, symbol, yf_interval, cache_file)
+            except Exception as e:
+                print_error(f"Unhandled error during batch processing for {symbol}: {e}", include_traceback=True)
+                results[symbol] = cache_file if os.path.exists(cache_file) else None
+
+    return results
+
+def resolve_symbol_list(symbols_arg):
+    """Parse a comma-separated symbol list; 'default' expands to DEFAULT_SYMBOLS"""
+    if symbols_arg.strip().lower() == 'default':
+        return [s['symbol'] for s in DEFAULT_SYMBOLS]
+    return [s.strip() for s in symbols_arg.split(',') if s.strip()]
+
+def resolve_timeframe_list(timeframes_arg):
+    """Parse a comma-separated timeframe list; 'all' expands to AVAILABLE_TIMEFRAMES"""
+    if timeframes_arg.strip().lower() == 'all':
+        return [tf['id'] for tf in AVAILABLE_TIMEFRAMES]
+    return [t.strip() for t in timeframes_arg.split(',') if t.strip()]
+
+
+# --- Resampling (avledede tidsrammer fra base-serien) ---
+LINEAGE_SUFFIX = '.lineage.json'
+NS_PER_DAY = 86400 * 10**9
+
+def get_timeframe(timeframe_id):
+    """AVAILABLE_TIMEFRAMES entry for a timeframe ID or interval, or None"""
+    for tf in AVAILABLE_TIMEFRAMES:
+        if tf['id'] == timeframe_id or tf['yf_interval'] == timeframe_id:
+            return tf
+    return None
+
+def is_intraday_rule(rule):
+    return rule not in ('W', 'M') and pd.Timedelta(rule).value < NS_PER_DAY
+
+def wall_clock_ns(dates):
+    """
+    Local wall-clock time of each bar as int64 ns (tz-aware dates keep the exchange
+    clock, so buckets follow the session across DST). CSV text is read without its offset.
+    """
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = pd.to_datetime(dates.astype(str).str.slice(0, 19), format='ISO8601')
+    elif dates.dt.tz is not None:
+        dates = dates.dt.tz_localize(None)
+    return dates.to_numpy(dtype='datetime64[ns]').astype(np.int64)
+
+def session_anchor(dates):
+    """Most common time of day (ns after midnight) of the first bar of each day, i.e. the session open"""
+    wall = wall_clock_ns(dates)
+    days = wall // NS_PER_DAY
+    first_of_day = np.r_[True, days[1:] != days[:-1]]
+    times, counts = np.unique(wall[first_of_day] - days[first_of_day] * NS_PER_DAY, return_counts=True)
+    return int(times[np.argmax(counts)]) if len(times) else 0
+
+def bucket_starts(dates, rule, anchor=0):
+    """Wall-clock start (int64 ns) of the bucket each bar belongs to"""
+    wall = wall_clock_ns(dates)
+    if rule == 'W':
+        days = wall // NS_PER_DAY
+        return (days - (days + 3) % 7) * NS_PER_DAY # 1970-01-01 var en torsdag; uken starter mandag
+    if rule == 'M':
+        return wall.astype('datetime64[ns]').astype('datetime64[M]').astype('datetime64[ns]').astype(np.int64)
+    step = pd.Timedelta(rule).value
+    if step >= NS_PER_DAY:
+        return wall // step * step # Flere dager: faste bøtter fra epoch, stabile når historikken forskyves
+    # Intradag: bøttene starter ved sesjonsåpning hver dag (f.eks. 09:30, 11:30, ... for 2h)
+    midnight = wall // NS_PER_DAY * NS_PER_DAY
+    return midnight + anchor + (wall - midnight - anchor) // step * step
+
+def _bucket_labels(dates, starts, first_rows):
+    """Date labels for bucket starts in the same type/timezone as the base dates"""
+    wall_first = wall_clock_ns(dates)[first_rows]
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        # CSV-tekst: behold første bars tekst, eller bruk bøttestart med første bars UTC-offset
+        text = dates.astype(str).to_numpy()[first_rows]
+        start_text = np.datetime_as_string(starts.astype('datetime64[ns]'), unit='s')
+        return pd.Series([
+            t if w == s else (st[:10] if len(t) == 10 else st.replace('T', ' ') + t[19:])
+            for t, w, s, st in zip(text, wall_first, starts, start_text)
+        ])
+    labels = pd.DatetimeIndex(starts.astype('datetime64[ns]'))
+    tz = dates.dt.tz
+    if tz is not None:
+        # Bøttestart som ikke finnes eller er tvetydig (sommertid) får første bars tidspunkt
+        labels = labels.tz_localize(tz, ambiguous='NaT', nonexistent='NaT')
+    labels = pd.Series(labels).astype(dates.dtype)
+    fallback = dates.iloc[first_rows].reset_index(drop=True)
+    return labels.where(labels.notna(), fallback)
+
+@telemetry.timed('resample')
+def resample_ohlcv(base, rule, anchor=0):
+    """
+    Aggregate date-sorted OHLCV bars into buckets: first open, highest high,
+    lowest low, last close and summed volume. Each bucket is labelled with its start.
+    """
+    if base.empty:
+        return pd.DataFrame(columns=[col for col in ['date', 'open', 'high', 'low', 'close', 'volume'] if col in base.columns])
+    starts = bucket_starts(base['date'], rule, anchor)
+    first_rows = np.flatnonzero(np.r_[True, starts[1:] != starts[:-1]])
+    last_rows = np.r_[first_rows[1:], len(base)] - 1
+    bars = {'date': _bucket_labels(base['date'], starts[first_rows], first_rows)}
+    bars['open'] = base['open'].to_numpy()[first_rows]
+    bars['high'] = np.maximum.reduceat(base['high'].to_numpy(), first_rows)
+    bars['low'] = np.minimum.reduceat(base['low'].to_numpy(), first_rows)
+    bars['close'] = base['close'].to_numpy()[last_rows]
+    if 'volume' in base.columns:
+        bars['volume'] = np.add.reduceat(base['volume'].to_numpy(), first_rows)
+    return pd.DataFrame(bars)
+
+def lineage_path(cache_file):
+    return cache_file + LINEAGE_SUFFIX
+
+def read_lineage(cache_file):
+    """Lineage of a derived cache file (base, rule, anchor, base stamp, ...), or None"""
+    try:
+        with open(lineage_path(cache_file), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_lineage(cache_file, lineage):
+    def write(tmp_path):
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(lineage, f, indent=2)
+    cache_lock.atomic_write(lineage_path(cache_file), write, suffix='.json')
+
+def _utc_ms(dates):
+    """Dates as int64 ms since epoch (UTC), comparable across cache formats"""
+    return _to_utc(dates).to_numpy(dtype='datetime64[ms]').astype(np.int64)
+
+def _first_cached_date_ms(cache_file):
+    if is_column_cache(cache_file):
+        store = column_store.ColumnStore(cache_file)
+        return int(store.column('date', 0, 1)[0]) if store.rows else None
+    head = pd.read_csv(cache_file, nrows=1, usecols=['date'])
+    return int(_utc_ms(head['date'])[0]) if len(head) else None
+
+def _read_base_from(base_file, start_date):
+    """Base rows with date >= start_date"""
+    if is_column_cache(base_file):
+        return column_store.ColumnStore(base_file).read_range(start_date=start_date)
+    base = pd.read_csv(base_file)
+    keep = _utc_ms(base['date']) >= _utc_ms(pd.Series([start_date]))[0]
+    return base[keep].reset_index(drop=True)
+
+def _make_lineage(timeframe, anchor, base_file, base_stamp, base_tail):
+    # Base-barer før recompute_from endres ikke av en inkrementell oppdatering av basen;
+    # base_check (siste bar før den) avslører at basen er lastet ned på nytt med ny skala
+    dates = _utc_ms(base_tail['date'])
+    overlap = min(INCREMENTAL_OVERLAP_BARS, len(base_tail))
+    check = [int(dates[-overlap - 1]), float(base_tail['close'].iloc[-overlap - 1])] if len(base_tail) > overlap else None
+    return {
+        'base': timeframe['base'],
+        'rule': timeframe['rule'],
+        'anchor': anchor,
+        'base_stamp': list(base_stamp),
+        'base_first': _first_cached_date_ms(base_file),
+        'recompute_from': int(dates[-overlap]),
+        'base_check': check,
+    }
+
+def derive_full(symbol, timeframe, cache_file, base_file, base_stamp):
+    """Resample the whole base series and write the derived cache + lineage. Returns the cache file or None."""
+    base = load_cache_frame(base_file)
+    if base.empty:
+        print_warning(f"Base cache for {symbol} ({timeframe['base']}) is empty, cannot derive {timeframe['id']}.")
+        return None
+    anchor = session_anchor(base['date']) if is_intraday_rule(timeframe['rule']) else 0
+    data = resample_ohlcv(base, timeframe['rule'], anchor)
+    if LOW_MEMORY:
+        data.attrs['symbol'] = symbol
+    else:
+        data['symbol'] = symbol
+    data = finalize_data(data, symbol)
+    if data.empty:
+        return None
+    print_info(f"Derived {len(data)} {timeframe['id']} bars for {symbol} from {len(base)} {timeframe['base']} bars.")
+    write_cache_file(data, cache_file, symbol, timeframe['yf_interval'])
+    write_lineage(cache_file, _make_lineage(timeframe, anchor, base_file, base_stamp, base))
+    telemetry.increment('full_derives')
+    return cache_file
+
+def derive_tail(symbol, timeframe, cache_file, base_file, base_stamp, lineage):
+    """
+    Recompute only the derived buckets that can contain changed base bars (from the bucket
+    holding lineage['recompute_from']), with indicators over the tail. Returns the cache
+    file, or None when a full derive is needed instead.
+    """
+    if (lineage.get('base') != timeframe['base'] or lineage.get('rule') != timeframe['rule']
+            or lineage.get('base_first') != _first_cached_date_ms(base_file)):
+        print_debug("Lineage of %s does not match the base series, full derive required.", cache_file)
+        return None
+    read_rows = INDICATOR_LOOKBACK_BARS + INCREMENTAL_OVERLAP_BARS + INCREMENTAL_TAIL_MARGIN
+    old_tail, positions = read_cache_tail(cache_file, read_rows)
+    if 'date' not in old_tail.columns or old_tail.empty:
+        return None
+    old_dates = _utc_ms(old_tail['date'])
+    # Første bøtte som kan inneholde endrede base-barer
+    first_changed = int(np.searchsorted(old_dates, lineage['recompute_from'], side='right')) - 1
+    if first_changed < INDICATOR_LOOKBACK_BARS:
+        return None
+
+    bucket_start = int(old_dates[first_changed])
+    check = lineage.get('base_check')
+    read_from = min(bucket_start, check[0]) if check else bucket_start
+    base_tail = _read_base_from(base_file, pd.Timestamp(read_from, unit='ms', tz='UTC'))
+    base_dates = _utc_ms(base_tail['date'])
+    if check:
+        # Basen er uendret før recompute_from bare hvis kontrollbaren stemmer (ikke ny splitt-/utbyttejustering)
+        i = int(np.searchsorted(base_dates, check[0]))
+        if i >= len(base_dates) or base_dates[i] != check[0] or \
+                not np.isclose(float(base_tail['close'].iloc[i]), check[1], rtol=INCREMENTAL_MATCH_RTOL, atol=0.0):
+            print_debug("Base history of %s (%s) changed before the recompute point, full derive required.", symbol, timeframe['id'])
+            return None
+        base_tail = base_tail[base_dates >= bucket_start].reset_index(drop=True)
+    new_bars = resample_ohlcv(base_tail, timeframe['rule'], lineage.get('anchor', 0))
+    if new_bars.empty or _utc_ms(new_bars['date'])[0] != old_dates[first_changed]:
+        print_debug("Bucket alignment changed for %s (%s), full derive required.", symbol, timeframe['id'])
+        return None
+
+    price_cols = [col for col in ['open', 'high', 'low', 'close', 'volume'] if col in old_tail.columns]
+    combined = pd.concat([old_tail.iloc[:first_changed][price_cols], new_bars[price_cols]], ignore_index=True)
+    combined = calculate_indicators(combined)
+    new_rows = combined.iloc[first_changed:].reset_index(drop=True)
+    new_rows.insert(0, 'date', new_bars['date'].reset_index(drop=True))
+    if 'symbol' in old_tail.columns:
+        new_rows['symbol'] = symbol
+    if set(new_rows.columns) != set(old_tail.columns):
+        return None
+
+    replace_cache_tail(cache_file, positions[first_changed], new_rows, list(old_tail.columns))
+    write_lineage(cache_file, _make_lineage(timeframe, lineage.get('anchor', 0), base_file, base_stamp, base_tail))
+    telemetry.increment('incremental_derives')
+    print_info(f"Re-derived {symbol} ({timeframe['id']}): replaced {len(old_tail) - first_changed} and wrote {len(new_rows)} bars.")
+    return cache_file
+
+def derive_locked(symbol, timeframe, base_file):
+    """Bring the derived cache in line with the current base file (under the cache lock for the derived key)"""
+    cache_file = get_cache_file_path(symbol, timeframe['yf_interval'])
+    with cache_file_lock(symbol, timeframe['yf_interval']):
+        base_stamp = _file_stamp(base_file)
+        if base_stamp is None:
+            return cache_file if os.path.exists(cache_file) else None
+        lineage = read_lineage(cache_file) if os.path.exists(cache_file) else None
+        if lineage and lineage.get('base_stamp') == list(base_stamp):
+            print_info(f"Derived cache for {symbol} ({timeframe['id']}) is up to date with its base.")
+            telemetry.increment('cache_hits')
+            os.utime(cache_file) # Sjekket mot basen nå; hold filen fersk for is_cached_file_fresh
+            return cache_file
+        if lineage and INCREMENTAL_REFRESH:
+            try:
+                if derive_tail(symbol, timeframe, cache_file, base_file, base_stamp, lineage):
+                    return cache_file
+            except Exception as e:
+                print_warning(f"Incremental re-derive failed for {symbol} ({timeframe['id']}): {e}")
+            print_info(f"Falling back to full derive for {symbol} ({timeframe['id']}).")
+        return derive_full(symbol, timeframe, cache_file, base_file, base_stamp)
+
+def derive_from_base(symbol, timeframe, base_file):
+    """derive_locked, shared between concurrent callers for the same key. Keeps a stale derived cache on errors."""
+    cache_file = get_cache_file_path(symbol, timeframe['yf_interval'])
+    try:
+        result, shared = _fetch_flight.do(
+            (symbol, timeframe['yf_interval']),
+            lambda: derive_locked(symbol, timeframe, base_file))
+        if shared:
+            print_debug("Shared in-flight derive result for %s (%s).", symbol, timeframe['id'])
+        return result
+    except Exception as e:
+        print_error(f"Error deriving {timeframe['id']} for {symbol}: {e}", include_traceback=True)
+        return cache_file if os.path.exists(cache_file) else None
+
+def fetch_derived_timeframe(symbol, timeframe, max_age_hours=CACHE_HOURS):
+    """Fetch/refresh the base series, then derive the timeframe from it. Returns the cache file or None."""
+    base_file = fetch_market_data_yf(symbol, timeframe['base'], max_age_hours=max_age_hours)
+    if not base_file:
+        cache_file = get_cache_file_path(symbol, timeframe['yf_interval'])
+        return cache_file if os.path.exists(cache_file) else None
+    return derive_from_base(symbol, timeframe, base_file)
+
+def fetch_derived_batch(symbols, timeframe, max_age_hours=CACHE_HOURS):
+    """Batch-refresh the base series for all symbols, then derive per symbol. Returns {symbol: cache_file or None}."""
+    base_files = fetch_market_data_batch(symbols, timeframe['base'], max_age_hours=max_age_hours)
+    results = {}
+    for symbol in symbols:
+        base_file = base_files.get(symbol)
+        if base_file:
+            results[symbol] = derive_from_base(symbol, timeframe, base_file)
+        else:
+            cache_file = get_cache_file_path(symbol, timeframe['yf_interval'])
+            results[symbol] = cache_file if os.path.exists(cache_file) else None
+    print_info(f"--- Derived {timeframe['id']} for {sum(1 for f in results.values() if f)}/{len(symbols)} symbols ---")
+    return results
+
+
+# --- Minnecache for prosesserte serier ---
+class FrameCache:
+    """
+    Thread-safe LRU cache of processed DataFrames keyed by (symbol, interval),
+    bounded by total memory usage. Each entry carries a stamp of its cache
+    file (mtime_ns, size), so a file rewritten by another process invalidates it.
+    Cached frames are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, max_bytes=FRAME_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # key -> [stamp, frame, nbytes, extras]
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, stamp):
+        """Return the cached frame if its stamp matches, else None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if stamp is None or entry[0] != stamp:
+                self._remove(key)
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def get_extra(self, key, stamp, name):
+        """Return a derived value (e.g. an indicator column) stored with a cached frame"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != stamp:
+                return None
+            return entry[3].get(name)
+
+    def put_extra(self, key, stamp, name, values):
+        """Attach a derived NumPy array to a cached frame; counts toward the byte limit"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != stamp or name in entry[3]:
+                return
+            entry[3][name] = values
+            entry[2] += int(values.nbytes)
+            self.total_bytes += int(values.nbytes)
+            self._evict()
+
+    def put(self, key, stamp, frame):
+        nbytes = int(frame.memory_usage(index=True, deep=True).sum())
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if nbytes > self.max_bytes:
+                return # Større enn hele cachen; ikke bufre
+            self._entries[key] = [stamp, frame, nbytes, {}]
+            self.total_bytes += nbytes
+            self._evict()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.total_bytes -= entry[2]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+_frame_cache = FrameCache()
+
+def get_frame_cache():
+    return _frame_cache
+
+def _file_stamp(cache_file):
+    """(mtime_ns, size) of a cache file, or None if it is missing"""
+    try:
+        st = os.stat(cache_file)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def get_market_frame(symbol, timeframe_id='1d', max_age_hours=CACHE_HOURS):
+    """
+    Return the processed (indicator-enriched) frame for symbol/timeframe.
+    Served from memory when the cache file is fresh and unchanged; otherwise
+    the file is refreshed via fetch_market_data_yf and loaded. None if no data.
+    """
+    yf_interval = map_timeframe_id_to_yf_interval(timeframe_id)
+    key = (symbol, yf_interval)
+    cache_file = get_cache_file_path(symbol, yf_interval)
+    stamp = _file_stamp(cache_file)
+    is_fresh = stamp is not None and time.time() - stamp[0] / 1e9 < max_age_hours * 3600
+    frame = _frame_cache.get(key, stamp if is_fresh else None) # Utdatert fil ugyldiggjør oppføringen
+    if frame is not None:
+        record_access(symbol, yf_interval)
+        return frame
+
+    cache_file = fetch_market_data_yf(symbol, timeframe_id, max_age_hours=max_age_hours)
+    if not cache_file or not os.path.exists(cache_file):
+        return None
+    stamp = _file_stamp(cache_file)
+    frame = load_cache_frame(cache_file)
+    _frame_cache.put(key, stamp, frame)
+    return frame
+
+def get_market_indicators(symbol, timeframe_id='1d', specs=('sma:20', 'rsi:14'), max_age_hours=CACHE_HOURS):
+    """
+    Return a frame with 'date' plus the requested indicator columns (see indicator_engine).
+    Each indicator is computed once per cached series and shared between callers;
+    indicators requested together share intermediates (diffs, EMAs).
+    """
+    frame = get_market_frame(symbol, timeframe_id, max_age_hours=max_age_hours)
+    if frame is None:
+        return None
+    yf_interval = map_timeframe_id_to_yf_interval(timeframe_id)
+    key = (symbol, yf_interval)
+    stamp = _file_stamp(get_cache_file_path(symbol, yf_interval))
+
+    specs = [indicator_engine.parse_indicator_spec(spec) for spec in specs]
+    columns = {}
+    missing = []
+    for spec in specs:
+        names = indicator_engine.output_columns(spec)
+        cached = [_frame_cache.get_extra(key, stamp, name) for name in names]
+        if all(values is not None for values in cached):
+            columns.update(zip(names, cached))
+        else:
+            missing.append(spec)
+    if missing:
+        computed = indicator_engine.compute_indicators(frame, missing)
+        for name, values in computed.items():
+            _frame_cache.put_extra(key, stamp, name, values)
+        columns.update(computed)
+
+    out = frame[['date']].copy()
+    for spec in specs:
+        for name in indicator_engine.output_columns(spec):
+            out[name] = columns[name]
+    return out
+
+def is_date_only(dates):
+    """True for naive dates without a time of day (daily and longer bars)"""
+    return dates.dt.tz is None and bool((dates.dt.normalize() == dates).all())
+
+def format_dates(dates, date_only=None):
+    """Format a datetime Series as YYYY-MM-DD strings (date_only) or ISO 8601 strings"""
+    if date_only is None:
+        date_only = is_date_only(dates)
+    if date_only:
+        return np.datetime_as_string(dates.to_numpy(dtype='datetime64[D]'), unit='D').tolist()
+    # Vektorisert isoformat(): lokal veggklokke + UTC-offset (offsetene er få og unike)
+    tz = dates.dt.tz
+    local = dates.dt.tz_localize(None) if tz is not None else dates
+    text = np.datetime_as_string(local.to_numpy(dtype='datetime64[s]'), unit='s')
+    if tz is None:
+        return text.tolist()
+    utc = dates.dt.tz_convert('UTC').dt.tz_localize(None)
+    offsets = ((local - utc).dt.total_seconds() // 60).astype(int).to_numpy()
+    labels = {}
+    for minutes in np.unique(offsets):
+        sign = '-' if minutes < 0 else '+'
+        labels[minutes] = f"{sign}{abs(minutes) // 60:02d}:{abs(minutes) % 60:02d}"
+    return [t + labels[o] for t, o in zip(text.tolist(), offsets.tolist())]
+
+def frame_to_records(frame):
+    """Convert a frame to JSON-ready records (dates as YYYY-MM-DD or ISO 8601, NaN as None)"""
+    out = frame.copy()
+    if 'symbol' not in out.columns and frame.attrs.get('symbol'):
+        out['symbol'] = frame.attrs['symbol'] # Lavminnemodus: symbolet ligger i attrs
+    if 'date' in out.columns and pd.api.types.is_datetime64_any_dtype(out['date']):
+        out['date'] = format_dates(out['date'])
+    out = out.astype(object).where(out.notna(), None)
+    return out.to_dict(orient='records')
+
+
+# --- Serve-modus (langlevende worker) ---
+def handle_serve_request(request, emit=None):
+    """Handle one serve-mode request and return the result fields (emit sends partial responses)"""
+    cmd = request.get('cmd', 'fetch')
+    if cmd == 'fetch':
+        symbol = request.get('symbol')
+        if not symbol:
+            raise ValueError("'symbol' is required for the fetch command")
+        timeframe_id = request.get('timeframe', '1d')
+        days_arg = int(request.get('days', DEFAULT_FETCH_DAYS_ARG))
+        if request.get('rows'):
+            # Returner de siste radene direkte fra minnecachen
+            frame = get_market_frame(symbol, timeframe_id)
+            if frame is None:
+                raise RuntimeError(f"No data available for {symbol} ({timeframe_id})")
+            return {
+                'cache_file': get_cache_file_path(symbol, map_timeframe_id_to_yf_interval(timeframe_id)),
+                'data': frame_to_records(frame.tail(int(request['rows']))),
+            }
+        cache_file = fetch_market_data_yf(symbol, timeframe_id, days_arg)
+        if not cache_file or not os.path.exists(cache_file):
+            raise RuntimeError(f"No valid data file produced or saved for {symbol} ({timeframe_id})")
+        return {'cache_file': cache_file}
+    if cmd == 'fetch-batch':
+        symbols = request.get('symbols')
+        if not symbols:
+            raise ValueError("'symbols' is required for the fetch-batch command")
+        if isinstance(symbols, str):
+            symbols = resolve_symbol_list(symbols)
+        return {'cache_files': fetch_market_data_batch(symbols, request.get('timeframe', '1d'))}
+    if cmd == 'init-lists':
+        save_default_lists()
+        return {
+            'symbols_file': os.path.join(DATA_DIR, 'default_symbols.csv'),
+            'timeframes_file': os.path.join(DATA_DIR, 'timeframes.csv'),
+        }
+    if cmd == 'indicators':
+        symbol = request.get('symbol')
+        if not symbol:
+            raise ValueError("'symbol' is required for the indicators command")
+        frame = get_market_indicators(symbol, request.get('timeframe', '1d'), request.get('indicators') or ['sma:20', 'rsi:14'])
+        if frame is None:
+            raise RuntimeError(f"No data available for {symbol}")
+        rows = int(request.get('rows') or 0)
+        return {'data': frame_to_records(frame.tail(rows) if rows else frame)}
+    if cmd == 'backtest':
+        import backtest_engine # Importeres her; modulen importerer selv market_data_yf
+        symbol = request.get('symbol')
+        if not symbol or not request.get('strategy'):
+            raise ValueError("'symbol' and 'strategy' are required for the backtest command")
+        return {'result': backtest_engine.run_backtest(
+            request['strategy'], symbol, request.get('timeframe', '1d'),
+            days=request.get('days'), compact_equity=bool(request.get('compact_equity')))}
+    if cmd == 'sweep':
+        import param_sweep
+        symbol = request.get('symbol')
+        if not symbol or not request.get('strategy') or not request.get('params'):
+            raise ValueError("'symbol', 'strategy' and 'params' are required for the sweep command")
+        return {'result': param_sweep.run_sweep(
+            request['strategy'], request['params'], symbol, request.get('timeframe', '1d'),
+            days=request.get('days'), rank_by=request.get('rank_by', param_sweep.DEFAULT_RANK_BY),
+            top=int(request.get('top', param_sweep.DEFAULT_TOP)), workers=request.get('workers'))}
+    if cmd == 'range':
+        import range_query
+        return range_query.handle_range_request(request, emit)
+    if cmd in ('scan', 'correlation'):
+        import panel_store
+        return panel_store.handle_panel_request(request)
+    if cmd == 'cache-stats':
+        return {'frame_cache': _frame_cache.stats()}
+    if cmd == 'metrics':
+        frame_stats = _frame_cache.stats()
+        if request.get('format') == 'prometheus':
+            return {'text': telemetry.prometheus_text(gauges={f"frame_cache_{k}": v for k, v in frame_stats.items()})}
+        return {'metrics': telemetry.snapshot(), 'frame_cache': frame_stats}
+    if cmd == 'ping':
+        return {'pong': True}
+    raise ValueError(f"Unknown command '{cmd}'")
+
+def serve_jsonl(max_workers=DEFAULT_SERVE_WORKERS, input_stream=None, output_stream=None):
+    """
+    Run as a long-lived worker speaking JSON lines.
+    Each input line is a request object ({"id", "cmd", "symbol", "timeframe", "days"});
+    each output line is a response with the same "id". Requests are handled
+    concurrently, so responses may arrive out of order. Streaming requests send
+    lines with "partial": true before their final response.
+    """
+    input_stream = input_stream or sys.stdin
+    output_stream = output_stream or sys.stdout
+    # Stdout er reservert for svar; all logging går til stderr i denne modusen
+    sys.stdout = sys.stderr
+    write_lock = threading.Lock()
+
+    def respond(payload):
+        line = json.dumps(payload, default=str)
+        with write_lock:
+            output_stream.write(line + '\n')
+            output_stream.flush()
+
+    def run_request(request):
+        request_id = request.get('id')
+        # Strømmende kommandoer (range) sender delsvar med samme id før det endelige svaret
+        emit = lambda fields: respond({'id': request_id, 'ok': True, 'partial': True, **fields})
+        try:
+            with telemetry.trace(f"serve.{request.get('cmd', 'fetch')}", symbol=request.get('symbol'), timeframe=request.get('timeframe')):
+                result = handle_serve_request(request, emit)
+            respond({'id': request_id, 'ok': True, **result})
+        except Exception as e:
+            print_error(f"Serve request {request_id} failed: {e}", include_traceback=True)
+            respond({'id': request_id, 'ok': False, 'error': str(e)})
+
+    print_info(f"Serve mode started with {max_workers} worker threads.")
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='md-serve') as pool:
+        respond({'id': None, 'ok': True, 'ready': True})
+        for raw_line in input_stream:
+            raw_line = raw_line.strip()
+            if not raw_line:
+                continue
+            try:
+                request = json.loads(raw_line)
+                if not isinstance(request, dict):
+                    raise ValueError("request must be a JSON object")
+            except ValueError as parse_err:
+                print_warning(f"Ignoring invalid serve request: {parse_err}")
+                respond({'id': None, 'ok': False, 'error': f"Invalid request: {parse_err}"})
+                continue
+            pool.submit(run_request, request)
+    flush_access_stats()
+    print_info("Input closed. Serve mode exiting.")
+
+
 # --- Hovedlogikk for å håndtere argumenter ---
 if __name__ == "__main__":
+    # Moduler som importerer market_data_yf (f.eks. backtest_engine) skal dele denne modulens tilstand
+    sys.modules.setdefault('market_data_yf', sys.modules[__name__])
     print_info("Python script started.")
     # Definer argument parser
     parser = argparse.ArgumentParser(
@@ -378,15 +1565,34 @@ if __name__ == "__main__":
     # Dager brukes nå kun av kallende skript for å begrense resultatet, ikke for fetch-periode
     parser.add_argument('--days', type=int, default=DEFAULT_FETCH_DAYS_ARG, help='Number of past periods (used by caller to limit result, fetch duration determined by timeframe)')
     parser.add_argument('--init-lists', action='store_true', help='Initialize default symbol/timeframe lists and exit if no symbol provided.')
+    parser.add_argument('--symbols', type=str, default=None, help="Comma-separated symbols for a grouped batch fetch ('default' = DEFAULT_SYMBOLS).")
+    parser.add_argument('--timeframes', type=str, default=None, help="Comma-separated timeframe IDs for --symbols ('all' = AVAILABLE_TIMEFRAMES). Defaults to --timeframe.")
+    parser.add_argument('--export-csv', nargs='?', const='', default=None, metavar='PATH', help='Export the cached series for --symbol/--timeframe to CSV (default path: the legacy CSV cache name) and exit.')
+    parser.add_argument('--serve', action='store_true', help='Run as a long-lived worker reading JSON-lines requests from stdin and writing responses to stdout.')
+    parser.add_argument('--workers', type=int, default=DEFAULT_SERVE_WORKERS, help='Number of concurrent requests handled in --serve mode.')
+    parser.add_argument('--low-memory', action='store_true', help='Process with float32 columns, the symbol as metadata and no intermediate copies (same as MARKET_DATA_LOW_MEMORY=1).')
+    parser.add_argument('--log-level', choices=list(telemetry.LOG_LEVELS), default=None, help='Minimum log level (overrides MARKET_DATA_LOG_LEVEL).')
 
     # Parse argumenter
     try:
         args = parser.parse_args()
-        print_debug(f"Parsed arguments: {args}")
+        if args.log_level:
+            telemetry.set_log_level(args.log_level)
+        if args.low_memory:
+            LOW_MEMORY = True
+        print_debug("Parsed arguments: %s", args)
     except Exception as parse_err:
         print_error(f"Error parsing arguments: {parse_err}")
         exit(2) # Avslutt med feilkode for argumentfeil
 
+    # Serve-modus: hold prosessen (og pandas/yfinance-importene) varm
+    if args.serve:
+        try:
+            serve_jsonl(max_workers=max(1, args.workers))
+        except KeyboardInterrupt:
+            print_info("Serve mode interrupted.")
+        exit(0)
+
     # Kjør --init-lists hvis bedt om
     if args.init_lists:
         print_info("Processing --init-lists request.")
@@ -405,17 +1611,45 @@ if __name__ == "__main__":
              exit(0)
         # Ellers fortsett for å hente data for gitt symbol
 
+    # Batch-modus: én gruppert nedlasting per tidsramme
+    if args.symbols:
+        symbols = resolve_symbol_list(args.symbols)
+        timeframes = resolve_timeframe_list(args.timeframes or args.timeframe)
+        failed = []
+        for timeframe_id in timeframes:
+            try:
+                batch_results = fetch_market_data_batch(symbols, timeframe_id)
+            except Exception as batch_err:
+                print_error(f"Unexpected error in batch fetch ({timeframe_id}): {batch_err}", include_traceback=True)
+                batch_results = {}
+            failed += [f"{sym} ({timeframe_id})" for sym in symbols if not batch_results.get(sym)]
+        if failed:
+            print_error(f"Batch fetch failed for: {', '.join(failed)}")
+            exit(1)
+        print_info(f"Batch fetch complete for {len(symbols)} symbols x {len(timeframes)} timeframes.")
+        exit(0)
+
     # Sjekk om symbol er påkrevd hvis vi kom hit (dvs. ikke bare init)
     if not args.symbol:
         print_error("Argument --symbol is required when not using --init-lists exclusively.")
         parser.print_usage(file=sys.stderr) # Skriv bruk til stderr
         exit(2) # Avslutt med feilkode for manglende argument
 
+    # Eksporter cache til CSV hvis bedt om
+    if args.export_csv is not None:
+        try:
+            export_cache_to_csv(args.symbol, args.timeframe, args.export_csv or None)
+            exit(0)
+        except Exception as export_err:
+            print_error(f"CSV export failed for {args.symbol}: {export_err}", include_traceback=True)
+            exit(1)
+
     # Kjør hovedfunksjonen for datahenting
     print_info(f"Processing request for Symbol: {args.symbol}, Timeframe: {args.timeframe}...")
     cache_filepath = None # Initialiser
     try:
         cache_filepath = fetch_market_data_yf(args.symbol, args.timeframe, args.days)
+        flush_access_stats()
     except Exception as fetch_err:
         # Fang uventede feil i selve kall til fetch_market_data_yf (bør ikke skje pga try/except inni)
         print_error(f"Unexpected top-level error calling fetch_market_data_yf for {args.symbol}: {fetch_err}", include_traceback=True)
@@ -0,0 +1,575 @@
+#!/usr/bin/env python3
+"""
+Cross-sectional panel store: all cached series of one interval as date x symbol matrices.
+
+Layout (market_data/panels/<interval>/):
+  - index.json: version, symbols (column order), fields, tz and the (mtime_ns, size)
+    stamp of each source cache file when it was last read into the panel
+  - dates.<version>.npy: int64 ms since epoch (UTC), one row per date in the union of all series
+  - <field>.<version>.npy: float32 matrix (dates x symbols) per field (close, rsi, ...),
+    NaN where a symbol has no bar. Read memory-mapped.
+
+update_panel() only re-reads the cache files whose stamp changed since the last update;
+the columns of unchanged symbols are copied over from the previous panel. Files are
+written under a new version and the index is replaced last, so readers always see one
+consistent version.
+
+On top of the panel:
+- scan(): vectorized screens over the latest bar of every symbol, e.g. "rsi < 30" or
+  "close > sma20 and change_pct > 2" (fields, numbers, + - * /, comparisons, and/or/not, abs()).
+- correlation_matrix(): pairwise correlation of returns over the last N bars.
+"""
+
+import os
+import ast
+import json
+import argparse
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+
+import cache_lock
+import column_store
+import telemetry
+import market_data_yf as md
+from market_data_yf import print_debug, print_info, print_error
+
+# --- Konfigurasjon ---
+PANEL_DIR_NAME = 'panels'
+PANEL_FIELDS = ('open', 'high', 'low', 'close', 'volume', 'sma20', 'rsi')
+PANEL_DTYPE = np.float32 # Halvert minne; nok presisjon for screening og korrelasjon
+SCAN_WINDOW_ROWS = 64 # Symboler uten bar blant de siste radene regnes som utdaterte i en scan
+DEFAULT_CORRELATION_WINDOW = 250
+DEFAULT_MIN_PERIODS = 20
+DERIVED_FIELDS = ('change_pct',) # Endring i close fra forrige bar, i prosent
+# ---------------------
+
+_update_flight = cache_lock.SingleFlight()
+_loaded_lock = threading.Lock()
+_loaded = {} # intervall -> (indeksstempel, Panel)
+
+
+class PanelError(ValueError):
+    """Raised for invalid scan expressions, unknown symbols or an empty panel"""
+
+
+@dataclass
+class Panel:
+    """Date x symbol matrices of one interval (dates as int64 ms UTC)"""
+    interval: str
+    version: int
+    dates: np.ndarray
+    symbols: list
+    fields: dict
+    tz: str = None
+
+    @property
+    def rows(self):
+        return len(self.dates)
+
+    def columns(self, symbols=None):
+        """Column positions of symbols (all symbols if None)"""
+        if not symbols:
+            return np.arange(len(self.symbols))
+        position = {symbol: i for i, symbol in enumerate(self.symbols)}
+        missing = [symbol for symbol in symbols if symbol not in position]
+        if missing:
+            raise PanelError(f"Not in the {self.interval} panel: {', '.join(missing)}")
+        return np.array([position[symbol] for symbol in symbols], dtype=np.int64)
+
+    def date_labels(self, rows):
+        """Formatted dates (YYYY-MM-DD or ISO 8601) of the given rows"""
+        dates = pd.to_datetime(np.asarray(self.dates[rows], dtype=np.int64), unit='ms')
+        if self.tz:
+            dates = dates.tz_localize('UTC').tz_convert(self.tz)
+        return md.format_dates(pd.Series(dates))
+
+
+# --- Lagring ---
+def panel_dir(yf_interval):
+    return os.path.join(md.DATA_DIR, PANEL_DIR_NAME, yf_interval)
+
+def _index_path(directory):
+    return os.path.join(directory, 'index.json')
+
+def read_index(directory):
+    try:
+        with open(_index_path(directory), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _array_path(directory, name, version):
+    return os.path.join(directory, f"{name}.{version}.npy")
+
+def _save_array(path, values):
+    def write(tmp_path):
+        with open(tmp_path, 'wb') as f:
+            np.save(f, values)
+    cache_lock.atomic_write(path, write, suffix='.npy')
+
+def _load_arrays(directory, index):
+    """(dates, {field: matrix}) of an index version, memory-mapped"""
+    version = index['version']
+    dates = np.load(_array_path(directory, 'dates', version), mmap_mode='r')
+    fields = {name: np.load(_array_path(directory, name, version), mmap_mode='r') for name in index['fields']}
+    shape = (index['rows'], len(index['symbols']))
+    if len(dates) != shape[0] or any(matrix.shape != shape for matrix in fields.values()):
+        raise column_store.ColumnStoreError(f"Panel files in {directory} do not match version {version}")
+    return dates, fields
+
+def _remove_old_versions(directory, version):
+    for name in os.listdir(directory):
+        parts = name.split('.')
+        if len(parts) == 3 and parts[2] == 'npy' and parts[1].isdigit() and int(parts[1]) != version:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass # Fjernes ved neste oppdatering
+
+
+# --- Kildeserier ---
+def _symbol_of(cache_file):
+    """Symbol stored in a cache file (column store attrs or the CSV 'symbol' column)"""
+    try:
+        if md.is_column_cache(cache_file):
+            return column_store.ColumnStore(cache_file).attrs.get('symbol')
+        head = pd.read_csv(cache_file, nrows=1)
+        return str(head['symbol'].iloc[0]) if 'symbol' in head.columns and len(head) else None
+    except (OSError, ValueError, column_store.ColumnStoreError):
+        return None
+
+def discover_sources(yf_interval, known_files=None):
+    """
+    {symbol: cache file} for every cached series of the interval. When a symbol has both
+    formats, the current CACHE_FORMAT wins. known_files maps file names to symbols already seen.
+    """
+    known_files = known_files or {}
+    suffix = f"_{yf_interval}_data"
+    preferred = md.COLUMN_CACHE_EXT if md.CACHE_FORMAT == 'col' else '.csv'
+    by_base = {}
+    try:
+        names = os.listdir(md.DATA_DIR)
+    except FileNotFoundError:
+        return {}
+    for name in names:
+        base, ext = os.path.splitext(name)
+        if base.endswith(suffix) and ext in (md.COLUMN_CACHE_EXT, '.csv') and not name.startswith('.'):
+            if base not in by_base or ext == preferred:
+                by_base[base] = name
+    sources = {}
+    for base, name in sorted(by_base.items()):
+        path = os.path.join(md.DATA_DIR, name)
+        symbol = known_files.get(name) or _symbol_of(path) or base[:-len(suffix)]
+        sources[symbol] = path
+    return sources
+
+def read_series(cache_file):
+    """(dates as int64 ms UTC, {field: values}, tz) of one cache file, only the panel fields"""
+    if md.is_column_cache(cache_file):
+        store = column_store.ColumnStore(cache_file)
+        dates = np.array(store.column(column_store.DATE_COLUMN), dtype=np.int64)
+        values = {name: np.array(store.column(name)) for name in PANEL_FIELDS if name in store.column_names}
+        return dates, values, store.tz
+    frame = pd.read_csv(cache_file, usecols=lambda name: name == 'date' or name in PANEL_FIELDS)
+    values = {name: frame[name].to_numpy(dtype=np.float64, na_value=np.nan) for name in PANEL_FIELDS if name in frame.columns}
+    # CSV-teksten har bare UTC-offset (ikke tidssonenavn): intradagsdatoer merkes i UTC
+    aware = len(frame) and pd.Timestamp(str(frame['date'].iloc[0])).tzinfo is not None
+    return md._utc_ms(frame['date']), values, ('UTC' if aware else None)
+
+
+# --- Oppdatering ---
+def _build_panel(index, old, sources, changed, stamps):
+    """New (index, dates, fields) from the previous panel plus the re-read `changed` series"""
+    old_symbols = index['symbols'] if index else []
+    kept = [symbol for symbol in old_symbols if symbol in sources]
+    symbols = kept + sorted(symbol for symbol in changed if symbol not in old_symbols)
+    with telemetry.timed('panel_read'):
+        series = {symbol: read_series(sources[symbol]) for symbol in changed}
+    telemetry.increment('panel_series_read', len(series))
+
+    date_sets = [dates for dates, _, _ in series.values()]
+    if old is not None:
+        date_sets.append(np.asarray(old[0]))
+    dates = np.unique(np.concatenate(date_sets)) if date_sets else np.empty(0, dtype=np.int64)
+
+    position = {symbol: i for i, symbol in enumerate(symbols)}
+    copied = [symbol for symbol in kept if symbol not in series] # Uendrede kolonner hentes fra forrige panel
+    if old is not None and copied:
+        old_rows = np.searchsorted(dates, np.asarray(old[0]))
+        old_position = {symbol: i for i, symbol in enumerate(old_symbols)}
+        old_cols = [old_position[symbol] for symbol in copied]
+        new_cols = [position[symbol] for symbol in copied]
+    fields = {}
+    for name in PANEL_FIELDS:
+        matrix = np.full((len(dates), len(symbols)), np.nan, dtype=PANEL_DTYPE)
+        if old is not None and copied and name in old[1]:
+            matrix[np.ix_(old_rows, new_cols)] = old[1][name][:, old_cols]
+        for symbol, (series_dates, values, _) in series.items():
+            if name in values:
+                matrix[np.searchsorted(dates, series_dates), position[symbol]] = values[name]
+        fields[name] = matrix
+
+    # Datoer som bare fantes i omskrevne eller fjernede serier har ingen verdier igjen
+    keep = ~np.isnan(fields['close']).all(axis=1) if symbols else np.zeros(len(dates), dtype=bool)
+    if not keep.all():
+        dates = dates[keep]
+        fields = {name: matrix[keep] for name, matrix in fields.items()}
+
+    tz = next((series_tz for _, _, series_tz in series.values() if series_tz), None) or (index or {}).get('tz')
+    new_index = {
+        'version': (index['version'] + 1) if index else 1,
+        'interval': (index or {}).get('interval'),
+        'rows': len(dates),
+        'symbols': symbols,
+        'fields': list(PANEL_FIELDS),
+        'tz': tz,
+        'sources': {symbol: {'file': os.path.basename(sources[symbol]), 'stamp': stamps[symbol]} for symbol in symbols},
+        'updated': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+    }
+    return new_index, dates, fields
+
+def _update_locked(yf_interval):
+    directory = panel_dir(yf_interval)
+    os.makedirs(directory, exist_ok=True)
+    with cache_lock.FileLock(directory, 'panel', timeout=md.CACHE_LOCK_TIMEOUT_SECONDS):
+        index = read_index(directory)
+        known_files = {info['file']: symbol for symbol, info in (index or {}).get('sources', {}).items()}
+        sources = discover_sources(yf_interval, known_files)
+        stamps = {symbol: list(md._file_stamp(path) or ()) for symbol, path in sources.items()}
+        previous = (index or {}).get('sources', {})
+        changed = [symbol for symbol, path in sources.items()
+                   if previous.get(symbol, {}).get('stamp') != stamps[symbol]
+                   or previous.get(symbol, {}).get('file') != os.path.basename(path)]
+        removed = [symbol for symbol in previous if symbol not in sources]
+        if index is not None and not changed and not removed:
+            return index
+
+        old = None
+        if index is not None:
+            try:
+                old = _load_arrays(directory, index)
+            except (OSError, ValueError, column_store.ColumnStoreError) as e:
+                print_info(f"Rebuilding {yf_interval} panel ({e})")
+                index, changed = None, list(sources)
+        new_index, dates, fields = _build_panel(index, old, sources, changed, stamps)
+        new_index['interval'] = yf_interval
+        with telemetry.timed('panel_write'):
+            version = new_index['version']
+            _save_array(_array_path(directory, 'dates', version), dates)
+            for name, matrix in fields.items():
+                _save_array(_array_path(directory, name, version), matrix)
+            def write_index(tmp_path):
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(new_index, f)
+            cache_lock.atomic_write(_index_path(directory), write_index, suffix='.json')
+        _remove_old_versions(directory, version)
+        telemetry.increment('panel_updates')
+        print_debug("Panel %s v%d: %d dates x %d symbols (%d re-read, %d removed)",
+                    yf_interval, version, len(dates), len(new_index['symbols']), len(changed), len(removed))
+        return new_index
+
+def update_panel(timeframe_id='1d', symbols=None, fetch=False):
+    """
+    Bring the panel of the timeframe up to date with the cache files on disk.
+    With fetch=True the caches of `symbols` (list or 'default') are refreshed first.
+    Returns the panel index.
+    """
+    yf_interval = md.map_timeframe_id_to_yf_interval(timeframe_id)
+    if fetch:
+        symbol_list = md.resolve_symbol_list(symbols) if isinstance(symbols, str) else list(symbols or [])
+        if symbol_list:
+            md.fetch_market_data_batch(symbol_list, timeframe_id)
+    result, _ = _update_flight.do(yf_interval, lambda: _update_locked(yf_interval))
+    return result
+
+def get_panel(timeframe_id='1d', update=True):
+    """The up-to-date Panel of a timeframe (memory-mapped, reused while the index is unchanged)"""
+    yf_interval = md.map_timeframe_id_to_yf_interval(timeframe_id)
+    if update:
+        update_panel(timeframe_id)
+    directory = panel_dir(yf_interval)
+    stamp = md._file_stamp(_index_path(directory))
+    with _loaded_lock:
+        cached = _loaded.get(yf_interval)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    index = read_index(directory)
+    if index is None or not index['symbols']:
+        raise PanelError(f"No cached {yf_interval} series to build a panel from")
+    try:
+        dates, fields = _load_arrays(directory, index)
+    except (OSError, column_store.ColumnStoreError):
+        # Filene ble byttet ut mellom lesing av indeks og data; les på nytt under låsen
+        with cache_lock.FileLock(directory, 'panel', timeout=md.CACHE_LOCK_TIMEOUT_SECONDS):
+            stamp = md._file_stamp(_index_path(directory))
+            index = read_index(directory)
+            dates, fields = _load_arrays(directory, index)
+    panel = Panel(yf_interval, index['version'], dates, index['symbols'], fields, index.get('tz'))
+    with _loaded_lock:
+        _loaded[yf_interval] = (stamp, panel)
+    return panel
+
+
+# --- Screening ---
+_COMPARISONS = {ast.Lt: np.less, ast.LtE: np.less_equal, ast.Gt: np.greater, ast.GtE: np.greater_equal,
+                ast.Eq: np.equal, ast.NotEq: np.not_equal}
+_ARITHMETIC = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.divide,
+               ast.BitAnd: np.logical_and, ast.BitOr: np.logical_or}
+
+def parse_screen(expression):
+    """Parse a screen expression; returns (AST, referenced field names)"""
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError as e:
+        raise PanelError(f"Invalid scan expression '{expression}': {e.msg}") from e
+    names = sorted({node.id for node in ast.walk(tree) if isinstance(node, ast.Name)} - {'abs'})
+    unknown = [name for name in names if name not in PANEL_FIELDS and name not in DERIVED_FIELDS]
+    if unknown:
+        raise PanelError(f"Unknown field(s) {', '.join(unknown)} (use {', '.join(PANEL_FIELDS + DERIVED_FIELDS)})")
+    return tree, names
+
+def evaluate_screen(node, env):
+    """Evaluate a parsed screen expression over arrays in env (vectorized, no Python eval)"""
+    if isinstance(node, ast.Expression):
+        return evaluate_screen(node.body, env)
+    if isinstance(node, ast.BoolOp):
+        combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+        result = evaluate_screen(node.values[0], env)
+        for value in node.values[1:]:
+            result = combine(result, evaluate_screen(value, env))
+        return result
+    if isinstance(node, ast.UnaryOp):
+        operand = evaluate_screen(node.operand, env)
+        if isinstance(node.op, ast.Not):
+            return np.logical_not(operand)
+        if isinstance(node.op, ast.USub):
+            return -operand
+        if isinstance(node.op, ast.UAdd):
+            return operand
+    if isinstance(node, ast.Compare):
+        left = evaluate_screen(node.left, env)
+        result = None
+        for op, comparator in zip(node.ops, node.comparators):
+            if type(op) not in _COMPARISONS:
+                raise PanelError(f"Unsupported comparison {type(op).__name__}")
+            right = evaluate_screen(comparator, env)
+            step = _COMPARISONS[type(op)](left, right)
+            result = step if result is None else np.logical_and(result, step)
+            left = right
+        return result
+    if isinstance(node, ast.BinOp) and type(node.op) in _ARITHMETIC:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return _ARITHMETIC[type(node.op)](evaluate_screen(node.left, env), evaluate_screen(node.right, env))
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == 'abs' and len(node.args) == 1 and not node.keywords:
+        return np.abs(evaluate_screen(node.args[0], env))
+    if isinstance(node, ast.Name):
+        return env[node.id]
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        return node.value
+    raise PanelError(f"Unsupported element in scan expression: {type(node).__name__}")
+
+def cross_section(panel, at=None, window=SCAN_WINDOW_ROWS):
+    """
+    Latest bar of every symbol at or before `at` (default: the newest date), looking back
+    at most `window` rows. Returns ({field: float64 values}, row of each value, has_bar).
+    """
+    stop = panel.rows if at is None else int(np.searchsorted(panel.dates, _date_ms(at, panel.tz), side='right'))
+    start = max(0, stop - window)
+    cols = np.arange(len(panel.symbols))
+    close = np.asarray(panel.fields['close'][start:stop])
+    valid = ~np.isnan(close)
+    has_bar = valid.any(axis=0)
+    last = len(close) - 1 - np.argmax(valid[::-1], axis=0)
+    values = {}
+    for name, matrix in panel.fields.items():
+        block = matrix[start:stop]
+        values[name] = np.where(has_bar, block[last, cols], np.nan).astype(np.float64) if len(close) else np.full(len(cols), np.nan)
+    if len(close):
+        valid[last, cols] = False # Forrige bar: siste gyldige rad før `last`
+        has_prev = valid.any(axis=0) & has_bar
+        prev = len(close) - 1 - np.argmax(valid[::-1], axis=0)
+        prev_close = np.where(has_prev, close[prev, cols], np.nan).astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values['change_pct'] = (values['close'] / prev_close - 1) * 100
+    else:
+        values['change_pct'] = np.full(len(cols), np.nan)
+    return values, start + last, has_bar
+
+def _date_ms(value, tz):
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is None and tz:
+        ts = ts.tz_localize(tz)
+    if ts.tzinfo is not None:
+        ts = ts.tz_convert('UTC').tz_localize(None)
+    return int(np.datetime64(ts.to_datetime64(), 'ms').astype(np.int64))
+
+@telemetry.timed('scan')
+def scan(timeframe_id, expression, symbols=None, at=None, sort=None, descending=False, top=None):
+    """
+    Symbols whose latest bar matches the screen expression, e.g. scan('1d', 'rsi < 30').
+    Each result has the symbol, its bar date, close, change_pct and the fields used in the
+    expression (and in `sort`). Sorted by `sort` (default: symbol), at most `top` results.
+    """
+    tree, names = parse_screen(expression)
+    if sort and sort not in PANEL_FIELDS + DERIVED_FIELDS:
+        raise PanelError(f"Unknown sort field '{sort}'")
+    panel = get_panel(timeframe_id)
+    values, rows, has_bar = cross_section(panel, at)
+    matched = np.asarray(evaluate_screen(tree, values), dtype=bool) & has_bar
+    if symbols:
+        allowed = np.zeros(len(panel.symbols), dtype=bool)
+        allowed[panel.columns(symbols)] = True
+        matched &= allowed
+    hits = np.flatnonzero(matched)
+    if sort:
+        order = np.argsort(values[sort][hits], kind='stable')
+        hits = hits[order[::-1]] if descending else hits[order]
+        hits = np.r_[hits[~np.isnan(values[sort][hits])], hits[np.isnan(values[sort][hits])]] # NaN sist
+    if top:
+        hits = hits[:int(top)]
+
+    shown = list(dict.fromkeys(['close', 'change_pct', *names, *([sort] if sort else [])]))
+    labels = panel.date_labels(rows[hits]) if len(hits) else []
+    results = []
+    for i, col in enumerate(hits.tolist()):
+        row = {'symbol': panel.symbols[col], 'date': labels[i]}
+        for name in shown:
+            value = values[name][col]
+            row[name] = None if np.isnan(value) else round(float(value), 6)
+        results.append(row)
+    return {
+        'timeframe': timeframe_id,
+        'query': expression,
+        'date': panel.date_labels([rows[has_bar].max()])[0] if has_bar.any() else None,
+        'universe': int(has_bar.sum()),
+        'matches': int(matched.sum()),
+        'results': results,
+    }
+
+
+# --- Korrelasjon ---
+def pairwise_correlation(values):
+    """
+    Pearson correlation between the columns of `values` over the rows where both are
+    not NaN, via matrix products. Returns (correlation, number of shared rows).
+    """
+    mask = ~np.isnan(values)
+    if mask.all(): # Ingen hull: én matriseoperasjon
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = np.corrcoef(values, rowvar=False).reshape(values.shape[1], values.shape[1])
+        return np.clip(corr, -1.0, 1.0), np.full(corr.shape, len(values), dtype=np.int64)
+    x = np.where(mask, values, 0.0)
+    m = mask.astype(np.float64)
+    n = m.T @ m
+    sx = x.T @ m # sx[i, j]: sum av kolonne i over radene der både i og j har verdier
+    sxx = (x * x).T @ m
+    sxy = x.T @ x
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = n * sxy - sx * sx.T
+        var = (n * sxx - sx * sx) * (n * sxx.T - sx.T * sx.T)
+        corr = cov / np.sqrt(var)
+    corr[~(var > 0)] = np.nan
+    return np.clip(corr, -1.0, 1.0), n.astype(np.int64)
+
+@telemetry.timed('correlation')
+def correlation_matrix(timeframe_id='1d', symbols=None, window=DEFAULT_CORRELATION_WINDOW, min_periods=DEFAULT_MIN_PERIODS):
+    """
+    Correlation matrix of close-to-close returns over the last `window` bars.
+    Gaps (e.g. different trading days) are bridged: a return spans back to the symbol's
+    previous bar. Pairs with fewer than min_periods shared returns are None.
+    """
+    panel = get_panel(timeframe_id)
+    cols = panel.columns(symbols)
+    window = max(2, int(window))
+    start = max(0, panel.rows - window - 1)
+    close = np.asarray(panel.fields['close'][start:, cols], dtype=np.float64)
+    filled = pd.DataFrame(close).ffill().to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = filled[1:] / filled[:-1] - 1
+    returns[np.isnan(close[1:])] = np.nan # Ingen bar på datoen: ingen avkastning
+    corr, shared = pairwise_correlation(returns)
+    corr[shared < int(min_periods)] = np.nan
+    labels = panel.date_labels([start, panel.rows - 1]) if panel.rows else [None, None]
+    matrix = np.round(corr, 6).tolist()
+    for i, j in zip(*np.nonzero(np.isnan(corr))): # JSON: NaN -> None
+        matrix[i][j] = None
+    return {
+        'timeframe': timeframe_id,
+        'symbols': [panel.symbols[i] for i in cols.tolist()],
+        'start': labels[0],
+        'end': labels[-1],
+        'window': int(len(returns)),
+        'matrix': matrix,
+    }
+
+
+# --- Serve-kommandoer ---
+def handle_panel_request(request):
+    """
+    Serve-mode 'scan' / 'correlation' request. symbols is a list or a comma-separated
+    string ('default' = DEFAULT_SYMBOLS); correlation fetches missing/stale caches of its
+    symbols first, scan does so only with "refresh": true.
+    """
+    cmd = request.get('cmd')
+    timeframe_id = request.get('timeframe', '1d')
+    symbols = request.get('symbols')
+    if isinstance(symbols, str):
+        symbols = md.resolve_symbol_list(symbols)
+    if cmd == 'scan':
+        if not request.get('query'):
+            raise PanelError("'query' is required for the scan command")
+        if request.get('refresh') and symbols:
+            update_panel(timeframe_id, symbols, fetch=True)
+        return {'result': scan(
+            timeframe_id, request['query'], symbols, at=request.get('at'), sort=request.get('sort'),
+            descending=bool(request.get('desc')), top=request.get('top'))}
+    if cmd == 'correlation':
+        symbols = symbols or md.resolve_symbol_list('default')
+        update_panel(timeframe_id, symbols, fetch=True)
+        return {'result': correlation_matrix(
+            timeframe_id, symbols, window=int(request.get('window') or DEFAULT_CORRELATION_WINDOW),
+            min_periods=int(request.get('min_periods') or DEFAULT_MIN_PERIODS))}
+    raise PanelError(f"Unknown panel command '{cmd}'")
+
+
+# --- Hovedlogikk for å håndtere argumenter ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the date x symbol panel of cached series and run universe scans or correlations.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+        )
+    parser.add_argument('--timeframe', type=str, default='1d', help='Timeframe ID (e.g., 1h, 1d, 1wk, 1mo)')
+    parser.add_argument('--symbols', type=str, default=None, help="Comma-separated symbols ('default' = DEFAULT_SYMBOLS): restricts scans/correlation, and is the set refreshed with --fetch.")
+    parser.add_argument('--fetch', action='store_true', help='Refresh the caches of --symbols before updating the panel.')
+    parser.add_argument('--scan', type=str, default=None, metavar='EXPR', help="Screen expression, e.g. 'rsi < 30 and close > sma20'.")
+    parser.add_argument('--at', type=str, default=None, help='Scan the latest bar at or before this date instead of the newest.')
+    parser.add_argument('--sort', type=str, default=None, help='Field to sort scan results by.')
+    parser.add_argument('--desc', action='store_true', help='Sort descending.')
+    parser.add_argument('--top', type=int, default=None, help='Only the first N scan results.')
+    parser.add_argument('--correlation', action='store_true', help='Print the correlation matrix of returns.')
+    parser.add_argument('--window', type=int, default=DEFAULT_CORRELATION_WINDOW, help='Bars of returns used for --correlation.')
+    args = parser.parse_args()
+
+    # Stdout er reservert for JSON-resultatet
+    import sys
+    sys.stdout = sys.stderr
+    try:
+        symbols = md.resolve_symbol_list(args.symbols) if args.symbols else None
+        index = update_panel(args.timeframe, symbols, fetch=args.fetch)
+        if args.scan:
+            result = scan(args.timeframe, args.scan, symbols, at=args.at, sort=args.sort, descending=args.desc, top=args.top)
+        elif args.correlation:
+            result = correlation_matrix(args.timeframe, symbols, window=args.window)
+        else:
+            result = {key: index[key] for key in ('interval', 'version', 'rows', 'updated')}
+            result['symbols'] = len(index['symbols'])
+        md.flush_access_stats()
+        sys.stdout = sys.__stdout__
+        print(json.dumps(result, indent=2))
+    except (PanelError, OSError, ValueError) as e:
+        sys.stdout = sys.__stdout__
+        print_error(f"Panel command failed: {e}")
+        sys.exit(1)
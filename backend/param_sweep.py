@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Parameter sweep (grid search) for backtest strategies.
+
+Takes a strategy template (same shape as the frontend strategy object) plus
+parameter ranges, backtests every combination on the cached series of one
+symbol/timeframe and returns the combinations ranked by a metric.
+
+Combinations are spread over a process pool. The series is written once to a
+column store snapshot that every worker memory-maps, so price arrays are never
+pickled per task. Each worker keeps its indicator columns and condition masks
+between combinations, and neighbouring grid points (which share most
+parameters) are sent to the same worker, so shared periods are computed once.
+
+Parameters are addressed by path into the strategy object:
+  {'stopLoss': [1, 2, 3],
+   'longEntryIndicators.0.period': {'start': 10, 'stop': 50, 'step': 5}}
+"""
+
+import os
+import sys
+import copy
+import json
+import math
+import time
+import shutil
+import argparse
+import tempfile
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import column_store
+import indicator_engine
+import backtest_engine
+import market_data_yf as md
+from market_data_yf import print_info, print_warning, print_error
+
+# --- Konfigurasjon ---
+DEFAULT_RANK_BY = 'netProfit'
+DEFAULT_TOP = 50
+MAX_COMBINATIONS = 1000000
+MIN_PARALLEL_COMBINATIONS = 256 # Under dette lønner det seg ikke å starte prosesser
+TASKS_PER_WORKER = 8
+MAX_CHUNK_SIZE = 500
+# ---------------------
+
+# Metrikk -> høyere er bedre?
+RANK_METRICS = {
+    'netProfit': True,
+    'finalCapital': True,
+    'sharpeRatio': True,
+    'profitFactor': True,
+    'winRate': True,
+    'totalTrades': True,
+    'maxDrawdown': False,
+}
+
+
+class SweepError(ValueError):
+    """Raised for invalid parameter grids or sweep options"""
+
+
+# --- Parametergrid ---
+def _parse_value(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text.strip()
+
+def expand_range(values):
+    """
+    Expand one parameter range: a list of values, {'start', 'stop', 'step'} (stop inclusive),
+    or a CLI string 'start:stop:step' / 'a,b,c'.
+    """
+    if isinstance(values, str):
+        if ':' in values:
+            parts = [float(p) for p in values.split(':')]
+            if len(parts) != 3:
+                raise SweepError(f"Range '{values}' must be start:stop:step")
+            values = dict(zip(('start', 'stop', 'step'), parts))
+        else:
+            values = [_parse_value(v) for v in values.split(',')]
+    if isinstance(values, dict):
+        start, stop, step = values.get('start'), values.get('stop'), values.get('step', 1)
+        if start is None or stop is None or not step or step <= 0 or stop < start:
+            raise SweepError(f"Invalid range {values}: need start <= stop and step > 0")
+        count = int(math.floor((stop - start) / step + 1e-9)) + 1
+        values = [round(start + i * step, 10) for i in range(count)]
+        if all(float(v).is_integer() for v in (start, step)):
+            values = [int(v) for v in values]
+    if not isinstance(values, (list, tuple)) or not values:
+        raise SweepError(f"Parameter range must be a non-empty list or range, got {values!r}")
+    return list(values)
+
+def parameter_grid(params):
+    """(names, list of value tuples) for the cartesian product of all ranges"""
+    if not params:
+        raise SweepError("No parameters to sweep")
+    names = list(params)
+    ranges = [expand_range(params[name]) for name in names]
+    total = math.prod(len(r) for r in ranges)
+    if total > MAX_COMBINATIONS:
+        raise SweepError(f"Grid has {total} combinations (max {MAX_COMBINATIONS})")
+    return names, list(itertools.product(*ranges))
+
+def set_path(strategy, path, value):
+    """Set a value by dotted path ('longEntryIndicators.0.period') in a strategy object"""
+    keys = path.split('.')
+    target = strategy
+    try:
+        for key in keys[:-1]:
+            target = target[int(key)] if isinstance(target, list) else target[key]
+        last = keys[-1]
+        if isinstance(target, list):
+            target[int(last)] = value
+        else:
+            target[last] = value
+    except (KeyError, IndexError, ValueError, TypeError) as e:
+        raise SweepError(f"Invalid parameter path '{path}': {e}") from e
+
+def apply_params(template, names, values):
+    """Copy of the template with the parameters set (only containers on the parameter paths are copied)"""
+    strategy = dict(template)
+    copied = set()
+    for name, value in zip(names, values):
+        keys = name.split('.')
+        parent = strategy
+        for depth, key in enumerate(keys[:-1]):
+            index = int(key) if isinstance(parent, list) and key.isdigit() else key
+            try:
+                child = parent[index]
+            except (KeyError, IndexError, TypeError) as e:
+                raise SweepError(f"Invalid parameter path '{name}': {e}") from e
+            if tuple(keys[:depth + 1]) not in copied:
+                child = copy.copy(child)
+                parent[index] = child
+                copied.add(tuple(keys[:depth + 1]))
+            parent = child
+        set_path(parent, keys[-1], value)
+    return strategy
+
+
+# --- Evaluering (kjøres i arbeidsprosessene) ---
+class SweepEvaluator:
+    """Backtests strategies on one memory-mapped series, reusing indicators and condition masks"""
+
+    def __init__(self, snapshot_path, start=0):
+        store = column_store.ColumnStore(snapshot_path)
+        full = {col: store.column(col) for col in indicator_engine.PRICE_COLUMNS if col in store.column_names}
+        # Indikatorer beregnes på hele serien og kuttes deretter, som i run_backtest
+        self.context = indicator_engine.IndicatorContext(full)
+        self.start = start
+        self.prices = {col: values[start:] for col, values in self.context.arrays.items()}
+        self.candles = len(self.prices['close'])
+        self.indicators = {}
+        self.masks = {}
+
+    def evaluate(self, strategy):
+        """Numeric performance metrics (see backtest_engine.performance_metrics) for one strategy"""
+        missing = [spec for spec in backtest_engine.strategy_indicator_specs(strategy)
+                   if not all(col in self.indicators for col in indicator_engine.output_columns(spec))]
+        if missing:
+            computed = indicator_engine.compute_indicators(None, missing, context=self.context)
+            self.indicators.update({col: values[self.start:] for col, values in computed.items()})
+        result = backtest_engine.backtest_arrays(strategy, self.prices, self.indicators, mask_cache=self.masks)
+        initial_capital = strategy.get('initialCapital') or backtest_engine.DEFAULT_INITIAL_CAPITAL
+        return backtest_engine.performance_metrics(result, initial_capital, self.candles)
+
+_evaluator = None
+
+def _init_worker(snapshot_path, start):
+    global _evaluator
+    _evaluator = SweepEvaluator(snapshot_path, start)
+
+def _evaluate_chunk(template, names, chunk):
+    """Evaluate [(index, values), ...] in this process. Returns [(index, metrics or error string)]."""
+    results = []
+    for index, values in chunk:
+        try:
+            results.append((index, _evaluator.evaluate(apply_params(template, names, values))))
+        except (backtest_engine.BacktestError, indicator_engine.IndicatorError, SweepError) as e:
+            results.append((index, str(e)))
+    return results
+
+
+# --- Offentlig API ---
+def _write_snapshot(frame, directory):
+    """Write the series to a column store snapshot that workers can memory-map"""
+    path = os.path.join(directory, 'sweep_series.col')
+    columns = ['date'] + [col for col in indicator_engine.PRICE_COLUMNS if col in frame.columns]
+    column_store.write_frame(path, frame[columns], capacity=len(frame))
+    return path
+
+def _chunks(items, workers):
+    size = max(1, min(MAX_CHUNK_SIZE, math.ceil(len(items) / (workers * TASKS_PER_WORKER))))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def _rank(names, grid, metrics, rank_by, top):
+    higher_is_better = RANK_METRICS[rank_by]
+    scored = []
+    for index, result in metrics.items():
+        if isinstance(result, dict) and not math.isnan(result[rank_by]):
+            scored.append((result[rank_by] if higher_is_better else -result[rank_by], index))
+    # Stabil rekkefølge ved like verdier: grid-rekkefølgen
+    scored.sort(key=lambda item: (-item[0], item[1]))
+    rows = []
+    for rank, (_, index) in enumerate(scored[:top] if top else scored, start=1):
+        result = metrics[index]
+        score = result[rank_by] if math.isfinite(result[rank_by]) else 'Infinity'
+        rows.append({'rank': rank, 'params': dict(zip(names, grid[index])), 'score': score,
+                     **backtest_engine.format_metrics(result)})
+    return rows, len(scored)
+
+def run_sweep(template, params, symbol, timeframe_id='1d', days=None, rank_by=DEFAULT_RANK_BY,
+              top=DEFAULT_TOP, workers=None):
+    """
+    Backtest every combination of `params` applied to the strategy template.
+    Returns a summary with the `top` combinations ranked by `rank_by` (all when top is 0/None).
+    """
+    if rank_by not in RANK_METRICS:
+        raise SweepError(f"Unknown rank metric '{rank_by}'. Available: {sorted(RANK_METRICS)}")
+    names, grid = parameter_grid(params)
+    apply_params(template, names, grid[0]) # Feil i stiene oppdages før arbeidet starter
+    frame = md.get_market_frame(symbol, timeframe_id)
+    if frame is None or frame.empty:
+        raise backtest_engine.BacktestError(f"No data available for {symbol} ({timeframe_id})")
+    start = max(0, len(frame) - int(days)) if days else 0
+    workers = max(1, workers or os.cpu_count() or 1)
+    if len(grid) < MIN_PARALLEL_COMBINATIONS:
+        workers = 1
+
+    started = time.time()
+    print_info(f"Sweep {symbol} ({timeframe_id}): {len(grid)} combinations of {names} on {workers} process(es).")
+    items = list(enumerate(grid))
+    metrics = {}
+    snapshot_dir = tempfile.mkdtemp(prefix='sweep_')
+    try:
+        snapshot_path = _write_snapshot(frame, snapshot_dir)
+        if workers == 1:
+            _init_worker(snapshot_path, start)
+            metrics.update(_evaluate_chunk(template, names, items))
+        else:
+            # 'spawn' er trygt også når kalleren har tråder (serve-modus)
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                     initargs=(snapshot_path, start)) as pool:
+                futures = [pool.submit(_evaluate_chunk, template, names, chunk) for chunk in _chunks(items, workers)]
+                for future in as_completed(futures):
+                    metrics.update(future.result())
+    finally:
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+    failed = {index: error for index, error in metrics.items() if isinstance(error, str)}
+    if failed:
+        index, error = next(iter(failed.items()))
+        print_warning(f"Sweep: {len(failed)} combinations failed (e.g. {dict(zip(names, grid[index]))}: {error})")
+    rows, ranked = _rank(names, grid, metrics, rank_by, top)
+    elapsed = time.time() - started
+    print_info(f"Sweep finished: {len(grid)} combinations in {elapsed:.1f}s "
+               f"({len(grid) / max(elapsed, 1e-9):.0f}/s).")
+    return {
+        'symbol': symbol,
+        'timeframe': timeframe_id,
+        'candles': len(frame) - start,
+        'parameters': names,
+        'combinations': len(grid),
+        'ranked': ranked,
+        'failed': len(failed),
+        'rankBy': rank_by,
+        'elapsedSeconds': round(elapsed, 3),
+        'results': rows,
+    }
+
+
+# --- Hovedlogikk for å håndtere argumenter ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Grid-search strategy parameters with backtests on cached market data.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+        )
+    parser.add_argument('--strategy', type=str, required=True, help='Path to the strategy template JSON file.')
+    parser.add_argument('--grid', type=str, default=None, help='Path to a JSON file mapping parameter paths to ranges.')
+    parser.add_argument('--param', action='append', default=[], metavar='PATH=RANGE',
+                        help="Parameter range, e.g. 'longEntryIndicators.0.period=10:50:5' or 'stopLoss=1,2,3'. Repeatable.")
+    parser.add_argument('--symbol', type=str, required=True, help='Trading symbol (e.g., AAPL)')
+    parser.add_argument('--timeframe', type=str, default='1d', help='Timeframe ID (e.g., 1h, 1d, 1wk, 1mo)')
+    parser.add_argument('--days', type=int, default=None, help='Only backtest the last N candles.')
+    parser.add_argument('--rank-by', type=str, default=DEFAULT_RANK_BY, choices=sorted(RANK_METRICS), help='Metric to rank by.')
+    parser.add_argument('--top', type=int, default=DEFAULT_TOP, help='Number of ranked rows to print (0 = all).')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: all CPU cores).')
+    args = parser.parse_args()
+
+    try:
+        with open(args.strategy, encoding='utf-8') as f:
+            template = json.load(f)
+        params = {}
+        if args.grid:
+            with open(args.grid, encoding='utf-8') as f:
+                params.update(json.load(f))
+        for item in args.param:
+            if '=' not in item:
+                raise SweepError(f"--param must be PATH=RANGE, got '{item}'")
+            path, values = item.split('=', 1)
+            params[path.strip()] = values
+        # Stdout er reservert for JSON-resultatet
+        sys.stdout = sys.stderr
+        summary = run_sweep(template, params, args.symbol, args.timeframe, days=args.days,
+                            rank_by=args.rank_by, top=args.top, workers=args.workers)
+        sys.stdout = sys.__stdout__
+        print(json.dumps(summary, indent=2))
+    except (SweepError, backtest_engine.BacktestError, OSError, ValueError) as e:
+        sys.stdout = sys.__stdout__
+        print_error(f"Sweep failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,530 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark of the fetch/process/cache pipeline in market_data_yf.
+
+yf.download is replaced by a deterministic synthetic OHLCV generator
+(FakeYahoo), so the suite runs without network access. For each
+interval (1h/1d), column shape (yfinance MultiIndex or flat), cache format
+(col/csv) and row count it measures:
+
+- every stage of fetch_market_data_yf in isolation (normalize, indicators,
+  dropna/sort, write) and cache reads (full load, tail read, warm frame cache),
+- end-to-end cold, incremental and batch fetches, with the per-stage
+  breakdown from telemetry.
+
+Each case reports median latency, throughput (rows/s) and peak traced
+memory (tracemalloc, in a separate pass so it does not distort the timings).
+Results can be saved as a baseline JSON and later runs compared against it;
+with --baseline the exit code is 1 when a case regressed beyond the tolerance.
+
+  python pipeline_benchmark.py --rows 10000,100000 --save-baseline bench.json
+  python pipeline_benchmark.py --rows 10000,100000 --baseline bench.json
+  python pipeline_benchmark.py --check     (correctness checks only)
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+import telemetry
+import market_data_yf as md
+from market_data_yf import print_info, print_warning, print_error
+
+# --- Konfigurasjon ---
+DEFAULT_ROWS = [10_000, 100_000]
+DEFAULT_INTERVALS = ['1h', '1d']
+DEFAULT_SHAPES = ['multi', 'flat']
+DEFAULT_FORMATS = ['col', 'csv']
+DEFAULT_REPEAT = 5
+DEFAULT_TOLERANCE = 0.25 # Tillatt økning i latens før det regnes som regresjon
+DEFAULT_MEMORY_TOLERANCE = 0.25
+# Små absolutte endringer er målestøy, ikke regresjoner
+MIN_LATENCY_DELTA_MS = 2.0
+MIN_MEMORY_DELTA_MB = 0.5
+DEFAULT_BATCH_SYMBOLS = 8
+INCREMENTAL_NEW_BARS = 5
+TAIL_ROWS = 300
+SYNTHETIC_END = pd.Timestamp('2025-01-03 20:00') # Fast sluttdato gir like data på hver kjøring
+MAX_DAILY_ROWS = 80_000 # Virkedager tilbake til ca. 1700 (pandas' datoområde i ns)
+BENCH_SYMBOL = 'BENCH'
+# ---------------------
+
+
+class BenchmarkError(ValueError):
+    """Invalid benchmark configuration"""
+
+
+# --- Syntetiske data ---
+def synthetic_index(rows, interval):
+    """DatetimeIndex of `rows` bars ending at SYNTHETIC_END (1h: continuous hours in exchange time, 1d: business days)"""
+    if interval == '1h':
+        # Døgnkontinuerlige timer (som forex) i UTC, vist i børstid som fra yfinance
+        index = pd.date_range(end=SYNTHETIC_END.tz_localize('UTC'), periods=rows, freq='h').tz_convert('America/New_York')
+        return index.rename('Datetime')
+    if interval == '1d':
+        if rows > MAX_DAILY_ROWS:
+            raise BenchmarkError(f"1d supports at most {MAX_DAILY_ROWS} rows (pandas datetime range)")
+        return pd.bdate_range(end=SYNTHETIC_END.normalize(), periods=rows).rename('Date')
+    raise BenchmarkError(f"Unsupported benchmark interval '{interval}'")
+
+def synthetic_ohlcv(rows, interval, seed=0):
+    """Deterministic random-walk OHLCV frame with yfinance's flat column names"""
+    rng = np.random.default_rng(seed)
+    close = 100.0 * np.exp(np.cumsum(rng.normal(0.0, 0.01, rows)))
+    open_ = close * np.exp(rng.normal(0.0, 0.003, rows))
+    spread = close * rng.uniform(0.0, 0.01, rows)
+    return pd.DataFrame({
+        'Open': open_,
+        'High': np.maximum(open_, close) + spread,
+        'Low': np.minimum(open_, close) - spread,
+        'Close': close,
+        'Volume': rng.integers(1_000, 1_000_000, rows),
+    }, index=synthetic_index(rows, interval))
+
+def to_yf_shape(frame, symbol, shape):
+    """Give a flat frame the column layout yf.download returns for one ticker"""
+    if shape == 'flat':
+        return frame
+    if shape == 'multi':
+        # yfinance >= 0.2.48: kolonner (Price, Ticker), alfabetisk sortert
+        frame = frame[['Close', 'High', 'Low', 'Open', 'Volume']]
+        frame.columns = pd.MultiIndex.from_product([frame.columns, [symbol]], names=['Price', 'Ticker'])
+        return frame
+    raise BenchmarkError(f"Unknown column shape '{shape}'")
+
+
+class FakeYahoo:
+    """
+    Stand-in for yf.download serving synthetic series. Each symbol gets its own
+    seed; `cutoff` hides the newest bars so a later call can "publish" them for
+    incremental refreshes. Full-history requests ignore the start date so 1h can
+    be benchmarked beyond yfinance's 730-day limit.
+    """
+
+    def __init__(self, rows, interval, shape='multi', extra_bars=INCREMENTAL_NEW_BARS):
+        self.rows = rows
+        self.interval = interval
+        self.shape = shape
+        self.extra_bars = extra_bars
+        self.cutoff = rows
+        self.honor_start = False
+        self.calls = 0
+        self._frames = {}
+
+    def series(self, symbol):
+        frame = self._frames.get(symbol)
+        if frame is None:
+            seed = sum(ord(ch) for ch in symbol)
+            frame = self._frames[symbol] = synthetic_ohlcv(self.rows + self.extra_bars, self.interval, seed)
+        return frame.iloc[:self.cutoff]
+
+    def _slice(self, symbol, start):
+        frame = self.series(symbol)
+        if start is not None and self.honor_start:
+            start = pd.Timestamp(start)
+            if frame.index.tz is not None and start.tzinfo is None:
+                start = start.tz_localize(frame.index.tz)
+            frame = frame[frame.index >= start]
+        return frame
+
+    def download(self, tickers=None, start=None, end=None, interval='1d', group_by='column', **kwargs):
+        self.calls += 1
+        if isinstance(tickers, str):
+            return to_yf_shape(self._slice(tickers, start).copy(), tickers, self.shape)
+        # Gruppert nedlasting: (ticker, felt) som med group_by='ticker'
+        frames = {symbol: self._slice(symbol, start) for symbol in tickers}
+        return pd.concat(frames, axis=1, names=['Ticker', 'Price'])
+
+@contextmanager
+def offline_market_data(fake, cache_format):
+    """Route market_data_yf to the fake downloader and a temporary cache directory"""
+    saved = (md.yf.download, md.DATA_DIR, md.CACHE_FORMAT)
+    data_dir = tempfile.mkdtemp(prefix='md_bench_')
+    md.yf.download = fake.download
+    md.DATA_DIR = data_dir
+    md.CACHE_FORMAT = cache_format
+    md.get_frame_cache().clear()
+    try:
+        yield data_dir
+    finally:
+        md.flush_access_stats() # Bruksstatistikken skal ikke havne i den ekte cachen
+        md.yf.download, md.DATA_DIR, md.CACHE_FORMAT = saved
+        md.get_frame_cache().clear()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+# --- Måling ---
+def measure(run, setup=None, repeat=DEFAULT_REPEAT, memory=True):
+    """
+    Time run(setup()) `repeat` times (setup is not timed) and, in one extra
+    pass, trace its peak memory. Returns latency/peak statistics.
+    """
+    times = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        run(arg)
+        times.append(time.perf_counter() - start)
+    result = {
+        'latency_ms': round(statistics.median(times) * 1000, 3),
+        'min_ms': round(min(times) * 1000, 3),
+    }
+    if memory:
+        arg = setup() if setup else None
+        tracemalloc.start()
+        try:
+            run(arg)
+            result['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2**20, 3)
+        finally:
+            tracemalloc.stop()
+    return result
+
+def _with_throughput(result, rows):
+    result['rows'] = rows
+    result['rows_per_s'] = round(rows / (result['latency_ms'] / 1000), 1) if result['latency_ms'] else None
+    return result
+
+def _make_stale(path):
+    old = time.time() - (md.CACHE_HOURS + 1) * 3600
+    os.utime(path, (old, old))
+
+def _stage_breakdown():
+    """Average ms per telemetry stage since the last reset"""
+    return {stage: timing['avg_ms'] for stage, timing in telemetry.snapshot()['stages'].items()
+            if not stage.startswith('request.')}
+
+
+def bench_stages(rows, interval, shape, cache_format, repeat):
+    """Each fetch stage and the cache reads in isolation"""
+    fake = FakeYahoo(rows, interval, shape)
+    results = {}
+    with offline_market_data(fake, cache_format) as data_dir:
+        raw = fake.download(tickers=BENCH_SYMBOL, interval=interval)
+        normalized = md.normalize_yf_data(raw.copy(), BENCH_SYMBOL, interval)
+        with_indicators = md.calculate_indicators(normalized)
+        final = md.drop_incomplete_and_sort(with_indicators.copy(), BENCH_SYMBOL)
+        cache_file = md.get_cache_file_path(BENCH_SYMBOL, interval)
+
+        results['normalize'] = measure(
+            lambda frame: md.normalize_yf_data(frame, BENCH_SYMBOL, interval), raw.copy, repeat)
+        results['indicators'] = measure(lambda _: md.calculate_indicators(normalized), None, repeat)
+        results['dropna_sort'] = measure(
+            lambda frame: md.drop_incomplete_and_sort(frame, BENCH_SYMBOL), with_indicators.copy, repeat)
+        results['write'] = measure(
+            lambda _: md.write_cache_file(final, cache_file, BENCH_SYMBOL, interval), None, repeat)
+        results['read_full'] = measure(lambda _: md.load_cache_frame(cache_file), None, repeat)
+        results['read_tail'] = measure(lambda _: md.read_cache_tail(cache_file, TAIL_ROWS), None, repeat)
+        results['cache_bytes'] = os.path.getsize(cache_file)
+
+        md.get_market_frame(BENCH_SYMBOL, interval) # Fyll minnecachen
+        results['frame_cache_hit'] = measure(lambda _: md.get_market_frame(BENCH_SYMBOL, interval), None, repeat)
+    cache_bytes = results.pop('cache_bytes')
+    for name, result in results.items():
+        _with_throughput(result, TAIL_ROWS if name == 'read_tail' else rows)
+    results['write']['bytes'] = cache_bytes
+    return results
+
+def bench_pipeline(rows, interval, shape, cache_format, repeat, batch_symbols):
+    """End-to-end fetches through fetch_market_data_yf / fetch_market_data_batch"""
+    fake = FakeYahoo(rows, interval, shape)
+    results = {}
+    with offline_market_data(fake, cache_format):
+        cache_file = md.get_cache_file_path(BENCH_SYMBOL, interval)
+
+        def remove_cache():
+            if os.path.exists(cache_file):
+                os.remove(cache_file)
+        telemetry.reset()
+        results['fetch_cold'] = measure(
+            lambda _: md.fetch_market_data_yf(BENCH_SYMBOL, interval), remove_cache, repeat)
+        results['fetch_cold']['stages'] = _stage_breakdown()
+
+        results['fetch_fresh'] = measure(lambda _: md.fetch_market_data_yf(BENCH_SYMBOL, interval), None, repeat)
+
+        # Inkrementell: cachen har `rows` barer, Yahoo har fått INCREMENTAL_NEW_BARS nye
+        snapshot_file = cache_file + '.bench'
+        shutil.copyfile(cache_file, snapshot_file)
+        fake.honor_start = True
+
+        def stale_cache():
+            fake.cutoff = fake.rows
+            shutil.copyfile(snapshot_file, cache_file)
+            _make_stale(cache_file)
+            fake.cutoff = fake.rows + fake.extra_bars
+        telemetry.reset()
+        results['fetch_incremental'] = measure(
+            lambda _: md.fetch_market_data_yf(BENCH_SYMBOL, interval), stale_cache, repeat)
+        results['fetch_incremental']['stages'] = _stage_breakdown()
+        fake.honor_start = False
+        fake.cutoff = fake.rows
+
+        symbols = [f"{BENCH_SYMBOL}{i}" for i in range(batch_symbols)]
+
+        def remove_batch_caches():
+            for symbol in symbols:
+                path = md.get_cache_file_path(symbol, interval)
+                if os.path.exists(path):
+                    os.remove(path)
+        telemetry.reset()
+        results['fetch_batch_cold'] = measure(
+            lambda _: md.fetch_market_data_batch(symbols, interval), remove_batch_caches, repeat, memory=False)
+        results['fetch_batch_cold']['stages'] = _stage_breakdown()
+    for name, result in results.items():
+        _with_throughput(result, rows * (batch_symbols if name == 'fetch_batch_cold' else 1))
+    results['fetch_incremental']['rows'] = INCREMENTAL_NEW_BARS
+    return results
+
+def run_benchmarks(rows_list, intervals, shapes, formats, repeat=DEFAULT_REPEAT, batch_symbols=DEFAULT_BATCH_SYMBOLS):
+    """Run all combinations. Returns {'meta': ..., 'cases': {case_name: result}}."""
+    cases = {}
+    for interval in intervals:
+        for rows in rows_list:
+            if interval == '1d' and rows > MAX_DAILY_ROWS:
+                print_warning(f"Skipping 1d with {rows} rows (max {MAX_DAILY_ROWS}).")
+                continue
+            for shape in shapes:
+                for cache_format in formats:
+                    prefix = f"{interval}/{shape}/{cache_format}/{rows}"
+                    print_info(f"Benchmarking {prefix} ...")
+                    for name, result in bench_stages(rows, interval, shape, cache_format, repeat).items():
+                        cases[f"{prefix}/{name}"] = result
+                    pipeline_symbols = batch_symbols if rows <= 100_000 else 0
+                    if pipeline_symbols:
+                        for name, result in bench_pipeline(rows, interval, shape, cache_format, repeat, pipeline_symbols).items():
+                            cases[f"{prefix}/{name}"] = result
+    return {'meta': environment_info(repeat), 'cases': cases}
+
+def environment_info(repeat):
+    import yfinance
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'yfinance': yfinance.__version__,
+        'repeat': repeat,
+        'low_memory': md.LOW_MEMORY,
+    }
+
+
+# --- Korrekthetskontroller ---
+GAP_CHECK_ROWS = 500
+GAP_CHECK_ROW = 100
+DERIVED_CHECK_TIMEFRAME = '1wk'
+DERIVED_CHECK_ROWS = 2000 # Nok avledede barer til å passere indikator-lookback (inkrementell avledning)
+
+def check_interior_gap(interval='1d', cache_format='col', rows=GAP_CHECK_ROWS, gap_row=GAP_CHECK_ROW):
+    """
+    Regression check: one all-NaN bar inside a download must not poison the cached
+    indicators. SMA20 must match pandas' rolling mean over the complete bars and RSI
+    must keep moving after the gap. Returns a list of failures (empty when it passes).
+    """
+    fake = FakeYahoo(rows, interval, 'multi', extra_bars=0)
+    series = fake.series(BENCH_SYMBOL).copy()
+    series.iloc[gap_row, :] = np.nan # Slik yfinance av og til leverer helligdager
+    fake._frames[BENCH_SYMBOL] = series
+    failures = []
+    with offline_market_data(fake, cache_format):
+        frame = md.load_cache_frame(md.fetch_market_data_yf(BENCH_SYMBOL, interval))
+    if len(frame) != rows - 1:
+        failures.append(f"expected {rows - 1} rows after dropping the gap, got {len(frame)}")
+    expected = frame['close'].astype(float).rolling(20).mean().to_numpy()
+    after = slice(gap_row + 20, None)
+    if np.isnan(frame['sma20'].to_numpy(dtype=float)[after]).any():
+        failures.append("sma20 still NaN 20 bars after the gap")
+    elif not np.allclose(frame['sma20'].to_numpy(dtype=float)[19:], expected[19:], rtol=1e-5):
+        failures.append("sma20 differs from pandas' rolling mean")
+    if frame['rsi'].iloc[after].nunique() < 2:
+        failures.append("rsi is constant after the gap")
+    return failures
+
+def check_split_refresh(interval='1d', cache_format='col', rows=GAP_CHECK_ROWS, batch=False):
+    """
+    Regression check: a 2:1 split between two refreshes rescales all adjusted history.
+    The stale cache must not be extended incrementally (old-scale history + new-scale
+    tail); the refresh must fall back to a full download. Returns a list of failures.
+    """
+    fake = FakeYahoo(rows, interval, 'multi')
+    failures = []
+    with offline_market_data(fake, cache_format):
+        cache_file = md.fetch_market_data_yf(BENCH_SYMBOL, interval)
+        # Splitt: hele den justerte historikken halveres, og nye barer publiseres
+        split = fake._frames[BENCH_SYMBOL].copy()
+        split[['Open', 'High', 'Low', 'Close']] /= 2.0
+        split['Volume'] *= 2
+        fake._frames[BENCH_SYMBOL] = split
+        fake.cutoff = rows + fake.extra_bars
+        _make_stale(cache_file)
+        md.get_frame_cache().clear()
+        telemetry.reset()
+        if batch:
+            md.fetch_market_data_batch([BENCH_SYMBOL], interval)
+        else:
+            md.fetch_market_data_yf(BENCH_SYMBOL, interval)
+        counters = telemetry.snapshot()['counters']
+        frame = md.load_cache_frame(cache_file)
+    expected = split['Close'].to_numpy(dtype=np.float64)
+    if counters.get('incremental_refreshes'):
+        failures.append("refresh was applied incrementally across the split")
+    if len(frame) != len(expected):
+        failures.append(f"expected {len(expected)} rows after the refresh, got {len(frame)}")
+    elif not np.allclose(frame['close'].to_numpy(dtype=np.float64), expected, rtol=1e-5):
+        failures.append("cached closes mix pre- and post-split prices")
+    return failures
+
+def check_derived_split_refresh(cache_format='col', rows=DERIVED_CHECK_ROWS, timeframe=DERIVED_CHECK_TIMEFRAME):
+    """
+    Regression check: after a split in the base series, a derived timeframe must be
+    re-derived from the rescaled base, not extended from its old-scale buckets.
+    Compares the refreshed cache with a full derive. Returns a list of failures.
+    """
+    tf = md.get_timeframe(timeframe)
+    fake = FakeYahoo(rows, tf['base'], 'multi')
+    failures = []
+    with offline_market_data(fake, cache_format):
+        cache_file = md.fetch_market_data_yf(BENCH_SYMBOL, timeframe)
+        split = fake._frames[BENCH_SYMBOL].copy()
+        split[['Open', 'High', 'Low', 'Close']] /= 2.0
+        split['Volume'] *= 2
+        fake._frames[BENCH_SYMBOL] = split
+        fake.cutoff = rows + fake.extra_bars
+        base_file = md.get_cache_file_path(BENCH_SYMBOL, tf['base'])
+        _make_stale(base_file)
+        md.get_frame_cache().clear()
+        md.fetch_market_data_yf(BENCH_SYMBOL, timeframe)
+        frame = md.load_cache_frame(cache_file)
+        # Fasit: full avledning fra den oppdaterte basen
+        reference_file = os.path.join(md.DATA_DIR, 'reference_' + os.path.basename(cache_file))
+        md.derive_full(BENCH_SYMBOL, tf, reference_file, base_file, md._file_stamp(base_file))
+        reference = md.load_cache_frame(reference_file)
+    if len(frame) != len(reference):
+        failures.append(f"expected {len(reference)} bars after the refresh, got {len(frame)}")
+    elif not np.allclose(frame['close'].to_numpy(dtype=np.float64),
+                         reference['close'].to_numpy(dtype=np.float64), rtol=1e-5):
+        failures.append("derived closes mix pre- and post-split buckets")
+    return failures
+
+def run_checks():
+    """All correctness checks for each interval and cache format. Returns the failures."""
+    failures = []
+    for interval in DEFAULT_INTERVALS:
+        for cache_format in DEFAULT_FORMATS:
+            failures += [f"interior gap ({interval}, {cache_format}): {failure}"
+                         for failure in check_interior_gap(interval, cache_format)]
+            for batch in (False, True):
+                failures += [f"split refresh ({interval}, {cache_format}{', batch' if batch else ''}): {failure}"
+                             for failure in check_split_refresh(interval, cache_format, batch=batch)]
+    for cache_format in DEFAULT_FORMATS:
+        failures += [f"derived split refresh ({DERIVED_CHECK_TIMEFRAME}, {cache_format}): {failure}"
+                     for failure in check_derived_split_refresh(cache_format)]
+    return failures
+
+
+# --- Sammenligning mot baseline ---
+def compare_to_baseline(results, baseline, tolerance=DEFAULT_TOLERANCE, memory_tolerance=DEFAULT_MEMORY_TOLERANCE):
+    """
+    Compare cases present in both runs. Returns a list of rows
+    (case, metric, baseline, current, ratio, regressed); a metric regressed when it
+    grew by more than the tolerance and by more than the absolute noise floor.
+    """
+    rows = []
+    for case, current in sorted(results['cases'].items()):
+        previous = baseline.get('cases', {}).get(case)
+        if not previous:
+            continue
+        for metric, limit, floor in (('latency_ms', tolerance, MIN_LATENCY_DELTA_MS),
+                                     ('peak_mb', memory_tolerance, MIN_MEMORY_DELTA_MB)):
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            ratio = new / old
+            rows.append((case, metric, old, new, round(ratio, 3), ratio > 1 + limit and new - old > floor))
+    return rows
+
+def format_results(results):
+    lines = [f"{'case':<48} {'latency ms':>11} {'rows/s':>14} {'peak MB':>9}"]
+    for case, result in sorted(results['cases'].items()):
+        peak = result.get('peak_mb')
+        rate = result.get('rows_per_s')
+        lines.append(f"{case:<48} {result['latency_ms']:>11.3f} "
+                     f"{rate if rate is not None else '-':>14} {peak if peak is not None else '-':>9}")
+    return '\n'.join(lines)
+
+def format_comparison(comparison):
+    lines = [f"{'case':<48} {'metric':<10} {'baseline':>10} {'current':>10} {'ratio':>7}"]
+    for case, metric, old, new, ratio, regressed in comparison:
+        flag = '  REGRESSION' if regressed else ''
+        lines.append(f"{case:<48} {metric:<10} {old:>10.3f} {new:>10.3f} {ratio:>7.3f}{flag}")
+    return '\n'.join(lines)
+
+def _parse_list(value, cast=str):
+    return [cast(item.strip()) for item in value.split(',') if item.strip()]
+
+
+# --- Hovedlogikk ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Offline benchmark of the market data fetch/process/cache pipeline.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+        )
+    parser.add_argument('--rows', type=str, default=','.join(str(r) for r in DEFAULT_ROWS), help='Comma-separated row counts (e.g. 10000,100000,1000000).')
+    parser.add_argument('--intervals', type=str, default=','.join(DEFAULT_INTERVALS), help='Comma-separated intervals (1h, 1d).')
+    parser.add_argument('--shapes', type=str, default=','.join(DEFAULT_SHAPES), help="Comma-separated yf.download column shapes ('multi', 'flat').")
+    parser.add_argument('--formats', type=str, default=','.join(DEFAULT_FORMATS), help="Comma-separated cache formats ('col', 'csv').")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='Timed repetitions per case (the median is reported).')
+    parser.add_argument('--batch-symbols', type=int, default=DEFAULT_BATCH_SYMBOLS, help='Symbols in the batch fetch case.')
+    parser.add_argument('--low-memory', action='store_true', help='Benchmark the low-memory processing mode (market_data_yf.LOW_MEMORY).')
+    parser.add_argument('--output', type=str, default=None, help='Write the results JSON to this path.')
+    parser.add_argument('--save-baseline', type=str, default=None, metavar='PATH', help='Store the results as the baseline JSON.')
+    parser.add_argument('--baseline', type=str, default=None, metavar='PATH', help='Compare against this baseline; exit 1 on regressions.')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='Allowed relative latency increase vs. the baseline.')
+    parser.add_argument('--memory-tolerance', type=float, default=DEFAULT_MEMORY_TOLERANCE, help='Allowed relative peak memory increase vs. the baseline.')
+    parser.add_argument('--check', action='store_true', help='Only run the correctness checks (e.g. NaN bars inside a download); exit 1 on failures.')
+    args = parser.parse_args()
+
+    # Pipeline-logging ville dominert målingene
+    telemetry.set_log_level('warning')
+    md.LOW_MEMORY = md.LOW_MEMORY or args.low_memory
+    if args.check:
+        failures = run_checks()
+        for failure in failures:
+            print_error(f"Check failed: {failure}")
+        print(f"{len(failures)} check failure(s).")
+        sys.exit(1 if failures else 0)
+    try:
+        results = run_benchmarks(
+            _parse_list(args.rows, int), _parse_list(args.intervals), _parse_list(args.shapes),
+            _parse_list(args.formats), repeat=max(1, args.repeat), batch_symbols=max(1, args.batch_symbols))
+    except (BenchmarkError, ValueError) as e:
+        print_error(f"Benchmark failed: {e}")
+        sys.exit(2)
+
+    print(format_results(results))
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+            print(f"Results written to {path}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        comparison = compare_to_baseline(results, baseline, args.tolerance, args.memory_tolerance)
+        print()
+        print(format_comparison(comparison))
+        regressions = [row for row in comparison if row[-1]]
+        if regressions:
+            print_error(f"{len(regressions)} benchmark regression(s) against {args.baseline}.")
+            sys.exit(1)
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+Range and cursor queries over cached market data series, for chart display.
+
+- select_range(): rows between start/end (inclusive), the last N rows and/or the
+  rows after a cursor date, at most `limit` rows per page. Column store caches are
+  binary-searched on the date column and only the selected rows are read from the
+  memory map; CSV caches are read whole and masked.
+- downsample(): reduce a selection to about `points` rows. 'ohlc' merges each
+  bucket into one candle, 'minmax' keeps the bars holding each bucket's lowest and
+  highest value, 'lttb' keeps the visually most significant bar per bucket
+  (Largest-Triangle-Three-Buckets).
+- query_range(): both of the above for symbol/timeframe, as metadata plus an
+  iterator of chunks, encoded as JSON records or binary frames (column_store.encode_frame).
+  The serve command 'range' streams these chunks; the CLI writes NDJSON or frames to stdout.
+"""
+
+import sys
+import json
+import base64
+import argparse
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+
+import column_store
+import telemetry
+import market_data_yf as md
+from market_data_yf import print_debug, print_error
+
+# --- Konfigurasjon ---
+DEFAULT_CHUNK_ROWS = 5000
+MAX_CHUNK_ROWS = 100000
+DOWNSAMPLE_METHODS = ('ohlc', 'minmax', 'lttb')
+DEFAULT_DOWNSAMPLE_METHOD = 'ohlc'
+DEFAULT_VALUE_COLUMN = 'close' # Kolonnen minmax/lttb velger barer etter
+OUTPUT_FORMATS = ('json', 'ndjson', 'binary')
+# ---------------------
+
+
+class RangeQueryError(ValueError):
+    """Raised for invalid range query arguments"""
+
+
+@dataclass
+class RangeSelection:
+    """Rows [start:stop] of a cache file picked by select_range (dates are int64 ms, UTC)"""
+    cache_file: str
+    start: int
+    stop: int
+    total_rows: int
+    has_more: bool
+    frame: object = None # CSV: hele filen er allerede lest
+    store: object = None # Kolonnelager: samme åpne fil for utvalget og alle bitene
+
+    @property
+    def rows(self):
+        return self.stop - self.start
+
+    def read(self, start=0, stop=None, columns=None):
+        """Read rows [start:stop] of the selection (positions relative to the selection)"""
+        stop = self.rows if stop is None else min(stop, self.rows)
+        if self.frame is not None:
+            frame = self.frame.iloc[self.start + start:self.start + stop]
+            return (frame[columns] if columns else frame).reset_index(drop=True)
+        with telemetry.timed('range_read'):
+            store = self.store or md.open_column_store(self.cache_file)
+            frame = store.read_frame(self.start + start, self.start + stop, columns)
+        telemetry.increment('range_rows_read', len(frame))
+        return frame
+
+
+# --- Utvalg av rader ---
+def _bound_ms(value, tz, end=False):
+    """
+    A range bound as (int64 ms since epoch, searchsorted side). Naive dates are in the
+    series' timezone; a date-only end ('2024-01-31') includes that whole day.
+    Numbers are taken as epoch milliseconds.
+    """
+    if isinstance(value, (int, float, np.integer)):
+        return int(value), 'right' if end else 'left'
+    ts = pd.Timestamp(value)
+    side = 'right' if end else 'left'
+    if end and isinstance(value, str) and len(value.strip()) <= 10:
+        ts, side = ts + pd.Timedelta(days=1), 'left'
+    if ts.tzinfo is None and tz is not None:
+        ts = ts.tz_localize(tz)
+    if ts.tzinfo is not None:
+        ts = ts.tz_convert('UTC').tz_localize(None)
+    return int(np.datetime64(ts.to_datetime64(), 'ms').astype(np.int64)), side
+
+def _csv_tz(dates):
+    """Timezone (fixed UTC offset) of CSV date text, or None for naive dates"""
+    if dates.empty:
+        return None
+    return pd.Timestamp(str(dates.iloc[0])).tzinfo
+
+def select_range(cache_file, start=None, end=None, last=None, after=None, limit=None):
+    """
+    Select the rows with start <= date <= end, after the cursor date `after`
+    (exclusive), then the last `last` of those, then the first `limit`.
+    has_more is set when `limit` cut rows off (page on with after=<last date>).
+    """
+    if md.is_column_cache(cache_file):
+        store = md.open_column_store(cache_file)
+        dates, tz, frame = store.column(column_store.DATE_COLUMN), store.tz, None
+    else:
+        store, frame = None, md.load_cache_frame(cache_file)
+        dates, tz = md._utc_ms(frame['date']), _csv_tz(frame['date'])
+
+    lo, hi = 0, len(dates)
+    if start is not None:
+        lo = int(np.searchsorted(dates, *_bound_ms(start, tz)))
+    if after is not None:
+        target, _ = _bound_ms(after, tz)
+        lo = max(lo, int(np.searchsorted(dates, target, side='right')))
+    if end is not None:
+        hi = int(np.searchsorted(dates, *_bound_ms(end, tz, end=True)))
+    hi = max(lo, hi)
+    if last:
+        lo = max(lo, hi - int(last))
+    has_more = bool(limit) and hi - lo > int(limit)
+    if has_more:
+        hi = lo + int(limit)
+    return RangeSelection(cache_file, lo, hi, len(dates), has_more, frame, store)
+
+
+# --- Nedsampling ---
+def bucket_edges(n_rows, buckets):
+    """Start row of each of `buckets` equal-count buckets over n_rows rows"""
+    return np.unique(np.linspace(0, n_rows, buckets + 1).astype(np.int64)[:-1])
+
+def ohlc_buckets(frame, points):
+    """One candle per bucket: first date/open, highest high, lowest low, last close, summed volume"""
+    edges = bucket_edges(len(frame), points)
+    last_rows = np.r_[edges[1:], len(frame)] - 1
+    out = {}
+    for name in frame.columns:
+        if name == 'open' or not pd.api.types.is_numeric_dtype(frame[name]):
+            out[name] = frame[name].iloc[edges].reset_index(drop=True) # date, open og symbol: første rad
+            continue
+        values = frame[name].to_numpy()
+        if name == 'high':
+            out[name] = np.fmax.reduceat(values, edges)
+        elif name == 'low':
+            out[name] = np.fmin.reduceat(values, edges)
+        elif name == 'volume':
+            out[name] = np.add.reduceat(np.nan_to_num(values), edges)
+        else:
+            out[name] = values[last_rows] # close og indikatorer: verdien ved bøttens slutt
+    result = pd.DataFrame(out)
+    result.attrs.update(frame.attrs)
+    return result
+
+def minmax_indices(values, points):
+    """Rows of the lowest and highest value in each of points/2 buckets, in row order"""
+    values = np.asarray(values, dtype=np.float64)
+    edges = bucket_edges(len(values), max(1, points // 2))
+    bucket = np.repeat(np.arange(len(edges)), np.diff(np.r_[edges, len(values)]))
+    filled = np.where(np.isnan(values), np.nanmean(values) if len(values) else 0.0, values)
+    picked = []
+    for reducer in (np.minimum, np.maximum):
+        extreme = reducer.reduceat(filled, edges)
+        hits = np.flatnonzero(filled == extreme[bucket])
+        _, first = np.unique(bucket[hits], return_index=True) # Første treff i hver bøtte
+        picked.append(hits[first])
+    return np.unique(np.concatenate(picked))
+
+def lttb_indices(x, y, points):
+    """
+    Largest-Triangle-Three-Buckets: keep the first and last row, and from each of
+    points-2 buckets the row forming the largest triangle with the previously kept
+    row and the average of the next bucket.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if points >= n or n < 3:
+        return np.arange(n)
+    if points < 3:
+        return np.array([0, n - 1])
+    y = np.where(np.isnan(y), np.nanmean(y), y)
+    # Bøtte i dekker radene edges[i]:edges[i+1]; den siste "bøtten" er bare siste rad
+    edges = np.r_[(np.arange(points - 2) * ((n - 2) / (points - 2))).astype(np.int64) + 1, n - 1]
+    sizes = np.diff(np.r_[edges, n])
+    avg_x = np.add.reduceat(x, edges) / sizes # Gjennomsnitt per bøtte uavhengig av valget, så de beregnes samlet
+    avg_y = np.add.reduceat(y, edges) / sizes
+    selected = np.empty(points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        area = np.abs((x[a] - avg_x[i + 1]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y[i + 1] - y[a]))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+@telemetry.timed('downsample')
+def downsample(frame, points, method=DEFAULT_DOWNSAMPLE_METHOD, value_column=DEFAULT_VALUE_COLUMN):
+    """Reduce a date-sorted frame to about `points` rows (unchanged if it is already small enough)"""
+    if method not in DOWNSAMPLE_METHODS:
+        raise RangeQueryError(f"Unknown downsampling method '{method}' (use one of {', '.join(DOWNSAMPLE_METHODS)})")
+    points = int(points)
+    if points <= 0 or len(frame) <= points:
+        return frame
+    if method == 'ohlc':
+        return ohlc_buckets(frame, points)
+    if value_column not in frame.columns:
+        raise RangeQueryError(f"Column '{value_column}' not found for {method} downsampling")
+    if method == 'minmax':
+        rows = minmax_indices(frame[value_column].to_numpy(), points)
+    else:
+        x = md._utc_ms(frame['date']) if 'date' in frame.columns else np.arange(len(frame))
+        rows = lttb_indices(x, frame[value_column].to_numpy(), points)
+    return frame.iloc[rows].reset_index(drop=True)
+
+
+# --- Spørring og koding ---
+def encode_chunk(frame, output_format, date_only=None):
+    """A chunk as JSON records (json/ndjson) or as a binary frame (bytes)"""
+    if output_format == 'binary':
+        symbol = frame.attrs.get('symbol')
+        if symbol is None and 'symbol' in frame.columns and len(frame):
+            symbol = frame['symbol'].iloc[0]
+        data = frame.drop(columns=['symbol'], errors='ignore')
+        return column_store.encode_frame(data, attrs={'symbol': symbol} if symbol else None)
+    if date_only is not None and 'date' in frame.columns and pd.api.types.is_datetime64_any_dtype(frame['date']):
+        frame = frame.assign(date=md.format_dates(frame['date'], date_only))
+    return md.frame_to_records(frame)
+
+def query_range(symbol, timeframe_id='1d', start=None, end=None, last=None, after=None, limit=None,
+                points=None, method=DEFAULT_DOWNSAMPLE_METHOD, columns=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    Run a range query on the (refreshed) cache of symbol/timeframe.
+    Returns (meta, chunks): meta describes the selection (rows, total_rows, first/last
+    date, next_cursor), chunks yields DataFrames of at most chunk_rows rows. Without
+    downsampling each chunk is read from the cache only when it is consumed.
+    """
+    if method not in DOWNSAMPLE_METHODS:
+        raise RangeQueryError(f"Unknown downsampling method '{method}' (use one of {', '.join(DOWNSAMPLE_METHODS)})")
+    chunk_rows = min(max(1, int(chunk_rows or DEFAULT_CHUNK_ROWS)), MAX_CHUNK_ROWS)
+    cache_file = md.fetch_market_data_yf(symbol, timeframe_id)
+    if not cache_file:
+        raise RuntimeError(f"No data available for {symbol} ({timeframe_id})")
+    selection = select_range(cache_file, start, end, last, after, limit)
+    if columns and 'date' not in columns:
+        columns = ['date', *columns]
+
+    date_only, edge_labels = None, [None, None]
+    if selection.rows:
+        edge_dates = pd.concat([selection.read(0, 1, ['date'])['date'],
+                                selection.read(selection.rows - 1, None, ['date'])['date']], ignore_index=True)
+        if pd.api.types.is_datetime64_any_dtype(edge_dates):
+            date_only = md.is_date_only(edge_dates)
+            edge_labels = md.format_dates(edge_dates, date_only)
+        else:
+            edge_labels = edge_dates.astype(str).tolist() # CSV-tekst
+
+    downsampled = None
+    if points and selection.rows > int(points):
+        downsampled = downsample(selection.read(columns=columns), points, method)
+    meta = {
+        'symbol': symbol,
+        'timeframe': timeframe_id,
+        'total_rows': selection.total_rows,
+        'source_rows': selection.rows,
+        'rows': len(downsampled) if downsampled is not None else selection.rows,
+        'first': edge_labels[0],
+        'last': edge_labels[-1],
+        'next_cursor': edge_labels[-1] if selection.has_more else None,
+        'downsampled': method if downsampled is not None else None,
+        'date_only': date_only,
+    }
+    print_debug("Range %s (%s): rows %d-%d of %d, %d returned", symbol, timeframe_id,
+                selection.start, selection.stop, selection.total_rows, meta['rows'])
+
+    def chunks():
+        for offset in range(0, meta['rows'], chunk_rows):
+            if downsampled is not None:
+                yield downsampled.iloc[offset:offset + chunk_rows].reset_index(drop=True)
+            else:
+                yield selection.read(offset, offset + chunk_rows, columns)
+    return meta, chunks()
+
+
+def handle_range_request(request, emit=None):
+    """
+    Serve command 'range'. With stream=true and an emit callback, sends {'meta'} and then
+    one {'seq', 'chunk'} message per chunk through emit and returns a {'done'} summary;
+    otherwise returns meta and all data at once. Binary chunks are base64 in the JSON lines.
+    """
+    symbol = request.get('symbol')
+    if not symbol:
+        raise ValueError("'symbol' is required for the range command")
+    output_format = request.get('format') or 'json'
+    if output_format not in OUTPUT_FORMATS:
+        raise RangeQueryError(f"Unknown format '{output_format}' (use one of {', '.join(OUTPUT_FORMATS)})")
+    columns = request.get('columns')
+    if isinstance(columns, str):
+        columns = [col for col in columns.split(',') if col]
+    meta, chunks = query_range(
+        symbol, request.get('timeframe', '1d'), start=request.get('start'), end=request.get('end'),
+        last=request.get('last'), after=request.get('after'), limit=request.get('limit'),
+        points=request.get('points'), method=request.get('method') or DEFAULT_DOWNSAMPLE_METHOD,
+        columns=columns, chunk_rows=request.get('chunk_rows'))
+
+    if emit is None or not request.get('stream'):
+        if output_format == 'binary':
+            data = b''.join(encode_chunk(chunk, 'binary') for chunk in chunks)
+            return {'meta': meta, 'data': base64.b64encode(data).decode('ascii')}
+        return {'meta': meta, 'data': [record for chunk in chunks for record in encode_chunk(chunk, output_format, meta['date_only'])]}
+    emit({'meta': meta})
+    sent = 0
+    for sent, chunk in enumerate(chunks, start=1):
+        encoded = encode_chunk(chunk, output_format, meta['date_only'])
+        if output_format == 'binary':
+            encoded = base64.b64encode(encoded).decode('ascii')
+        emit({'seq': sent - 1, 'chunk': encoded})
+    return {'done': True, 'chunks': sent}
+
+
+# --- Hovedlogikk for å håndtere argumenter ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Query a date range of a cached series (optionally downsampled) and write it as NDJSON or binary frames.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+        )
+    parser.add_argument('--symbol', type=str, required=True, help='Trading symbol (e.g., AAPL)')
+    parser.add_argument('--timeframe', type=str, default='1d', help='Timeframe ID (e.g., 1h, 1d, 1wk, 1mo)')
+    parser.add_argument('--start', type=str, default=None, help='First date to include (YYYY-MM-DD or ISO 8601).')
+    parser.add_argument('--end', type=str, default=None, help='Last date to include (a date-only end includes the whole day).')
+    parser.add_argument('--last', type=int, default=None, help='Only the last N rows of the range.')
+    parser.add_argument('--after', type=str, default=None, help='Cursor: only rows after this date (the previous next_cursor).')
+    parser.add_argument('--limit', type=int, default=None, help='At most N rows; next_cursor is set when more remain.')
+    parser.add_argument('--points', type=int, default=None, help='Downsample to about N rows.')
+    parser.add_argument('--method', type=str, default=DEFAULT_DOWNSAMPLE_METHOD, choices=DOWNSAMPLE_METHODS, help='Downsampling method.')
+    parser.add_argument('--columns', type=str, default=None, help='Comma-separated columns (default: all cached columns).')
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS, help='Rows per chunk.')
+    parser.add_argument('--format', type=str, default='ndjson', choices=('ndjson', 'binary'), help="'ndjson': a meta line, then one line per row; 'binary': TSRF1 frames.")
+    args = parser.parse_args()
+
+    # Stdout er reservert for resultatet
+    sys.stdout = sys.stderr
+    out = sys.__stdout__
+    try:
+        meta, chunks = query_range(args.symbol, args.timeframe, start=args.start, end=args.end, last=args.last,
+                                   after=args.after, limit=args.limit, points=args.points, method=args.method,
+                                   columns=args.columns.split(',') if args.columns else None, chunk_rows=args.chunk_rows)
+        if args.format == 'binary':
+            for chunk in chunks:
+                out.buffer.write(encode_chunk(chunk, 'binary'))
+            out.buffer.flush()
+        else:
+            out.write(json.dumps({'meta': meta}) + '\n')
+            for chunk in chunks:
+                records = encode_chunk(chunk, 'ndjson', meta['date_only'])
+                out.write(''.join(json.dumps(record, default=str) + '\n' for record in records))
+            out.flush()
+        md.flush_access_stats()
+    except (RangeQueryError, RuntimeError, ValueError, OSError) as e:
+        print_error(f"Range query failed: {e}")
+        sys.exit(1)
@@ -5,15 +5,27 @@
 
 import express from 'express';
 import cors from 'cors';
+import { Readable } from 'stream';
 // V V V V V ENDRE DENNE IMPORTEN V V V V V
 import {
   fetchCompleteMarketData, // Hovedfunksjonen for data med indikatorer
   fetchAvailableSymbols,   // Funksjon for å hente symbolliste
-  fetchAvailableTimeframes // Ny funksjon for å hente tidsrammer
+  fetchAvailableTimeframes, // Ny funksjon for å hente tidsrammer
+  runServerBacktest,        // Backtest i Python-workeren
+  runServerSweep,           // Parameter-sweep i Python-workeren
+  fetchWorkerMetrics,       // Tellere og stegtider fra Python-workeren
+  streamMarketDataRange,    // Datointervall i biter (NDJSON/binært) fra Python-workeren
+  fetchMarketDataRange,     // Datointervall som ett JSON-svar
+  runUniverseScan,          // Screening av siste bar for alle symboler
+  fetchCorrelationMatrix    // Korrelasjon av avkastning mellom symboler
 } from './market_data_service.js'; // <-- Endre filnavnet her til navnet på den nye JS-filen
 
 const app = express();
 const PORT = process.env.PORT || 3001;
+// Når satt (f.eks. http://127.0.0.1:8765) videresendes dataendepunktene til market_data_http.py
+const MARKET_DATA_HTTP_URL = process.env.MARKET_DATA_HTTP_URL || '';
+const PROXIED_DATA_ENDPOINTS = ['/api/market-data', '/api/complete-market-data', '/api/market-data/range', '/api/symbols', '/api/timeframes', '/api/scan', '/api/correlation'];
+const PROXIED_RESPONSE_HEADERS = ['content-type', 'x-total-rows', 'x-rows', 'x-next-cursor', 'x-downsampled', 'x-shared'];
 
 // Enable CORS for all endpoints
 app.use(cors());
@@ -21,6 +33,31 @@ app.use(cors());
 // Parse JSON request body
 app.use(express.json());
 
+// Proxy for dataendepunktene til Python HTTP-tjenesten (strømmer svaret videre uendret)
+async function proxyToMarketDataHttp(req, res) {
+  const target = new URL(req.originalUrl.replace(/^\/api/, ''), MARKET_DATA_HTTP_URL);
+  try {
+    const upstream = await fetch(target, { headers: { accept: req.get('accept') || '*/*' } });
+    res.status(upstream.status);
+    for (const name of PROXIED_RESPONSE_HEADERS) {
+      const value = upstream.headers.get(name);
+      if (value !== null) res.set(name, value);
+    }
+    res.set('Access-Control-Expose-Headers', 'X-Total-Rows, X-Rows, X-Next-Cursor, X-Downsampled, X-Shared');
+    if (!upstream.body) return res.end();
+    Readable.fromWeb(upstream.body)
+      .on('error', (error) => res.destroy(error))
+      .pipe(res);
+  } catch (error) {
+    console.error(`API Error (proxy ${req.path}):`, error.message);
+    res.status(502).json({ error: `Market data HTTP service unavailable: ${error.message}` });
+  }
+}
+
+if (MARKET_DATA_HTTP_URL) {
+  app.get(PROXIED_DATA_ENDPOINTS, proxyToMarketDataHttp);
+}
+
 // API endpoint for market data (bruker nå fetchCompleteMarketData)
 // MERK: Siden Python-scriptet alltid beregner indikatorer,
 // gir denne nå samme resultat som /api/complete-market-data.
@@ -98,6 +135,157 @@ app.get('/api/timeframes', async (req, res) => {
     }
   });
 
+// API endpoint for server-side backtests (body: { strategy, symbol, timeframe, days, compactEquity })
+app.post('/api/backtest', async (req, res) => {
+  try {
+    const { strategy, symbol = 'AAPL', timeframe = '1d', days = null, compactEquity = false } = req.body || {};
+    if (!strategy || typeof strategy !== 'object') {
+      return res.status(400).json({ error: "Missing 'strategy' object in request body." });
+    }
+    const numDays = days === null ? null : parseInt(days, 10);
+    if (numDays !== null && (isNaN(numDays) || numDays <= 1)) {
+      return res.status(400).json({ error: "Invalid 'days' parameter. Must be an integer above 1." });
+    }
+
+    console.log(`Backtest request for ${symbol}, timeframe: ${timeframe}, days: ${numDays ?? 'all'}`);
+    const result = await runServerBacktest(strategy, symbol, timeframe, numDays, Boolean(compactEquity));
+    res.json(result);
+  } catch (error) {
+    console.error('API Error (/api/backtest):', error.message);
+    res.status(500).json({ error: error.message || 'Failed to run backtest' });
+  }
+});
+
+// API endpoint for parameter sweeps (body: { strategy, params, symbol, timeframe, days, rankBy, top })
+app.post('/api/backtest/sweep', async (req, res) => {
+  try {
+    const { strategy, params, symbol = 'AAPL', timeframe = '1d', days = null, rankBy, top, workers } = req.body || {};
+    if (!strategy || typeof strategy !== 'object' || !params || typeof params !== 'object') {
+      return res.status(400).json({ error: "Missing 'strategy' or 'params' object in request body." });
+    }
+
+    console.log(`Sweep request for ${symbol}, timeframe: ${timeframe}, parameters: ${Object.keys(params).join(', ')}`);
+    const result = await runServerSweep(strategy, params, symbol, timeframe, { days, rankBy, top, workers });
+    res.json(result);
+  } catch (error) {
+    console.error('API Error (/api/backtest/sweep):', error.message);
+    res.status(500).json({ error: error.message || 'Failed to run parameter sweep' });
+  }
+});
+
+
+// API endpoint for date ranges of a cached series, optionally downsampled for charts.
+// Query: symbol, timeframe, start, end, last, after (cursor), limit, points, method (ohlc|minmax|lttb),
+// columns, chunk, format (ndjson|binary|json). ndjson/binary are streamed chunk by chunk;
+// the selection is described in X-Total-Rows / X-Rows / X-Next-Cursor headers (json: in 'meta').
+app.get('/api/market-data/range', async (req, res) => {
+  const { symbol = 'AAPL', timeframe = '1d', start, end, after, method, columns, format = 'ndjson' } = req.query;
+  const numbers = {};
+  for (const name of ['last', 'limit', 'points', 'chunk']) {
+    if (req.query[name] === undefined) continue;
+    const value = parseInt(req.query[name], 10);
+    if (isNaN(value) || value <= 0) {
+      return res.status(400).json({ error: `Invalid '${name}' parameter. Must be a positive integer.` });
+    }
+    numbers[name] = value;
+  }
+  if (!['ndjson', 'binary', 'json'].includes(format)) {
+    return res.status(400).json({ error: "Invalid 'format' parameter. Use ndjson, binary or json." });
+  }
+  const query = {
+    start, end, after, method, columns,
+    last: numbers.last, limit: numbers.limit, points: numbers.points, chunkRows: numbers.chunk,
+  };
+
+  console.log(`Range request for ${symbol}, timeframe: ${timeframe}, format: ${format}`);
+  try {
+    if (format === 'json') {
+      return res.json(await fetchMarketDataRange(symbol, timeframe, query));
+    }
+    let closed = false;
+    req.on('close', () => { closed = true; });
+    await streamMarketDataRange(symbol, timeframe, query, format, {
+      onMeta: (meta) => {
+        res.status(200);
+        res.type(format === 'binary' ? 'application/octet-stream' : 'application/x-ndjson');
+        res.set({
+          'X-Total-Rows': String(meta.total_rows),
+          'X-Rows': String(meta.rows),
+          'X-Next-Cursor': meta.next_cursor || '',
+          'X-Downsampled': meta.downsampled || '',
+          'Access-Control-Expose-Headers': 'X-Total-Rows, X-Rows, X-Next-Cursor, X-Downsampled',
+        });
+        res.flushHeaders();
+      },
+      onChunk: (chunk) => {
+        if (closed) return; // Klienten har koblet fra; resten av bitene forkastes
+        res.write(format === 'binary' ? chunk : chunk.map(row => JSON.stringify(row)).join('\n') + '\n');
+      },
+    });
+    res.end();
+  } catch (error) {
+    console.error('API Error (/api/market-data/range):', error.message);
+    if (res.headersSent) {
+      res.destroy(error); // Strømmen er allerede startet; avbryt så klienten ser et ufullstendig svar
+    } else {
+      res.status(500).json({ error: error.message || 'Failed to query market data range' });
+    }
+  }
+});
+
+// API endpoint for universe scans over the latest bar of every cached symbol.
+// Query: query (e.g. "rsi < 30 and close > sma20"), timeframe, symbols, at, sort, desc, top, refresh
+app.get('/api/scan', async (req, res) => {
+  const { query, timeframe = '1d', symbols, at, sort } = req.query;
+  if (!query) {
+    return res.status(400).json({ error: "Missing 'query' parameter (e.g. rsi < 30)." });
+  }
+  const top = req.query.top === undefined ? null : parseInt(req.query.top, 10);
+  if (top !== null && (isNaN(top) || top <= 0)) {
+    return res.status(400).json({ error: "Invalid 'top' parameter. Must be a positive integer." });
+  }
+  try {
+    console.log(`Scan request, timeframe: ${timeframe}, query: ${query}`);
+    const result = await runUniverseScan(query, timeframe, {
+      symbols, at, sort, top, desc: req.query.desc === 'true', refresh: req.query.refresh === 'true',
+    });
+    res.json(result);
+  } catch (error) {
+    console.error('API Error (/api/scan):', error.message);
+    res.status(500).json({ error: error.message || 'Failed to run scan' });
+  }
+});
+
+// API endpoint for the correlation matrix of returns. Query: symbols (default: DEFAULT_SYMBOLS), timeframe, window
+app.get('/api/correlation', async (req, res) => {
+  const { symbols = 'default', timeframe = '1d' } = req.query;
+  const window = req.query.window === undefined ? null : parseInt(req.query.window, 10);
+  if (window !== null && (isNaN(window) || window < 2)) {
+    return res.status(400).json({ error: "Invalid 'window' parameter. Must be an integer >= 2." });
+  }
+  try {
+    console.log(`Correlation request for ${symbols}, timeframe: ${timeframe}`);
+    res.json(await fetchCorrelationMatrix(symbols, timeframe, { window }));
+  } catch (error) {
+    console.error('API Error (/api/correlation):', error.message);
+    res.status(500).json({ error: error.message || 'Failed to compute correlation matrix' });
+  }
+});
+
+// Metrikker fra Python-workeren (JSON, eller ?format=prometheus for skraping)
+app.get('/api/metrics', async (req, res) => {
+  try {
+    const format = req.query.format === 'prometheus' ? 'prometheus' : 'json';
+    const metrics = await fetchWorkerMetrics(format);
+    if (format === 'prometheus') {
+      return res.type('text/plain; version=0.0.4').send(metrics);
+    }
+    res.json(metrics);
+  } catch (error) {
+    console.error('API Error (/api/metrics):', error.message);
+    res.status(500).json({ error: error.message || 'Failed to read metrics' });
+  }
+});
 
 // Health check endpoint (uendret)
 app.get('/api/health', (req, res) => {
@@ -107,10 +295,19 @@ app.get('/api/health', (req, res) => {
 // Start server
 app.listen(PORT, () => {
   console.log(`Server running on port ${PORT}`);
+  if (MARKET_DATA_HTTP_URL) {
+    console.log(`Data endpoints are proxied to the Python HTTP service at ${MARKET_DATA_HTTP_URL}`);
+  }
   console.log(`API Endpoints:`);
   console.log(`  Market Data (Complete): http://localhost:${PORT}/api/complete-market-data?symbol=AAPL&timeframe=1d&days=50`);
   console.log(`  Legacy Market Data:    http://localhost:${PORT}/api/market-data?symbol=MSFT&timeframe=1wk&days=20`);
+  console.log(`  Range (streamed):      http://localhost:${PORT}/api/market-data/range?symbol=AAPL&timeframe=1h&start=2020-01-01&points=1000`);
+  console.log(`  Universe Scan:         http://localhost:${PORT}/api/scan?timeframe=1d&query=rsi%3C30`);
+  console.log(`  Correlation:           http://localhost:${PORT}/api/correlation?timeframe=1d&window=250`);
   console.log(`  Available Symbols:     http://localhost:${PORT}/api/symbols`);
   console.log(`  Available Timeframes:  http://localhost:${PORT}/api/timeframes`);
+  console.log(`  Backtest (POST):       http://localhost:${PORT}/api/backtest`);
+  console.log(`  Sweep (POST):          http://localhost:${PORT}/api/backtest/sweep`);
+  console.log(`  Metrics:               http://localhost:${PORT}/api/metrics`);
   console.log(`  Health Check:          http://localhost:${PORT}/api/health`);
 });
\ No newline at end of file
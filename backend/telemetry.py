@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Logging and metrics for the market data scripts.
+
+- print_debug/print_info/print_warning/print_error: log helpers gated by level.
+  MARKET_DATA_LOG_LEVEL (debug|info|warning|error|off, default info) decides what
+  is written. A disabled level returns before any formatting, and messages take
+  %-style args (print_debug("Shape %s", df.shape)) so nothing is built for it.
+  MARKET_DATA_LOG_FORMAT=json writes one JSON object per line instead of "Py LEVEL: ...".
+- timed(stage): context manager/decorator recording wall time per stage.
+- increment(name, value): counters (cache hits/misses, bytes written, ...).
+- trace(op, **fields): collects stage timings and counters for one request; with
+  MARKET_DATA_METRICS_FILE set, each finished trace is appended there as a JSON line.
+- snapshot()/prometheus_text(): totals since start, for the serve 'metrics' command.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import traceback
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# --- Konfigurasjon ---
+LOG_LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40, 'off': 100}
+DEFAULT_LOG_LEVEL = 'info'
+LOG_FORMAT = os.environ.get('MARKET_DATA_LOG_FORMAT', 'text')
+METRICS_FILE = os.environ.get('MARKET_DATA_METRICS_FILE') or None
+METRICS_PREFIX = 'market_data'
+# ---------------------
+
+DEBUG, INFO, WARNING, ERROR = (LOG_LEVELS[name] for name in ('debug', 'info', 'warning', 'error'))
+_log_level = LOG_LEVELS.get(os.environ.get('MARKET_DATA_LOG_LEVEL', DEFAULT_LOG_LEVEL).lower(), LOG_LEVELS[DEFAULT_LOG_LEVEL])
+
+
+# --- Logging ---
+def set_log_level(level):
+    """Set the minimum level that is written ('debug', 'info', ... or a number)"""
+    global _log_level
+    _log_level = LOG_LEVELS[level.lower()] if isinstance(level, str) else int(level)
+
+def get_log_level():
+    return _log_level
+
+def is_enabled(level):
+    return level >= _log_level
+
+def _write_log(level_name, stream, message, args):
+    if args:
+        message = message % args
+    if LOG_FORMAT == 'json':
+        line = json.dumps({
+            'ts': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+            'level': level_name.lower(),
+            'pid': os.getpid(),
+            'msg': str(message),
+        })
+    else:
+        line = f"Py {level_name}: {message}"
+    print(line, file=stream)
+
+# sys.stdout slås opp ved hvert kall: serve-modus peker den om til stderr
+def print_debug(message, *args):
+    """Helper for DEBUG level prints"""
+    if DEBUG >= _log_level:
+        _write_log('DEBUG', sys.stdout, message, args)
+
+def print_info(message, *args):
+    """Helper for INFO level prints"""
+    if INFO >= _log_level:
+        _write_log('INFO', sys.stdout, message, args)
+
+def print_warning(message, *args):
+    """Helper for WARNING level prints"""
+    # Skriv advarsler til stderr slik at Node.js kan se dem separat hvis ønskelig
+    if WARNING >= _log_level:
+        _write_log('WARNING', sys.stderr, message, args)
+
+def print_error(message, *args, include_traceback=False):
+    """Helper for ERROR level prints"""
+    if ERROR >= _log_level:
+        _write_log('ERROR', sys.stderr, message, args)
+        if include_traceback:
+            traceback.print_exc(file=sys.stderr) # Skriv full traceback til stderr
+
+
+# --- Metrikker ---
+_lock = threading.Lock()
+_local = threading.local()
+_started = time.time()
+_counters = {}
+_stages = {} # stage -> [count, total_seconds, max_seconds]
+
+def increment(name, value=1):
+    """Add value to a counter (also to the current trace, if any)"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+    current = getattr(_local, 'trace', None)
+    if current is not None:
+        current['counters'][name] = current['counters'].get(name, 0) + value
+
+def record_stage(stage, seconds):
+    """Record one timing of a stage"""
+    with _lock:
+        entry = _stages.get(stage)
+        if entry is None:
+            _stages[stage] = [1, seconds, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+    current = getattr(_local, 'trace', None)
+    if current is not None:
+        current['stages'][stage] = current['stages'].get(stage, 0.0) + seconds
+
+@contextmanager
+def timed(stage):
+    """Time the block (or decorated function) as one run of `stage`"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+@contextmanager
+def trace(op, **fields):
+    """
+    Collect the stages and counters of one request in this thread. Nested traces
+    (e.g. a derived timeframe fetching its base) are merged into the outer one.
+    """
+    current = getattr(_local, 'trace', None)
+    if current is not None:
+        yield current
+        return
+    current = {'op': op, **fields, 'stages': {}, 'counters': {}}
+    _local.trace = current
+    start = time.perf_counter()
+    status = 'ok'
+    try:
+        yield current
+    except BaseException:
+        status = 'error'
+        raise
+    finally:
+        _local.trace = None
+        elapsed = time.perf_counter() - start
+        record_stage(f"request.{op}", elapsed)
+        if METRICS_FILE:
+            current.update(status=status, ms=round(elapsed * 1000, 3),
+                           stages={k: round(v * 1000, 3) for k, v in current['stages'].items()})
+            write_metrics_line(current)
+
+def write_metrics_line(record):
+    """Append one JSON line to METRICS_FILE (small O_APPEND writes are not interleaved between processes)"""
+    record = {'ts': datetime.now(timezone.utc).isoformat(timespec='milliseconds'), 'pid': os.getpid(), **record}
+    try:
+        with _lock, open(METRICS_FILE, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, default=str) + '\n')
+    except OSError as e:
+        print_warning("Could not write metrics to %s: %s", METRICS_FILE, e)
+
+def snapshot():
+    """Counters and per-stage timings (ms) since start or the last reset()"""
+    with _lock:
+        stages = {
+            stage: {
+                'count': count,
+                'total_ms': round(total * 1000, 3),
+                'avg_ms': round(total * 1000 / count, 3),
+                'max_ms': round(peak * 1000, 3),
+            }
+            for stage, (count, total, peak) in sorted(_stages.items())
+        }
+        return {'uptime_s': round(time.time() - _started, 1), 'counters': dict(sorted(_counters.items())), 'stages': stages}
+
+def reset():
+    global _started
+    with _lock:
+        _counters.clear()
+        _stages.clear()
+        _started = time.time()
+
+def prometheus_text(data=None, gauges=None):
+    """snapshot() (plus optional {name: value} gauges) in the Prometheus text exposition format"""
+    data = data or snapshot()
+    lines = [f"{METRICS_PREFIX}_uptime_seconds {data['uptime_s']}"]
+    for name, value in (gauges or {}).items():
+        lines.append(f"{METRICS_PREFIX}_{_metric_name(name)} {value}")
+    for name, value in data['counters'].items():
+        lines.append(f"{METRICS_PREFIX}_{_metric_name(name)}_total {value}")
+    for stage, timing in data['stages'].items():
+        label = f'{{stage="{stage}"}}'
+        lines.append(f"{METRICS_PREFIX}_stage_seconds_count{label} {timing['count']}")
+        lines.append(f"{METRICS_PREFIX}_stage_seconds_sum{label} {timing['total_ms'] / 1000:.6f}")
+        lines.append(f"{METRICS_PREFIX}_stage_seconds_max{label} {timing['max_ms'] / 1000:.6f}")
+    return '\n'.join(lines) + '\n'
+
+def _metric_name(name):
+    return ''.join(ch if ch.isalnum() else '_' for ch in name)
@@ -154,6 +154,58 @@ export const fetchCompleteMarketData = async (symbol = 'AAPL', timeframe = '1d',
   }
 };
 
+/**
+ * Fetch a date range of market data, streamed as NDJSON so rows can be drawn as they arrive.
+ * Pass `points` to get the range downsampled on the server (e.g. to the chart width in pixels).
+ *
+ * @param {string} symbol - Trading symbol
+ * @param {string} timeframe - Timeframe ID
+ * @param {Object} query - { start, end, last, after, limit, points, method ('ohlc'|'minmax'|'lttb') }
+ * @param {Function|null} onRows - Optional callback receiving each batch of parsed rows
+ * @returns {Promise<Object>} - { data, totalRows, nextCursor } (nextCursor: pass as `after` for the next page)
+ */
+export const fetchMarketDataRange = async (symbol = 'AAPL', timeframe = '1d', query = {}, onRows = null) => {
+  await ensureApiAvailable(); // Wait for check and throw if unavailable
+
+  const params = new URLSearchParams({ symbol, timeframe, format: 'ndjson' });
+  for (const [key, value] of Object.entries(query)) {
+    if (value !== undefined && value !== null && value !== '') params.set(key, value);
+  }
+  const url = `${API_URL}/market-data/range?${params}`;
+  console.log(`Frontend Service: Fetching market data range from: ${url}`);
+
+  try {
+    const response = await fetch(url);
+    if (!response.ok) {
+      await handleApiResponse(response, `fetchMarketDataRange for ${symbol}`); // Throws with the server's message
+    }
+    const data = [];
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffered = '';
+    for (;;) {
+      const { value, done } = await reader.read();
+      buffered += decoder.decode(value || new Uint8Array(), { stream: !done });
+      const lines = buffered.split('\n');
+      buffered = done ? '' : lines.pop(); // Siste linje kan være ufullstendig
+      const rows = lines.filter(line => line.trim() !== '').map(line => JSON.parse(line));
+      if (rows.length > 0) {
+        for (const row of rows) data.push(row);
+        if (onRows) onRows(rows);
+      }
+      if (done) break;
+    }
+    return {
+      data,
+      totalRows: parseInt(response.headers.get('X-Total-Rows') || '0', 10),
+      nextCursor: response.headers.get('X-Next-Cursor') || null,
+    };
+  } catch (error) {
+    console.error(`Frontend Service: Error in fetchMarketDataRange for ${symbol}:`, error.message);
+    throw error; // Re-throw error
+  }
+};
+
 /**
  * Fetch available symbols/instruments from API.
  *